@@ -10,6 +10,10 @@ OSRM_SERVERS = [
 OSRM_TIMEOUT = 45  # Zwiększony timeout do 45 sekund
 OSRM_MAX_RETRIES = 3  # Zwiększona liczba prób
 OSRM_RETRY_DELAY = 2  # Zwiększone opóźnienie między próbami
+OSRM_MAX_CONNECTIONS = 64  # Maksymalna liczba równoległych połączeń (klient async)
+OSRM_MAX_KEEPALIVE_CONNECTIONS = 32  # Liczba utrzymywanych połączeń w puli
+OSRM_MAX_TABLE_SIZE = 100  # Maksymalny rozmiar fragmentu macierzy w usłudze /table
+OSRM_PROBE_CACHE_TTL = 60  # Czas (s) ważności wyniku sprawdzenia dostępności serwera
 
 # Awaryjne obliczanie odległości (gdy serwery niedostępne)
 USE_DIRECT_DISTANCE_FALLBACK = True  # Pozwala na użycie odległości po linii prostej
@@ -18,17 +22,33 @@ USE_DIRECT_DISTANCE_FALLBACK = True  # Pozwala na użycie odległości po linii
 NOMINATIM_USER_AGENT = "my_route_planner"
 GEOLOCATION_MAX_RETRIES = 5
 GEOLOCATION_DELAY = 2
+GEOLOCATION_MIN_INTERVAL = (
+    1.0  # Minimalny odstęp między zapytaniami (limit Nominatim 1 req/s)
+)
+GEOLOCATION_WORKERS = 4  # Liczba wątków geolokalizacji wsadowej
 
 # Ustawienia TSP
 MAX_DAILY_DISTANCE = 1000
 DEFAULT_THREADS = 4
+TWO_OPT_NEIGHBORS = 20  # Liczba najbliższych sąsiadów sprawdzanych w 2-opt
 
 # Ustawienia cache
 CACHE_FILE = "cached_routes.pkl"
+CACHE_HASH_ALGO = "xxh128"  # Algorytm kluczy cache: xxh128, blake2b lub sha256
 
 # Ustawienia map
 DEFAULT_MAP_FILE = "index.html"
 ROUTES_MAP_FILE = "mapa_wszystkich_tras.html"
+GEOJSON_ROUTES_FILE = "trasy.geojson"  # Trasy wszystkich algorytmów jako GeoJSON
+GEOJSON_MAP_FILE = "mapa_tras_geojson.html"  # Statyczna mapa wczytująca GeoJSON
+MAP_SIMPLIFY_TOLERANCE = 5e-4  # Upraszczanie tras na mapie w stopniach (~50 m)
+
+# Opcje klastrów markerów (Leaflet.markercluster) - od powiększenia 12 markery
+# pokazywane są pojedynczo, a poza widocznym obszarem nie są rysowane
+MARKER_CLUSTER_OPTIONS = {
+    "disableClusteringAtZoom": 12,
+    "removeOutsideVisibleBounds": True,
+}
 
 # Predefiniowane kolory dla każdego algorytmu (10 dni)
 ALGORITHM_COLORS = {
@@ -117,6 +137,8 @@ CACHE_SETTINGS = {
     "matrix_cache_file": "distance_matrix.pkl",
     "tsp_results_dir": "tsp_results",
     "auto_save_frequency": 10,  # Zapis co ile operacji
+    "max_routes_in_memory": 20000,  # Rozmiar bufora LRU tras w pamięci
+    "route_simplify_tolerance": 1e-4,  # Upraszczanie tras w stopniach (~11 m)
     "max_backups": 5,  # Maksymalna liczba kopii zapasowych
     "cache_report_file": "cache_report.json",
     "safety_features": {
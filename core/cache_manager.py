@@ -1,11 +1,511 @@
+import atexit
+import fnmatch
+import functools
+import hashlib
 import json
 import os
 import pickle
+import shutil
+import sqlite3
+import struct
 import tempfile
 import threading
 import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 
+import numpy as np
+import orjson
+
+from config import CACHE_SETTINGS
+
+from .route_utils import uprosc_trase
+
+
+class _LazyMatrixCache(MutableMapping):
+    """
+    Słownik matryc odległości ładujący wpisy z dysku dopiero przy pierwszym
+    odwołaniu. Indeks (klucze i metadane) jest trzymany w pamięci w całości.
+    """
+
+    def __init__(self, index, loader):
+        """
+        Args:
+            index (dict): Metadane wpisów {klucz: metadane}
+            loader (callable): Funkcja ładująca wpis na podstawie klucza
+        """
+        self.index = index
+        self._loader = loader
+        self._loaded = {}
+
+    def __getitem__(self, key):
+        if key not in self._loaded:
+            if key not in self.index:
+                raise KeyError(key)
+            self._loaded[key] = self._loader(key)
+        return self._loaded[key]
+
+    def __setitem__(self, key, entry):
+        self._loaded[key] = entry
+        self.index[key] = {
+            "timestamp": entry.get("timestamp"),
+            "datetime": entry.get("datetime"),
+            "locations_count": len(entry.get("data", {}).get("locations", [])),
+            "fp": entry.get("fp"),
+        }
+
+    def __delitem__(self, key):
+        del self.index[key]
+        self._loaded.pop(key, None)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+
+class _RouteStore:
+    """
+    Cache tras w bazie SQLite z ograniczonym buforem LRU w pamięci.
+
+    Każda trasa zapisywana jest do bazy pojedynczo (write-through), a
+    transakcja zatwierdzana jest przez commit(). Pamięć zajmuje tylko do
+    `max_entries` ostatnio używanych tras.
+
+    Wartość wiersza to nagłówek (typ tablicy punktów, odległość) i surowe
+    bajty tablicy - bez pickle. Wiersze zapisane dawniej przez pickle są
+    nadal odczytywane.
+
+    Odczyty z bazy wykonywane są bez blokady, na osobnym połączeniu każdego
+    wątku (WAL pozwala na równoległych czytelników). Blokada `_mutex`
+    chroni tylko bufor w pamięci i połączenie zapisujące. Trasy zapisane,
+    ale jeszcze niezatwierdzone, trzymane są w `_pending`, bo połączenia
+    czytające ich nie widzą.
+    """
+
+    _KEY_FORMAT = struct.Struct("<4d")
+    _VALUE_HEADER = struct.Struct("<cd")
+    _DTYPES = {b"i": np.int32, b"f": np.float32, b"d": np.float64}
+    _DTYPE_CODES = {np.dtype(dtype): code for code, dtype in _DTYPES.items()}
+    _MMAP_SIZE = 1 << 30
+    _BATCH_SIZE = 500  # Liczba kluczy w jednym zapytaniu IN (...)
+
+    def __init__(self, db_path, max_entries):
+        """
+        Args:
+            db_path (str): Ścieżka do pliku bazy SQLite
+            max_entries (int): Maksymalna liczba tras trzymanych w pamięci
+        """
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self._front = OrderedDict()
+        self._pending = {}
+        self._mutex = threading.Lock()
+        self._local = threading.local()
+        self._readers = []
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # Odczyty stron bazy przez mmap zamiast wywołań read()
+        self._conn.execute(f"PRAGMA mmap_size={self._MMAP_SIZE}")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS routes (key BLOB PRIMARY KEY, value BLOB)"
+        )
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM routes").fetchone()[0]
+
+        # Wczytaj plik bazy do pamięci podręcznej systemu w tle, aby pierwsze
+        # zapytania nie czekały na odczyt z dysku
+        threading.Thread(
+            target=self._prefetch, name="cache-prefetch", daemon=True
+        ).start()
+
+    def _prefetch(self):
+        """
+        Wczytuje plik bazy do pamięci podręcznej systemu plików.
+
+        Na Linuksie wystarcza posix_fadvise(WILLNEED); na innych systemach
+        plik jest czytany sekwencyjnie blokami.
+        """
+        try:
+            with open(self.db_path, "rb") as f:
+                if hasattr(os, "posix_fadvise"):
+                    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+                    return
+                while f.read(1 << 20):
+                    pass
+        except Exception as e:
+            print(f"Nie udało się wstępnie wczytać bazy tras: {str(e)}")
+
+    @classmethod
+    def _pack_value(cls, value):
+        """
+        Koduje trasę (polyline_coords, distance_km) do wartości wiersza.
+
+        Args:
+            value (tuple): Punkty trasy (tablica NumPy lub None) i odległość
+
+        Returns:
+            bytes: Nagłówek i surowe bajty tablicy punktów
+        """
+        polyline_coords, distance_km = value
+        distance_km = float("nan") if distance_km is None else distance_km
+        if polyline_coords is None:
+            return cls._VALUE_HEADER.pack(b"-", distance_km)
+
+        coords = np.ascontiguousarray(polyline_coords)
+        code = cls._DTYPE_CODES.get(coords.dtype)
+        if code is None:
+            coords = coords.astype(np.float64)
+            code = b"d"
+        return cls._VALUE_HEADER.pack(code, distance_km) + coords.tobytes()
+
+    @classmethod
+    def _unpack_value(cls, blob):
+        """
+        Odtwarza trasę z wartości wiersza (bez kopiowania bajtów tablicy).
+
+        Args:
+            blob (bytes): Wartość zapisana przez _pack_value lub pickle
+
+        Returns:
+            tuple: (polyline_coords, distance_km)
+        """
+        # Wiersze ze starszej wersji zapisane przez pickle (opcode PROTO)
+        if blob[:1] == b"\x80":
+            return pickle.loads(blob)
+
+        code, distance_km = cls._VALUE_HEADER.unpack_from(blob)
+        if distance_km != distance_km:
+            distance_km = None
+        if code == b"-":
+            return None, distance_km
+        coords = np.frombuffer(
+            blob, dtype=cls._DTYPES[code], offset=cls._VALUE_HEADER.size
+        ).reshape(-1, 2)
+        return coords, distance_km
+
+    def _reader(self):
+        """
+        Zwraca połączenie do odczytu należące do bieżącego wątku.
+
+        Returns:
+            sqlite3.Connection: Połączenie tylko do odczytu
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute(f"PRAGMA mmap_size={self._MMAP_SIZE}")
+            conn.execute("PRAGMA query_only=ON")
+            self._local.conn = conn
+            with self._mutex:
+                self._readers.append(conn)
+        return conn
+
+    def _cached(self, key):
+        # Wywoływane pod self._mutex
+        if key in self._front:
+            self._front.move_to_end(key)
+            return self._front[key]
+        return self._pending.get(key)
+
+    def _remember(self, key, value):
+        self._front[key] = value
+        self._front.move_to_end(key)
+        if len(self._front) > self.max_entries:
+            self._front.popitem(last=False)
+
+    def get(self, key, default=None):
+        with self._mutex:
+            value = self._cached(key)
+        if value is not None:
+            return value
+
+        row = (
+            self._reader()
+            .execute(
+                "SELECT value FROM routes WHERE key = ?",
+                (self._KEY_FORMAT.pack(*key),),
+            )
+            .fetchall()
+        )
+        if not row:
+            return default
+
+        value = self._unpack_value(row[0][0])
+        with self._mutex:
+            self._remember(key, value)
+        return value
+
+    def get_many(self, keys):
+        """
+        Pobiera wiele tras naraz: z bufora w pamięci, a brakujące z bazy
+        zapytaniami WHERE key IN (...) po _BATCH_SIZE kluczy.
+
+        Args:
+            keys (iterable): Klucze (lat1, lng1, lat2, lng2)
+
+        Returns:
+            dict: {klucz: (polyline_coords, distance_km)} tylko dla kluczy
+                obecnych w cache
+        """
+        found = {}
+        missing = {}
+        with self._mutex:
+            for key in keys:
+                value = self._cached(key)
+                if value is not None:
+                    found[key] = value
+                else:
+                    missing[self._KEY_FORMAT.pack(*key)] = key
+
+        if not missing:
+            return found
+
+        loaded = {}
+        conn = self._reader()
+        blobs = list(missing)
+        for start in range(0, len(blobs), self._BATCH_SIZE):
+            batch = blobs[start : start + self._BATCH_SIZE]
+            rows = conn.execute(
+                "SELECT key, value FROM routes WHERE key IN "
+                f"({','.join('?' * len(batch))})",
+                batch,
+            ).fetchall()
+            for blob, value in rows:
+                loaded[missing[blob]] = self._unpack_value(value)
+
+        with self._mutex:
+            for key, value in loaded.items():
+                self._remember(key, value)
+        found.update(loaded)
+        return found
+
+    def __setitem__(self, key, value):
+        self.update({key: value})
+
+    def update(self, items):
+        """
+        Zapisuje wiele tras jednym wywołaniem executemany.
+
+        Args:
+            items (dict): Trasy {klucz: (polyline_coords, distance_km)}
+        """
+        with self._mutex:
+            rows = []
+            for key, value in items.items():
+                if key not in self._front and not self._contains_db(key):
+                    self._count += 1
+                self._remember(key, value)
+                self._pending[key] = value
+                rows.append((self._KEY_FORMAT.pack(*key), self._pack_value(value)))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO routes (key, value) VALUES (?, ?)", rows
+            )
+
+    def _contains_db(self, key):
+        return (
+            self._conn.execute(
+                "SELECT 1 FROM routes WHERE key = ?", (self._KEY_FORMAT.pack(*key),)
+            ).fetchone()
+            is not None
+        )
+
+    def __contains__(self, key):
+        with self._mutex:
+            return key in self._front or key in self._pending or self._contains_db(key)
+
+    def __len__(self):
+        return self._count
+
+    def commit(self):
+        """
+        Zatwierdza zapisane trasy w bazie.
+        """
+        with self._mutex:
+            self._conn.commit()
+            self._pending.clear()
+
+    def backup(self, target_path):
+        """
+        Tworzy spójną kopię zapasową bazy (API backup SQLite).
+
+        Args:
+            target_path (str): Ścieżka pliku kopii zapasowej
+        """
+        with self._mutex:
+            target = sqlite3.connect(target_path)
+            try:
+                self._conn.backup(target)
+            finally:
+                target.close()
+
+    def close(self):
+        with self._mutex:
+            self._conn.commit()
+            self._conn.close()
+            self._pending.clear()
+            for conn in self._readers:
+                conn.close()
+            self._readers.clear()
+
+
+class _RWLock:
+    """
+    Blokada typu czytelnicy-pisarz: wielu czytelników jednocześnie albo jeden
+    pisarz. Blokada pisarza jest reentrantna (jak RLock), a oczekujący pisarz
+    ma pierwszeństwo przed nowymi czytelnikami.
+
+    Użycie: `with lock:` dla zapisu, `with lock.read():` dla odczytu.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._writer_depth = 0
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        me = threading.get_ident()
+        with self._cond:
+            # Pisarz może czytać pod własną blokadą
+            if self._writer != me:
+                while self._writer is not None or self._waiting_writers:
+                    self._cond.wait()
+            self._readers += 1
+        try:
+            yield self
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+
+    def __enter__(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._writer_depth += 1
+                return self
+
+            self._waiting_writers += 1
+            while self._writer is not None or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = me
+            self._writer_depth = 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with self._cond:
+            self._writer_depth -= 1
+            if self._writer_depth == 0:
+                self._writer = None
+                self._cond.notify_all()
+
+
+def _fingerprint(value, hasher=None):
+    """
+    Oblicza 64-bitowy odcisk (BLAKE2b) zagnieżdżonej struktury danych matrycy.
+    Tablice NumPy są haszowane bezpośrednio z ich bufora.
+
+    Args:
+        value: Dane do zahaszowania (dict, list, tuple, np.ndarray, skalary)
+        hasher: Obiekt hashlib używany przy wywołaniach rekurencyjnych
+
+    Returns:
+        str: Odcisk w postaci szesnastkowej (tylko dla wywołania zewnętrznego)
+    """
+    top_level = hasher is None
+    if top_level:
+        hasher = hashlib.blake2b(digest_size=8)
+
+    if isinstance(value, np.ndarray):
+        hasher.update(f"nd{value.dtype.str}{value.shape}".encode())
+        hasher.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, dict):
+        hasher.update(f"d{len(value)}".encode())
+        try:
+            keys = sorted(value)
+        except TypeError:
+            keys = sorted(value, key=repr)
+        for key in keys:
+            hasher.update(repr(key).encode())
+            _fingerprint(value[key], hasher)
+    elif isinstance(value, (list, tuple)):
+        hasher.update(f"l{len(value)}".encode())
+        for item in value:
+            _fingerprint(item, hasher)
+    else:
+        hasher.update(repr(value).encode())
+
+    if top_level:
+        return hasher.hexdigest()
+    return None
+
+
+# Punkty tras zapisywane są jako int32 w jednostkach 1e-7° (~1,1 cm, jak w OSM)
+_COORD_SCALE = 10_000_000
+
+
+def _encode_coords(polyline_coords):
+    """
+    Kwantyzuje punkty trasy do tablicy int32 (n, 2) w jednostkach 1e-7°.
+
+    Args:
+        polyline_coords (list | np.ndarray | None): Punkty trasy (lat, lng)
+
+    Returns:
+        np.ndarray | None: Tablica int32 lub None jeśli brak trasy
+    """
+    if polyline_coords is None or len(polyline_coords) == 0:
+        return None
+    coords = np.asarray(polyline_coords, dtype=np.float64).reshape(-1, 2)
+    return np.round(coords * _COORD_SCALE).astype(np.int32)
+
+
+def _decode(coords):
+    """
+    Zamienia skwantyzowane punkty trasy z powrotem na stopnie (float64).
+
+    Args:
+        coords (np.ndarray): Tablica int32 z _encode_coords (tablice float
+            zapisane w starszym formacie zwracane są bez zmian)
+
+    Returns:
+        np.ndarray: Punkty trasy (lat, lng) w stopniach
+    """
+    if coords.dtype != np.int32:
+        return coords
+    return coords * (1.0 / _COORD_SCALE)
+
+
+@functools.lru_cache(maxsize=1)
+def _fmt_ts(sec):
+    """
+    Formatuje znacznik czasu z dokładnością do sekundy.
+
+    Przy seryjnych zapisach wiele wpisów trafia w tę samą sekundę, więc
+    strftime wykonywane jest raz na sekundę, a nie dla każdego wpisu.
+
+    Args:
+        sec (int): Czas uniksowy w sekundach
+
+    Returns:
+        str: Data w formacie "%Y-%m-%d %H:%M:%S"
+    """
+    return datetime.fromtimestamp(sec).strftime("%Y-%m-%d %H:%M:%S")
+
 
 class CacheManager:
     """
@@ -25,16 +525,42 @@ class CacheManager:
         Args:
             cache_dir (str): Katalog dla plików cache
             routes_file (str): Nazwa pliku dla cache tras
-            matrix_file (str): Nazwa pliku dla cache matrycy odległości
+            matrix_file (str): Nazwa pliku dla cache matrycy odległości (od nazwy
+                pliku bez rozszerzenia tworzony jest katalog z wpisami matryc)
         """
         self.cache_dir = cache_dir
-        self.routes_file = os.path.join(cache_dir, routes_file)
-        self.matrix_file = os.path.join(cache_dir, matrix_file)
-        self.lock = threading.RLock()  # Reentrant lock dla bezpiecznego dostępu
 
-        # Tworzenie katalogu cache jeśli nie istnieje
-        if not os.path.exists(cache_dir):
-            os.makedirs(cache_dir, exist_ok=True)
+        # Trasy przechowywane są w bazie SQLite (stary plik pickle jest
+        # migrowany przy pierwszym uruchomieniu)
+        self.legacy_routes_file = os.path.join(cache_dir, routes_file)
+        self.routes_file = os.path.splitext(self.legacy_routes_file)[0] + ".sqlite"
+
+        # Każda matryca zapisywana jest osobno w katalogu matryc, a tablice
+        # NumPy jako pliki .npy mapowane do pamięci przy odczycie
+        self.legacy_matrix_file = os.path.join(cache_dir, matrix_file)
+        self.matrix_dir = os.path.join(cache_dir, os.path.splitext(matrix_file)[0])
+        self.matrix_file = os.path.join(self.matrix_dir, "index.json")
+        # Odczyty tras równolegle, zapisy na wyłączność (reentrantnie)
+        self.lock = _RWLock()
+        self._stats_lock = threading.Lock()
+
+        # Tworzenie katalogów cache jeśli nie istnieją
+        os.makedirs(self.matrix_dir, exist_ok=True)
+
+        # Flagi niezapisanych zmian
+        self._routes_dirty = False
+        self._matrix_dirty = False
+        self._pending_matrix_keys = set()
+
+        # Zapis trasy co N dodanych wpisów zamiast po każdym
+        self._pending_writes = 0
+        self._flush_every = CACHE_SETTINGS.get("auto_save_frequency", 10)
+        self._simplify_tolerance = CACHE_SETTINGS.get("route_simplify_tolerance", 0)
+
+        # Kopie zapasowe i ich porządkowanie wykonywane są w tle, poza zapisem
+        self._maintenance = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="cache-bg"
+        )
 
         # Inicjalizacja cache tras
         self.routes_cache = self.load_routes_cache()
@@ -46,76 +572,340 @@ class CacheManager:
         self.hits = 0
         self.misses = 0
 
+        # Zapisz oczekujące zmiany przy zamykaniu aplikacji (atexit wywołuje
+        # funkcje w odwrotnej kolejności - najpierw flush, potem zadania w tle)
+        atexit.register(self._maintenance.shutdown, wait=True)
+        atexit.register(self.flush)
+
     def load_routes_cache(self):
         """
-        Ładuje dane cache tras z pliku.
+        Otwiera bazę cache tras. Trasy wczytywane są do pamięci dopiero przy
+        odwołaniu, a bufor w pamięci ma ograniczony rozmiar (LRU).
 
         Returns:
-            dict: Załadowane dane lub pusty słownik jeśli plik nie istnieje
+            _RouteStore: Cache tras oparty na SQLite
         """
+        max_entries = CACHE_SETTINGS.get("max_routes_in_memory", 20000)
         try:
-            if os.path.exists(self.routes_file):
-                with open(self.routes_file, "rb") as f:
-                    data = pickle.load(f)
-                print(f"Załadowano {len(data)} tras z cache")
-                return data
-            return {}
-        except Exception as e:
+            store = _RouteStore(self.routes_file, max_entries)
+        except sqlite3.DatabaseError as e:
             print(f"Błąd podczas ładowania cache tras: {str(e)}")
-            # Spróbuj załadować kopię zapasową
-            return self._load_backup(self.routes_file)
+            # Spróbuj odtworzyć bazę z kopii zapasowej
+            backup_files = self._find_backups(self.routes_file)
+            if backup_files:
+                print(f"Próba odtworzenia z backupu: {backup_files[-1].path}")
+                shutil.copyfile(backup_files[-1].path, self.routes_file)
+            else:
+                os.remove(self.routes_file)
+            store = _RouteStore(self.routes_file, max_entries)
+
+        # Migracja ze starego formatu (cały cache w jednym pliku pickle)
+        if os.path.exists(self.legacy_routes_file):
+            self._migrate_legacy_routes_cache(store)
+
+        print(f"Załadowano cache tras: {len(store)} tras")
+        return store
+
+    def _migrate_legacy_routes_cache(self, store):
+        """
+        Przenosi trasy ze starego pliku pickle do bazy SQLite.
+
+        Args:
+            store (_RouteStore): Docelowy cache tras
+        """
+        try:
+            with open(self.legacy_routes_file, "rb") as f:
+                data = pickle.load(f)
+        except Exception as e:
+            print(f"Błąd podczas ładowania starego cache tras: {str(e)}")
+            data = self._load_backup(self.legacy_routes_file)
+
+        try:
+            data = self._migrate_routes(data)
+            store.update(data)
+            store.commit()
+
+            today = datetime.now().strftime("%Y%m%d")
+            os.rename(self.legacy_routes_file, f"{self.legacy_routes_file}.{today}.bak")
+            print(f"Zmigrowano {len(data)} tras do bazy {self.routes_file}")
+        except Exception as e:
+            print(f"Błąd podczas migracji cache tras: {str(e)}")
 
     def load_matrix_cache(self):
         """
-        Ładuje cache matrycy odległości z pliku.
+        Ładuje indeks cache matryc odległości. Same matryce są wczytywane
+        leniwie, przy pierwszym odwołaniu do danego klucza.
 
         Returns:
-            dict: Załadowana matryca lub pusty słownik jeśli plik nie istnieje
+            _LazyMatrixCache: Leniwy słownik matryc (pusty jeśli brak indeksu)
         """
+        index = {}
         try:
             if os.path.exists(self.matrix_file):
                 with open(self.matrix_file, "rb") as f:
-                    data = pickle.load(f)
-                print(f"Załadowano cache matrycy odległości z {len(data)} rekordami")
-                return data
-            return {}
+                    index = orjson.loads(f.read())
+                print(
+                    f"Załadowano indeks cache matrycy odległości z {len(index)} rekordami"
+                )
         except Exception as e:
             print(f"Błąd podczas ładowania cache matrycy: {str(e)}")
             # Spróbuj załadować kopię zapasową
-            return self._load_backup(self.matrix_file)
+            index = self._load_backup(
+                self.matrix_file, loader=lambda f: orjson.loads(f.read())
+            )
+
+        matrix_cache = _LazyMatrixCache(index, self._read_matrix_entry)
+
+        # Migracja ze starego formatu (jeden plik pickle ze wszystkimi matrycami)
+        if not index and os.path.exists(self.legacy_matrix_file):
+            self._migrate_legacy_matrix_cache(matrix_cache)
+
+        return matrix_cache
 
-    def _load_backup(self, original_file):
+    def _migrate_legacy_matrix_cache(self, matrix_cache):
+        """
+        Przenosi matryce ze starego pliku pickle do katalogu matryc.
+
+        Args:
+            matrix_cache (_LazyMatrixCache): Docelowy leniwy słownik matryc
+        """
+        try:
+            with open(self.legacy_matrix_file, "rb") as f:
+                legacy = pickle.load(f)
+
+            for matrix_key, entry in legacy.items():
+                matrix_cache[matrix_key] = entry
+                self._pending_matrix_keys.add(matrix_key)
+            self._matrix_dirty = True
+            self.matrix_cache = matrix_cache
+
+            if self.save_matrix_cache():
+                today = datetime.now().strftime("%Y%m%d")
+                os.rename(
+                    self.legacy_matrix_file, f"{self.legacy_matrix_file}.{today}.bak"
+                )
+                print(f"Zmigrowano {len(legacy)} matryc do katalogu {self.matrix_dir}")
+        except Exception as e:
+            print(f"Błąd podczas migracji cache matrycy: {str(e)}")
+
+    def _matrix_entry_path(self, matrix_key, field=None):
+        """
+        Zwraca ścieżkę pliku wpisu matrycy (lub pliku tablicy danego pola).
+        """
+        if field is None:
+            return os.path.join(self.matrix_dir, f"{matrix_key}.pkl")
+        return os.path.join(self.matrix_dir, f"{matrix_key}.{field}.npy")
+
+    def _write_atomic(self, final_path, prefix, write):
+        """
+        Zapisuje plik przez plik tymczasowy i zmianę nazwy.
+
+        Args:
+            final_path (str): Ścieżka docelowa
+            prefix (str): Prefiks pliku tymczasowego
+            write (callable): Funkcja zapisująca do otwartego pliku
+        """
+        with tempfile.NamedTemporaryFile(
+            delete=False, prefix=prefix, dir=os.path.dirname(final_path)
+        ) as tmp_file:
+            tmp_path = tmp_file.name
+            write(tmp_file)
+        os.replace(tmp_path, final_path)
+
+    def _write_matrix_entry(self, matrix_key, entry):
+        """
+        Zapisuje pojedynczą matrycę: tablice NumPy do plików .npy, a resztę
+        danych (bez tablic) do pliku pickle.
+
+        Args:
+            matrix_key (str): Klucz matrycy
+            entry (dict): Wpis matrycy (data, timestamp, datetime)
+        """
+        data = dict(entry["data"])
+        prefix = f"{matrix_key}_tmp_"
+        arrays = {}
+
+        # Pola będące tablicami NumPy zapisujemy bezpośrednio jako .npy
+        for field, value in entry["data"].items():
+            if isinstance(value, np.ndarray):
+                arrays[field] = value
+                data[field] = None
+
+        # Trasy sklejamy w jedną tablicę punktów, zapamiętując zakresy
+        routes = data.get("routes")
+        routes_offsets = None
+        if isinstance(routes, dict):
+            routes_offsets = {}
+            chunks = []
+            offset = 0
+            for route_key, coords in routes.items():
+                if coords is None or len(coords) == 0:
+                    routes_offsets[route_key] = None
+                    continue
+                coords = np.asarray(coords, dtype=np.float32).reshape(-1, 2)
+                chunks.append(coords)
+                routes_offsets[route_key] = (offset, offset + len(coords))
+                offset += len(coords)
+            arrays["routes"] = (
+                np.concatenate(chunks) if chunks else np.empty((0, 2), np.float32)
+            )
+            data["routes"] = None
+
+        for field, array in arrays.items():
+            self._write_atomic(
+                self._matrix_entry_path(matrix_key, field),
+                prefix,
+                lambda f, array=array: np.save(f, array),
+            )
+
+        stored = {
+            "data": data,
+            "arrays": list(arrays),
+            "routes_offsets": routes_offsets,
+            "fp": entry.get("fp"),
+            "timestamp": entry.get("timestamp"),
+            "datetime": entry.get("datetime"),
+        }
+        self._write_atomic(
+            self._matrix_entry_path(matrix_key),
+            prefix,
+            lambda f: pickle.dump(stored, f, protocol=5),
+        )
+
+    def _read_matrix_entry(self, matrix_key):
+        """
+        Wczytuje pojedynczą matrycę z dysku. Tablice są mapowane do pamięci
+        (mmap), więc odczyt następuje dopiero przy dostępie do danych.
+
+        Args:
+            matrix_key (str): Klucz matrycy
+
+        Returns:
+            dict: Wpis matrycy (data, timestamp, datetime)
+        """
+        with open(self._matrix_entry_path(matrix_key), "rb") as f:
+            stored = pickle.load(f)
+
+        data = stored["data"]
+        for field in stored["arrays"]:
+            data[field] = np.load(
+                self._matrix_entry_path(matrix_key, field), mmap_mode="r"
+            )
+
+        # Odtwórz słownik tras jako widoki na wspólną tablicę punktów
+        routes_offsets = stored.get("routes_offsets")
+        if routes_offsets is not None:
+            points = data["routes"]
+            data["routes"] = {
+                route_key: (None if span is None else points[span[0] : span[1]])
+                for route_key, span in routes_offsets.items()
+            }
+
+        return {
+            "data": data,
+            "fp": stored.get("fp"),
+            "timestamp": stored.get("timestamp"),
+            "datetime": stored.get("datetime"),
+        }
+
+    @staticmethod
+    def _route_key(start_lat, start_lng, end_lat, end_lng):
+        """
+        Tworzy kanoniczny klucz cache dla trasy między dwoma punktami.
+
+        Trasa w obu kierunkach jest przechowywana raz - pod kluczem, w którym
+        mniejszy (leksykograficznie) punkt jest pierwszy.
+
+        Returns:
+            tuple: (klucz, czy_odwrocona) - klucz (lat1, lng1, lat2, lng2) oraz
+                informacja, czy żądany kierunek jest odwrotny do zapisanego
+        """
+        if (start_lat, start_lng) <= (end_lat, end_lng):
+            return (start_lat, start_lng, end_lat, end_lng), False
+        return (end_lat, end_lng, start_lat, start_lng), True
+
+    @staticmethod
+    def _as_array(polyline_coords):
+        """
+        Konwertuje punkty trasy do zwartej tablicy NumPy (n, 2) float32.
+
+        Args:
+            polyline_coords (list | np.ndarray | None): Punkty trasy
+
+        Returns:
+            np.ndarray | None: Tablica punktów lub None jeśli brak trasy
+        """
+        if polyline_coords is None or len(polyline_coords) == 0:
+            return None
+        return np.asarray(polyline_coords, dtype=np.float32).reshape(-1, 2)
+
+    def _migrate_routes(self, data):
+        """
+        Przepisuje stary format cache tras: klucze tekstowe "lat,lng|lat,lng"
+        na krotki oraz listy punktów na tablice NumPy.
+
+        Args:
+            data (dict): Dane cache tras załadowane z pliku
+
+        Returns:
+            dict: Dane cache w aktualnym formacie
+        """
+        if not any(
+            isinstance(key, str)
+            or isinstance(value[0], list)
+            or (key[0], key[1]) > (key[2], key[3])
+            for key, value in data.items()
+        ):
+            return data
+
+        migrated = {}
+        for key, (polyline_coords, distance_km) in data.items():
+            if isinstance(key, str):
+                try:
+                    start, end = key.split("|")
+                    key = (*map(float, start.split(",")), *map(float, end.split(",")))
+                except ValueError:
+                    continue
+
+            # Stary format przechowywał oba kierunki - zostawiamy jeden
+            key, is_reversed = self._route_key(*key)
+            if key in migrated:
+                continue
+
+            polyline_coords = _encode_coords(polyline_coords)
+            if is_reversed and polyline_coords is not None:
+                polyline_coords = polyline_coords[::-1].copy()
+            migrated[key] = (polyline_coords, distance_km)
+
+        self._routes_dirty = True
+        print(f"Zmigrowano cache tras do nowego formatu ({len(migrated)} tras)")
+        return migrated
+
+    def _load_backup(self, original_file, loader=pickle.load):
         """
         Próbuje załadować najnowszą kopię zapasową pliku cache.
 
         Args:
             original_file (str): Ścieżka do oryginalnego pliku cache
+            loader (callable): Funkcja odczytująca dane z otwartego pliku
 
         Returns:
             dict: Dane z backupu lub pusty słownik
         """
         try:
-            # Znajdź wszystkie kopie zapasowe pliku
-            base_name = os.path.basename(original_file)
-            backup_files = [
-                f
-                for f in os.listdir(self.cache_dir)
-                if f.startswith(base_name) and f.endswith(".bak")
-            ]
+            # Znajdź wszystkie kopie zapasowe pliku (posortowane od najstarszej)
+            backup_files = self._find_backups(original_file)
 
             # Jeśli są kopie zapasowe, załaduj najnowszą
             if backup_files:
-                # Sortuj według czasu utworzenia (timestamp w nazwie)
-                backup_files.sort(reverse=True)
-                newest_backup = os.path.join(self.cache_dir, backup_files[0])
+                newest_backup = backup_files[-1].path
 
                 print(f"Próba odtworzenia z backupu: {newest_backup}")
                 with open(newest_backup, "rb") as f:
-                    data = pickle.load(f)
+                    data = loader(f)
 
                 # Odtwórz oryginalny plik
-                with open(original_file, "wb") as f:
-                    pickle.dump(data, f)
+                shutil.copyfile(newest_backup, original_file)
 
                 print(f"Pomyślnie odtworzono dane z backupu")
                 return data
@@ -124,6 +914,21 @@ class CacheManager:
 
         return {}
 
+    def flush(self):
+        """
+        Zapisuje wszystkie oczekujące zmiany (trasy i nowe matryce) w jednym
+        przebiegu - matryce trafiają do plików partiami, a indeks matryc
+        zapisywany jest tylko raz.
+
+        Returns:
+            bool: True jeśli wszystkie zapisy się powiodły
+        """
+        with self.lock:
+            routes_saved = self.save_routes_cache()
+            self._pending_writes = 0
+            matrix_saved = self.save_matrix_cache()
+            return routes_saved and matrix_saved
+
     def save_routes_cache(self, force=False):
         """
         Bezpiecznie zapisuje aktualny stan cache tras do pliku.
@@ -135,7 +940,39 @@ class CacheManager:
             bool: True jeśli operacja się powiodła
         """
         with self.lock:
-            return self._safe_save(self.routes_cache, self.routes_file)
+            try:
+                # Trasy są już w bazie - wystarczy zatwierdzić transakcję
+                if not self._routes_dirty and not force:
+                    return True
+                self.routes_cache.commit()
+                self._routes_dirty = False
+
+                # Kopia zapasowa bazy (tylko raz dziennie) tworzona w tle
+                today = datetime.now().strftime("%Y%m%d")
+                backup_file = f"{self.routes_file}.{today}.bak"
+                if not os.path.exists(backup_file):
+                    self._maintenance.submit(self._backup_routes, backup_file)
+
+                print(f"Zapisano zaktualizowane dane do {self.routes_file}")
+                return True
+            except Exception as e:
+                print(f"Błąd podczas zapisu cache tras: {str(e)}")
+                return False
+
+    def _backup_routes(self, backup_file):
+        """
+        Tworzy kopię zapasową bazy tras i usuwa nadmiarowe kopie (zadanie w tle).
+
+        Args:
+            backup_file (str): Ścieżka pliku kopii zapasowej
+        """
+        try:
+            # Kilka zapisów mogło zlecić tę samą kopię - wykonaj ją tylko raz
+            if not os.path.exists(backup_file):
+                self.routes_cache.backup(backup_file)
+            self._cleanup_backups(self.routes_file)
+        except Exception as e:
+            print(f"Błąd podczas tworzenia kopii zapasowej tras: {str(e)}")
 
     def save_matrix_cache(self, force=False):
         """
@@ -148,26 +985,41 @@ class CacheManager:
             bool: True jeśli operacja się powiodła
         """
         with self.lock:
-            return self._safe_save(self.matrix_cache, self.matrix_file)
+            try:
+                # Zapisz nowe matryce do osobnych plików
+                for matrix_key in list(self._pending_matrix_keys):
+                    self._write_matrix_entry(matrix_key, self.matrix_cache[matrix_key])
+                    self._pending_matrix_keys.discard(matrix_key)
+            except Exception as e:
+                print(f"Błąd podczas zapisu matrycy do cache: {str(e)}")
+                return False
 
-    def _safe_save(self, data, file_path):
+            # Indeks matryc zapisujemy jako JSON
+            return self._safe_save(
+                self.matrix_cache.index,
+                self.matrix_file,
+                "_matrix_dirty",
+                force,
+                dump=lambda index, f: f.write(
+                    orjson.dumps(index, option=orjson.OPT_INDENT_2)
+                ),
+            )
+
+    def _safe_save(self, data, file_path, dirty_attr, force=False, dump=None):
         """
         Wykonuje bezpieczny zapis danych do pliku tylko jeśli dane się zmieniły.
+
+        Args:
+            data (dict): Dane do zapisania
+            file_path (str): Ścieżka do pliku docelowego
+            dirty_attr (str): Nazwa atrybutu z flagą niezapisanych zmian
+            force (bool): Czy wymusić zapis nawet jeśli nie ma zmian
+            dump (callable, optional): Funkcja zapisu (dane, plik); domyślnie pickle
         """
         try:
-            # Sprawdź czy plik istnieje i czy dane się zmieniły
-            if os.path.exists(file_path):
-                try:
-                    with open(file_path, "rb") as f:
-                        existing_data = pickle.load(f)
-
-                    # Jeśli dane są takie same, nie zapisuj ponownie
-                    if existing_data == data:
-                        print(f"Dane w {file_path} nie zmieniły się, pomijam zapis")
-                        return True
-                except Exception:
-                    # Jeśli wystąpił błąd odczytu, kontynuuj z zapisem
-                    pass
+            # Jeśli od ostatniego zapisu nic się nie zmieniło, nie zapisuj ponownie
+            if not getattr(self, dirty_attr) and not force:
+                return True
 
             # Utwórz plik tymczasowy w tym samym katalogu
             file_dir = os.path.dirname(file_path)
@@ -180,23 +1032,24 @@ class CacheManager:
                 delete=False, prefix=prefix, suffix=suffix, dir=file_dir
             ) as tmp_file:
                 tmp_path = tmp_file.name
-                pickle.dump(data, tmp_file)
+                if dump is None:
+                    pickle.dump(data, tmp_file, protocol=5)
+                else:
+                    dump(data, tmp_file)
 
             # Utwórz kopię zapasową istniejącego pliku (tylko raz dziennie)
-            backup_file = None
             if os.path.exists(file_path):
                 today = datetime.now().strftime("%Y%m%d")
                 backup_file = f"{file_path}.{today}.bak"
-
-                # Sprawdź czy backup z dzisiaj już istnieje
                 if not os.path.exists(backup_file):
                     os.rename(file_path, backup_file)
-                else:
-                    # Jeśli backup już istnieje, usuń stary plik bez tworzenia kopii
-                    os.remove(file_path)
 
-            # Zmień nazwę pliku tymczasowego na docelową
-            os.rename(tmp_path, file_path)
+            # Podmień plik docelowy atomowo (nadpisuje stary plik, jeśli istnieje)
+            os.replace(tmp_path, file_path)
+            setattr(self, dirty_attr, False)
+
+            # Usuwanie starych kopii zapasowych nie blokuje zapisu
+            self._maintenance.submit(self._cleanup_backups, file_path)
 
             print(f"Zapisano zaktualizowane dane do {file_path}")
             return True
@@ -204,40 +1057,77 @@ class CacheManager:
             print(f"Błąd podczas bezpiecznego zapisu cache: {str(e)}")
             return False
 
-    def _cleanup_backups(self, base_file_path):
+    @staticmethod
+    def _scan_dir(dir_path):
+        """
+        Odczytuje zawartość katalogu jednym wywołaniem os.scandir.
+
+        Args:
+            dir_path (str): Ścieżka katalogu
+
+        Returns:
+            list: Lista obiektów os.DirEntry (pusta jeśli katalog nie istnieje)
+        """
+        try:
+            with os.scandir(dir_path) as it:
+                return list(it)
+        except FileNotFoundError:
+            return []
+
+    def _find_backups(self, base_file_path, entries=None):
+        """
+        Wyszukuje kopie zapasowe pliku.
+
+        Args:
+            base_file_path (str): Podstawowa ścieżka pliku
+            entries (list, optional): Wcześniej odczytana zawartość katalogu
+
+        Returns:
+            list: Kopie zapasowe (os.DirEntry) od najstarszej do najnowszej
+        """
+        if entries is None:
+            entries = self._scan_dir(os.path.dirname(base_file_path))
+        base_name = os.path.basename(base_file_path)
+
+        backups = [
+            entry
+            for entry in entries
+            if entry.name.startswith(base_name) and entry.name.endswith(".bak")
+        ]
+
+        # Sortowanie po czasie modyfikacji (stat z DirEntry jest buforowany);
+        # nazwa rozstrzyga remisy i nie musi zawierać daty
+        backups.sort(key=lambda entry: (entry.stat().st_mtime, entry.name))
+        return backups
+
+    def _cleanup_backups(self, base_file_path, entries=None):
         """
         Ogranicza liczbę kopii zapasowych pliku do 5 najnowszych.
 
         Args:
             base_file_path (str): Podstawowa ścieżka pliku
+            entries (list, optional): Wcześniej odczytana zawartość katalogu
+
+        Returns:
+            int: Liczba usuniętych kopii zapasowych
         """
+        deleted_count = 0
         try:
-            dir_path = os.path.dirname(base_file_path)
-            base_name = os.path.basename(base_file_path)
-
-            # Znajdź wszystkie kopie zapasowe
-            backup_files = [
-                f
-                for f in os.listdir(dir_path)
-                if f.startswith(base_name) and f.endswith(".bak")
-            ]
-
-            # Posortuj wg timestampu (od najstarszych do najnowszych)
-            backup_files.sort()
+            backup_files = self._find_backups(base_file_path, entries)
 
             # Usuń nadmiarowe kopie, zachowując 5 najnowszych
-            if len(backup_files) > 5:
-                for old_file in backup_files[:-5]:
-                    old_path = os.path.join(dir_path, old_file)
-                    try:
-                        os.remove(old_path)
-                        print(f"Usunięto starą kopię zapasową: {old_file}")
-                    except Exception as e:
-                        print(
-                            f"Nie udało się usunąć kopii zapasowej {old_file}: {str(e)}"
-                        )
+            for old_file in backup_files[:-5]:
+                try:
+                    os.remove(old_file.path)
+                    deleted_count += 1
+                    print(f"Usunięto starą kopię zapasową: {old_file.name}")
+                except Exception as e:
+                    print(
+                        f"Nie udało się usunąć kopii zapasowej {old_file.name}: {str(e)}"
+                    )
         except Exception as e:
             print(f"Błąd podczas czyszczenia kopii zapasowych: {str(e)}")
+        return deleted_count
 
     def get_route(self, start_lat, start_lng, end_lat, end_lng):
         """
@@ -252,34 +1142,74 @@ class CacheManager:
         Returns:
             tuple: (polyline_coords, distance_km) lub (None, None) jeśli nie ma w cache
         """
-        with self.lock:
-            cache_key = f"{start_lat},{start_lng}|{end_lat},{end_lng}"
-            reverse_key = f"{end_lat},{end_lng}|{start_lat},{start_lng}"
+        cache_key, is_reversed = self._route_key(start_lat, start_lng, end_lat, end_lng)
 
-            # Sprawdzenie w cache
-            if cache_key in self.routes_cache:
+        # Odczyt nie modyfikuje cache, więc wiele wątków może czytać
+        # jednocześnie - _RouteStore czyta z bazy bez wspólnej blokady
+        with self.lock.read():
+            entry = self.routes_cache.get(cache_key)
+
+        with self._stats_lock:
+            if entry is None:
+                self.misses += 1
+            else:
                 self.hits += 1
-                return self.routes_cache[cache_key]
-            elif reverse_key in self.routes_cache:
-                # Jeśli mamy trasę w przeciwną stronę, możemy ją odwrócić
-                polyline_coords, distance_km = self.routes_cache[reverse_key]
-                if polyline_coords:
-                    # Odwracamy współrzędne dla przeciwnego kierunku
-                    reversed_coords = polyline_coords[::-1]
-                    # Zapisujemy do cache dla przyszłych zapytań
-                    self.routes_cache[cache_key] = (reversed_coords, distance_km)
-                    self.hits += 1
-                    return reversed_coords, distance_km
-                else:
-                    # Jeśli to tylko odległość bez współrzędnych trasy
-                    self.routes_cache[cache_key] = (None, distance_km)
-                    self.hits += 1
-                    return None, distance_km
 
-            # Brak w cache
-            self.misses += 1
+        # Brak w cache
+        if entry is None:
             return None, None
 
+        polyline_coords, distance_km = entry
+        if polyline_coords is not None:
+            polyline_coords = _decode(polyline_coords)
+            if is_reversed:
+                # Trasa zapisana w przeciwną stronę - widok odwrócony (bez kopii)
+                polyline_coords = polyline_coords[::-1]
+        return polyline_coords, distance_km
+
+    def get_routes(self, pairs):
+        """
+        Pobiera z cache trasy dla wielu par punktów jednym wywołaniem.
+
+        Odpowiednik get_route dla całej listy par - trasy spoza bufora w
+        pamięci odczytywane są z bazy partiami zamiast zapytaniem na parę.
+
+        Args:
+            pairs (list): Lista krotek (start_lat, start_lng, end_lat, end_lng)
+
+        Returns:
+            dict: {para: (polyline_coords, distance_km)}; (None, None) dla par,
+                których nie ma w cache
+        """
+        keys = {pair: self._route_key(*pair) for pair in pairs}
+
+        with self.lock.read():
+            entries = self.routes_cache.get_many(
+                {cache_key for cache_key, _ in keys.values()}
+            )
+
+        results = {}
+        hits = 0
+        for pair, (cache_key, is_reversed) in keys.items():
+            entry = entries.get(cache_key)
+            if entry is None:
+                results[pair] = (None, None)
+                continue
+
+            hits += 1
+            polyline_coords, distance_km = entry
+            if polyline_coords is not None:
+                polyline_coords = _decode(polyline_coords)
+                if is_reversed:
+                    polyline_coords = polyline_coords[::-1]
+            results[pair] = (polyline_coords, distance_km)
+
+        with self._stats_lock:
+            self.hits += hits
+            self.misses += len(keys) - hits
+
+        return results
+
     def add_route(
         self,
         start_lat,
@@ -298,31 +1228,38 @@ class CacheManager:
             start_lng (float): Długość geograficzna punktu początkowego
             end_lat (float): Szerokość geograficzna punktu końcowego
             end_lng (float): Długość geograficzna punktu końcowego
-            polyline_coords (list): Lista punktów trasy
+            polyline_coords (list | np.ndarray): Lista punktów trasy
             distance_km (float): Odległość w kilometrach
-            auto_save (bool): Czy automatycznie zapisać cache po dodaniu
+            auto_save (bool): Czy automatycznie zapisywać cache (co auto_save_frequency tras)
 
         Returns:
             bool: True jeśli operacja się powiodła
         """
         with self.lock:
             try:
-                cache_key = f"{start_lat},{start_lng}|{end_lat},{end_lng}"
-                reverse_key = f"{end_lat},{end_lng}|{start_lat},{start_lng}"
+                cache_key, is_reversed = self._route_key(
+                    start_lat, start_lng, end_lat, end_lng
+                )
 
-                # Zapisz trasę w obu kierunkach
-                self.routes_cache[cache_key] = (polyline_coords, distance_km)
+                # Punkty trasy upraszczamy raz, przy dodaniu do cache (a nie
+                # przy każdym rysowaniu mapy) i przechowujemy jako
+                # skwantyzowaną tablicę int32
+                polyline_coords = _encode_coords(
+                    uprosc_trase(polyline_coords, self._simplify_tolerance)
+                )
 
-                # Dla trasy w przeciwnym kierunku odwracamy punkty
-                if polyline_coords:
-                    reversed_coords = polyline_coords[::-1]
-                    self.routes_cache[reverse_key] = (reversed_coords, distance_km)
-                else:
-                    self.routes_cache[reverse_key] = (None, distance_km)
+                # Trasa zapisywana raz, w kierunku klucza kanonicznego
+                if is_reversed and polyline_coords is not None:
+                    polyline_coords = polyline_coords[::-1].copy()
+                self.routes_cache[cache_key] = (polyline_coords, distance_km)
+                self._routes_dirty = True
 
-                # Automatycznie zapisz jeśli potrzeba
+                # Automatycznie zapisz co określoną liczbę dodanych tras
                 if auto_save:
-                    self.save_routes_cache()
+                    self._pending_writes += 1
+                    if self._pending_writes >= self._flush_every:
+                        self.save_routes_cache()
+                        self._pending_writes = 0
 
                 return True
             except Exception as e:
@@ -345,25 +1282,42 @@ class CacheManager:
     def add_matrix_entry(self, matrix_key, matrix_data, auto_save=True):
         """
         Dodaje wpis matrycy odległości do cache tylko jeśli jest nowy.
+
+        Zmiany wykrywane są przez porównanie odcisku danych z odciskiem
+        zapisanym w indeksie, bez wczytywania istniejącej matrycy z dysku.
         """
         with self.lock:
             try:
+                # Trasy w tej samej postaci, w jakiej są odczytywane z dysku
+                if isinstance(matrix_data.get("routes"), dict):
+                    matrix_data = dict(
+                        matrix_data,
+                        routes={
+                            route_key: self._as_array(coords)
+                            for route_key, coords in matrix_data["routes"].items()
+                        },
+                    )
+                fingerprint = _fingerprint(matrix_data)
+
                 # Sprawdź czy matryca już istnieje
                 if matrix_key in self.matrix_cache:
-                    existing_data = self.matrix_cache[matrix_key].get("data")
-                    if existing_data == matrix_data:
+                    if self.matrix_cache.index[matrix_key].get("fp") == fingerprint:
                         print(
                             f"Matryca już istnieje w cache (klucz: {matrix_key[:8]}...)"
                         )
                         return True
 
                 # Zapisz z timestampem dla śledzenia aktualizacji
+                now = time.time()
                 entry = {
                     "data": matrix_data,
-                    "timestamp": time.time(),
-                    "datetime": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    "fp": fingerprint,
+                    "timestamp": now,
+                    "datetime": _fmt_ts(int(now)),
                 }
                 self.matrix_cache[matrix_key] = entry
+                self._pending_matrix_keys.add(matrix_key)
+                self._matrix_dirty = True
 
                 # Automatycznie zapisz jeśli potrzeba
                 if auto_save:
@@ -407,9 +1361,10 @@ class CacheManager:
             str: Ścieżka do zapisanego pliku
         """
         with self.lock:
+            now = time.time()
             report = {
-                "timestamp": time.time(),
-                "datetime": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "timestamp": now,
+                "datetime": _fmt_ts(int(now)),
                 "stats": self.get_cache_stats(),
                 "files": {
                     "routes_cache": {
@@ -422,11 +1377,10 @@ class CacheManager:
                         "entries": len(self.routes_cache),
                     },
                     "matrix_cache": {
-                        "path": self.matrix_file,
-                        "size_bytes": (
-                            os.path.getsize(self.matrix_file)
-                            if os.path.exists(self.matrix_file)
-                            else 0
+                        "path": self.matrix_dir,
+                        "size_bytes": sum(
+                            os.path.getsize(os.path.join(self.matrix_dir, file))
+                            for file in os.listdir(self.matrix_dir)
                         ),
                         "entries": len(self.matrix_cache),
                     },
@@ -436,8 +1390,13 @@ class CacheManager:
 
             # Zapisz raport do pliku
             report_path = os.path.join(self.cache_dir, output_file)
-            with open(report_path, "w", encoding="utf-8") as f:
-                json.dump(report, f, indent=4, ensure_ascii=False)
+            with open(report_path, "wb") as f:
+                f.write(
+                    orjson.dumps(
+                        report,
+                        option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY,
+                    )
+                )
 
             return report_path
 
@@ -451,29 +1410,18 @@ class CacheManager:
         backups = {"routes": [], "matrix": []}
 
         try:
-            # Znajdź backupy dla tras
-            routes_base = os.path.basename(self.routes_file)
-            for file in os.listdir(self.cache_dir):
-                if file.startswith(routes_base) and file.endswith(".bak"):
-                    file_path = os.path.join(self.cache_dir, file)
-                    backups["routes"].append(
+            # Jeden odczyt katalogu na każdy rodzaj backupu
+            for backup_type, base_file in (
+                ("routes", self.routes_file),
+                ("matrix", self.matrix_file),
+            ):
+                for entry in self._find_backups(base_file):
+                    stat = entry.stat()
+                    backups[backup_type].append(
                         {
-                            "filename": file,
-                            "size_bytes": os.path.getsize(file_path),
-                            "timestamp": os.path.getmtime(file_path),
-                        }
-                    )
-
-            # Znajdź backupy dla matrycy
-            matrix_base = os.path.basename(self.matrix_file)
-            for file in os.listdir(self.cache_dir):
-                if file.startswith(matrix_base) and file.endswith(".bak"):
-                    file_path = os.path.join(self.cache_dir, file)
-                    backups["matrix"].append(
-                        {
-                            "filename": file,
-                            "size_bytes": os.path.getsize(file_path),
-                            "timestamp": os.path.getmtime(file_path),
+                            "filename": entry.name,
+                            "size_bytes": stat.st_size,
+                            "timestamp": stat.st_mtime,
                         }
                     )
 
@@ -510,18 +1458,21 @@ class CacheManager:
                 print(f"Plik JSON {json_file_path} nie istnieje.")
                 return False
 
-            with open(json_file_path, "r", encoding="utf-8") as f:
-                locations = json.load(f)
-
-            # Sprawdź czy wszystkie lokalizacje mają współrzędne
-            locations_with_coords = [
-                loc
-                for loc in locations
-                if "latitude" in loc
-                and "longitude" in loc
-                and loc["latitude"] is not None
-                and loc["longitude"] is not None
-            ]
+            with open(json_file_path, "rb") as f:
+                raw = f.read()
+            try:
+                locations = orjson.loads(raw)
+            except orjson.JSONDecodeError:
+                # Plik może zawierać wartości NaN, których orjson nie akceptuje
+                locations = json.loads(raw)
+
+            # Sprawdź ile lokalizacji ma współrzędne (None i NaN jako brak)
+            coords = np.array(
+                [(loc.get("latitude"), loc.get("longitude")) for loc in locations],
+                dtype=[("lat", "f8"), ("lon", "f8")],
+            )
+            mask = ~(np.isnan(coords["lat"]) | np.isnan(coords["lon"]))
+            n_valid = int(mask.sum())
 
             # Jeśli cache istnieje, sprawdź jego zawartość
             if routes_exists:
@@ -529,9 +1480,8 @@ class CacheManager:
                 routes_count = len(self.routes_cache)
 
                 # Oczekiwana minimalna liczba tras w cache
-                expected_min_routes = len(locations_with_coords) * (
-                    len(locations_with_coords) - 1
-                )
+                # Każda para punktów jest przechowywana raz (bez kierunku)
+                expected_min_routes = n_valid * (n_valid - 1) // 2
 
                 if (
                     routes_count < expected_min_routes / 4 or routes_size < 1024
@@ -543,12 +1493,12 @@ class CacheManager:
 
             # Sprawdź integralność matrycy
             if matrix_exists and self.matrix_cache:
-                # Sprawdź czy matryca zawiera wszystkie lokalizacje
-                for entry in self.matrix_cache.values():
-                    if "data" in entry and "locations" in entry["data"]:
-                        cache_locations = entry["data"]["locations"]
+                # Sprawdź czy matryca zawiera wszystkie lokalizacje (na podstawie
+                # indeksu, bez wczytywania samych matryc)
+                for meta in self.matrix_cache.index.values():
+                    if "locations_count" in meta:
                         if (
-                            len(cache_locations) == len(locations_with_coords) + 1
+                            meta["locations_count"] == n_valid + 1
                         ):  # +1 dla lokalizacji startowej
                             print(
                                 "Matryca odległości zawiera prawidłową liczbę lokalizacji."
@@ -570,62 +1520,88 @@ class CacheManager:
         Returns:
             int: Liczba usuniętych plików
         """
-        import glob
-
         try:
             deleted_count = 0
 
+            # Jeden odczyt każdego katalogu cache, dalej filtrujemy w pamięci
+            cache_entries = self._scan_dir(self.cache_dir)
+            matrix_entries = self._scan_dir(self.matrix_dir)
+
             # Znajdź wszystkie pliki tymczasowe
-            temp_files = glob.glob(os.path.join(self.cache_dir, "*_tmp_*"))
+            temp_files = [
+                entry
+                for entry in cache_entries + matrix_entries
+                if fnmatch.fnmatch(entry.name, "*_tmp_*")
+            ]
             for tmp_file in temp_files:
                 try:
-                    os.remove(tmp_file)
+                    os.remove(tmp_file.path)
                     deleted_count += 1
-                    print(f"Usunięto plik tymczasowy: {os.path.basename(tmp_file)}")
+                    print(f"Usunięto plik tymczasowy: {tmp_file.name}")
                 except Exception as e:
                     print(
-                        f"Nie udało się usunąć pliku tymczasowego {tmp_file}: {str(e)}"
+                        f"Nie udało się usunąć pliku tymczasowego {tmp_file.path}: {str(e)}"
                     )
 
             # Ogranicz liczbę kopii zapasowych dla każdego pliku podstawowego
-            for base_file in [self.routes_file, self.matrix_file]:
-                self._cleanup_backups(base_file)
+            deleted_count += self._cleanup_backups(self.routes_file, cache_entries)
+            deleted_count += self._cleanup_backups(
+                self.legacy_routes_file, cache_entries
+            )
+            deleted_count += self._cleanup_backups(
+                self.legacy_matrix_file, cache_entries
+            )
+            deleted_count += self._cleanup_backups(self.matrix_file, matrix_entries)
 
             # Usuń stare pliki raportów, pozostawiając 3 najnowsze
-            report_files = glob.glob(os.path.join(self.cache_dir, "cache_report*.json"))
-            if len(report_files) > 3:
-                # Sortuj według daty modyfikacji (od najstarszych)
-                report_files.sort(key=os.path.getmtime)
-
-                # Usuń nadmiarowe pliki
-                for old_report in report_files[:-3]:
-                    try:
-                        os.remove(old_report)
-                        deleted_count += 1
-                        print(f"Usunięto stary raport: {os.path.basename(old_report)}")
-                    except Exception as e:
-                        print(f"Nie udało się usunąć raportu {old_report}: {str(e)}")
-
-            # Usuń stare pliki wyników TSP, zachowując 5 najnowszych
-            tsp_files = glob.glob(os.path.join(self.cache_dir, "tsp_results_*.json"))
-            if len(tsp_files) > 5:
-                # Sortuj według daty modyfikacji
-                tsp_files.sort(key=os.path.getmtime)
-
-                # Usuń nadmiarowe pliki
-                for old_tsp in tsp_files[:-5]:
-                    try:
-                        os.remove(old_tsp)
-                        deleted_count += 1
-                        print(f"Usunięto stary wynik TSP: {os.path.basename(old_tsp)}")
-                    except Exception as e:
-                        print(f"Nie udało się usunąć wyniku TSP {old_tsp}: {str(e)}")
+            deleted_count += self._remove_oldest(
+                cache_entries, "cache_report*.json", 3, "raport"
+            )
+
+            # Usuń stare wyniki TSP (pickle i kopie JSON), zachowując 5 najnowszych
+            deleted_count += self._remove_oldest(
+                cache_entries, "tsp_results_*.pkl", 5, "wynik TSP"
+            )
+            deleted_count += self._remove_oldest(
+                cache_entries, "tsp_results_*.json", 5, "wynik TSP"
+            )
 
             return deleted_count
         except Exception as e:
             print(f"Błąd podczas czyszczenia katalogu cache: {str(e)}")
             return 0
 
+    @staticmethod
+    def _remove_oldest(entries, pattern, keep, label):
+        """
+        Usuwa najstarsze pliki pasujące do wzorca, zachowując `keep` najnowszych.
+
+        Args:
+            entries (list): Zawartość katalogu (os.DirEntry)
+            pattern (str): Wzorzec nazwy pliku (fnmatch)
+            keep (int): Liczba najnowszych plików do zachowania
+            label (str): Opis rodzaju pliku w komunikatach
+
+        Returns:
+            int: Liczba usuniętych plików
+        """
+        matching = [entry for entry in entries if fnmatch.fnmatch(entry.name, pattern)]
+        if len(matching) <= keep:
+            return 0
+
+        # Sortuj według daty modyfikacji (od najstarszych)
+        matching.sort(key=lambda entry: entry.stat().st_mtime)
+
+        deleted_count = 0
+        for old_file in matching[:-keep]:
+            try:
+                os.remove(old_file.path)
+                deleted_count += 1
+                print(f"Usunięto stary {label}: {old_file.name}")
+            except Exception as e:
+                print(f"Nie udało się usunąć pliku {old_file.path}: {str(e)}")
+        return deleted_count
+
     def print_cache_stats(self):
         """
         Wyświetla szczegółowe statystyki cache.
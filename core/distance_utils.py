@@ -1,17 +1,106 @@
+from math import asin, cos, radians, sin, sqrt
+
+import numpy as np
 from geopy.distance import geodesic
+from numba import njit, prange
+
+# Średni promień Ziemi w kilometrach (IUGG)
+PROMIEN_ZIEMI_KM = 6371.0088
 
 
-def oblicz_odleglosc(lat1, lon1, lat2, lon2):
+def oblicz_odleglosc(lat1, lon1, lat2, lon2, precise=False):
     """
     Oblicza odległość między dwoma punktami na powierzchni Ziemi.
 
+    Domyślnie używa wzoru haversine (kula o średnim promieniu Ziemi),
+    który jest wielokrotnie szybszy od geodezyjnej metody z geopy.
+
     Args:
         lat1 (float): Szerokość geograficzna pierwszego punktu
         lon1 (float): Długość geograficzna pierwszego punktu
         lat2 (float): Szerokość geograficzna drugiego punktu
         lon2 (float): Długość geograficzna drugiego punktu
+        precise (bool): Czy użyć dokładnej odległości geodezyjnej (geopy)
 
     Returns:
         float: Odległość w kilometrach
     """
-    return geodesic((lat1, lon1), (lat2, lon2)).kilometers
+    if precise:
+        return geodesic((lat1, lon1), (lat2, lon2)).kilometers
+
+    lat1, lon1, lat2, lon2 = map(radians, (lat1, lon1, lat2, lon2))
+    a = (
+        sin((lat2 - lat1) / 2) ** 2
+        + cos(lat1) * cos(lat2) * sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * PROMIEN_ZIEMI_KM * asin(sqrt(a))
+
+
+def oblicz_odleglosc_pary(lats1, lons1, lats2, lons2):
+    """
+    Oblicza odległości haversine dla par punktów (element po elemencie).
+
+    Args:
+        lats1 (array-like): Szerokości geograficzne punktów początkowych
+        lons1 (array-like): Długości geograficzne punktów początkowych
+        lats2 (array-like): Szerokości geograficzne punktów końcowych
+        lons2 (array-like): Długości geograficzne punktów końcowych
+
+    Returns:
+        np.ndarray: Odległości w kilometrach
+    """
+    lats1, lons1, lats2, lons2 = (
+        np.radians(np.asarray(values, dtype=np.float64))
+        for values in (lats1, lons1, lats2, lons2)
+    )
+    a = (
+        np.sin((lats2 - lats1) / 2) ** 2
+        + np.cos(lats1) * np.cos(lats2) * np.sin((lons2 - lons1) / 2) ** 2
+    )
+    return 2 * PROMIEN_ZIEMI_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+@njit(parallel=True, fastmath=True, cache=True, boundscheck=False)
+def _haversine_matrix_nb(lats, lons, out):
+    """
+    Wypełnia bufor out odległościami haversine (współrzędne w radianach).
+
+    Args:
+        lats (np.ndarray): Szerokości geograficzne w radianach
+        lons (np.ndarray): Długości geograficzne w radianach
+        out (np.ndarray): Prealokowana macierz NxN na wynik
+    """
+    n = lats.shape[0]
+    for i in prange(n):
+        lat_i = lats[i]
+        cos_lat_i = cos(lat_i)
+        out[i, i] = 0.0
+        for j in range(i + 1, n):
+            dlat = lats[j] - lat_i
+            dlon = lons[j] - lons[i]
+            a = sin(dlat * 0.5) ** 2 + cos_lat_i * cos(lats[j]) * sin(dlon * 0.5) ** 2
+            d = 2.0 * PROMIEN_ZIEMI_KM * asin(sqrt(min(a, 1.0)))
+            out[i, j] = d
+            out[j, i] = d
+
+
+def oblicz_odleglosc_matrix(lats, lons, out=None):
+    """
+    Oblicza macierz odległości haversine między wszystkimi parami punktów.
+
+    Args:
+        lats (array-like): Szerokości geograficzne punktów
+        lons (array-like): Długości geograficzne punktów
+        out (np.ndarray, optional): Bufor NxN (float64) na wynik
+
+    Returns:
+        np.ndarray: Macierz NxN odległości w kilometrach
+    """
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    lons = np.radians(np.asarray(lons, dtype=np.float64))
+
+    if out is None:
+        out = np.empty((lats.shape[0], lats.shape[0]), dtype=np.float64)
+
+    _haversine_matrix_nb(lats, lons, out)
+    return out
@@ -1,6 +1,55 @@
+import functools
+
 import folium
+import numpy as np
+from folium.plugins import FastMarkerCluster
+
+from ..config import DAY_COLORS, LINE_STYLES, MARKER_CLUSTER_OPTIONS
+
+# Markery budowane po stronie przeglądarki z wierszy [lat, lng, popup, tooltip]
+MARKER_CALLBACK = """
+function (row) {
+    var marker = L.marker(new L.LatLng(row[0], row[1]));
+    marker.bindPopup(row[2]);
+    marker.bindTooltip(row[3]);
+    return marker;
+};
+"""
 
-from ..config import DAY_COLORS, LINE_STYLES
+
+@functools.lru_cache(maxsize=64)
+def generuj_kolory_dla_dni(num_days):
+    """
+    Generuje unikalne kolory dla każdego dnia.
+
+    Odcienie rozłożone są równomiernie na kole barw, a cała paleta liczona
+    jest wektorowo (HSV -> RGB) i zapamiętywana dla danej liczby dni.
+
+    Args:
+        num_days (int): Liczba dni
+
+    Returns:
+        tuple: Kolory w formacie "#rrggbb"
+    """
+    s = DAY_COLORS["saturation"]
+    v = DAY_COLORS["value"]
+
+    h = np.arange(num_days) / num_days if num_days else np.empty(0)
+    sector = np.floor(h * 6.0)
+    f = h * 6.0 - sector
+    sector = sector.astype(np.int64) % 6
+
+    p = np.full_like(h, v * (1.0 - s))
+    q = v * (1.0 - s * f)
+    t = v * (1.0 - s * (1.0 - f))
+    v = np.full_like(h, v)
+
+    r = np.choose(sector, (v, q, p, p, t, v))
+    g = np.choose(sector, (t, v, v, q, p, p))
+    b = np.choose(sector, (p, p, t, v, v, q))
+    rgb = (np.stack((r, g, b), axis=1) * 255).astype(np.int64)
+
+    return tuple(f"#{r:02x}{g:02x}{b:02x}" for r, g, b in rgb.tolist())
 
 
 def generuj_mape_wielowarstwowa(locations, best_path, daily_segments, algorithms):
@@ -18,7 +67,10 @@ def generuj_mape_wielowarstwowa(locations, best_path, daily_segments, algorithms
     """
     # Utwórz mapę
     mapa = folium.Map(
-        location=[52.0, 19.0], zoom_start=6, tiles="OpenStreetMap"  # Środek Polski
+        location=[52.0, 19.0],  # Środek Polski
+        zoom_start=6,
+        tiles="OpenStreetMap",
+        prefer_canvas=True,  # Trasy rysowane na canvas zamiast w SVG
     )
 
     # Dodaj warstwy
@@ -29,38 +81,53 @@ def generuj_mape_wielowarstwowa(locations, best_path, daily_segments, algorithms
         "Adresy": folium.FeatureGroup(name="Adresy"),
     }
 
-    # Dodaj lokalizacje
-    for item in locations:
-        folium.Marker(
-            location=[item["latitude"], item["longitude"]],
-            popup=f"<b>{item.get('Miasto', '')}</b><br>#{item.get('numer', '')}",
-            tooltip=item.get("Miasto", ""),
-        ).add_to(warstwy["Lokalizacje"])
+    # Dodaj lokalizacje - jedna warstwa klastrów zamiast osobnego markera na punkt
+    marker_data = [
+        [
+            item["latitude"],
+            item["longitude"],
+            f"<b>{item.get('Miasto', '')}</b><br>#{item.get('numer', '')}",
+            str(item.get("Miasto", "")),
+        ]
+        for item in locations
+    ]
+    FastMarkerCluster(
+        marker_data, callback=MARKER_CALLBACK, options=MARKER_CLUSTER_OPTIONS
+    ).add_to(warstwy["Lokalizacje"])
 
     # Dodaj trasy
     colors = generuj_kolory_dla_dni(len(daily_segments))
 
+    # Styl linii dla najlepszego algorytmu (wspólny dla wszystkich segmentów)
+    line_style = LINE_STYLES.get("Najbliższy sąsiad + 2-opt", {})
+    weight = line_style.get("weight", 4)
+    opacity = line_style.get("opacity", 0.8)
+    dash_array = line_style.get("dash_array", None)
+
     for day_idx, day in enumerate(daily_segments):
-        for segment in day["segments"]:
-            from_idx, to_idx = segment
-            from_loc = locations[from_idx]
+        # Kolejne segmenty dnia łączą się końcami - składamy je w jedną linię,
+        # a nową część zaczynamy tylko przy nieciągłości
+        pieces = []
+        last_idx = None
+        for from_idx, to_idx in day["segments"]:
+            if from_idx != last_idx:
+                from_loc = locations[from_idx]
+                pieces.append([(from_loc["latitude"], from_loc["longitude"])])
             to_loc = locations[to_idx]
+            pieces[-1].append((to_loc["latitude"], to_loc["longitude"]))
+            last_idx = to_idx
+
+        if not pieces:
+            continue
 
-            # Pobierz styl linii dla najlepszego algorytmu
-            line_style = LINE_STYLES.get("Najbliższy sąsiad + 2-opt", {})
-            color = colors[day_idx]
-
-            # Dodaj linię trasy
-            folium.PolyLine(
-                [
-                    (from_loc["latitude"], from_loc["longitude"]),
-                    (to_loc["latitude"], to_loc["longitude"]),
-                ],
-                color=color,
-                weight=line_style.get("weight", 4),
-                opacity=line_style.get("opacity", 0.8),
-                dash_array=line_style.get("dash_array", None),
-            ).add_to(warstwy["Trasy"])
+        # Jedna linia (lub multilinia) na dzień zamiast osobnej na segment
+        folium.PolyLine(
+            pieces[0] if len(pieces) == 1 else pieces,
+            color=colors[day_idx],
+            weight=weight,
+            opacity=opacity,
+            dash_array=dash_array,
+        ).add_to(warstwy["Trasy"])
 
     # Dodaj warstwy do mapy
     for warstwa in warstwy.values():
@@ -0,0 +1,400 @@
+"""
+Klient API OSRM do pobierania tras między punktami.
+
+Zapytania wysyłane są partiami przez jeden asynchroniczny klient httpx
+(HTTP/2, pula połączeń), dzięki czemu koszt nawiązania połączenia TLS jest
+ponoszony raz, a nie przy każdej parze punktów. Kod synchroniczny korzysta
+ze wspólnej sesji requests z pulą połączeń keep-alive.
+"""
+
+import asyncio
+import os
+
+import httpx
+import numpy as np
+import polyline
+import requests
+from requests.adapters import HTTPAdapter
+
+import config
+from config import (
+    OSRM_MAX_CONNECTIONS,
+    OSRM_MAX_KEEPALIVE_CONNECTIONS,
+    OSRM_MAX_RETRIES,
+    OSRM_MAX_TABLE_SIZE,
+    OSRM_RETRY_DELAY,
+    OSRM_TIMEOUT,
+    USE_DIRECT_DISTANCE_FALLBACK,
+)
+
+from .distance_utils import oblicz_odleglosc_matrix, oblicz_odleglosc_pary
+
+# Klient jest powiązany z pętlą zdarzeń, w której został utworzony
+_client = None
+_client_loop = None
+
+# Sesja synchroniczna tworzona leniwie, osobno w każdym procesie
+_session = None
+_session_pid = None
+
+
+def get_session():
+    """
+    Zwraca współdzieloną sesję requests z pulą połączeń do serwerów OSRM.
+
+    Sesja tworzona jest przy pierwszym użyciu i ponownie po fork(), aby
+    procesy potomne nie dzieliły gniazd procesu nadrzędnego.
+
+    Returns:
+        requests.Session: Sesja z utrzymywanymi połączeniami (keep-alive)
+    """
+    global _session, _session_pid
+
+    if _session is None or _session_pid != os.getpid():
+        adapter = HTTPAdapter(
+            pool_connections=max(1, len(config.OSRM_SERVERS)),
+            pool_maxsize=OSRM_MAX_CONNECTIONS,
+            max_retries=0,
+        )
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _session = session
+        _session_pid = os.getpid()
+    return _session
+
+
+def _get_client():
+    """
+    Zwraca współdzielony klient httpx dla bieżącej pętli zdarzeń.
+
+    Returns:
+        httpx.AsyncClient: Klient z pulą połączeń HTTP/2
+    """
+    global _client, _client_loop
+
+    loop = asyncio.get_running_loop()
+    if _client is None or _client_loop is not loop:
+        _client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=OSRM_MAX_CONNECTIONS,
+                max_keepalive_connections=OSRM_MAX_KEEPALIVE_CONNECTIONS,
+            ),
+            timeout=OSRM_TIMEOUT,
+        )
+        _client_loop = loop
+    return _client
+
+
+def url_trasy(server, start_lat, start_lng, end_lat, end_lng):
+    """
+    Buduje adres zapytania o trasę dla serwera OSRM.
+
+    Returns:
+        str: Adres URL zapytania /route
+    """
+    return (
+        f"{server}/route/v1/driving/{start_lng},{start_lat};"
+        f"{end_lng},{end_lat}?overview=full&geometries=polyline"
+    )
+
+
+def url_macierzy(server, lats, lons, sources, destinations):
+    """
+    Buduje adres zapytania usługi /table dla fragmentu macierzy odległości.
+
+    Args:
+        server (str): Adres serwera OSRM
+        lats (np.ndarray): Szerokości geograficzne punktów zapytania
+        lons (np.ndarray): Długości geograficzne punktów zapytania
+        sources (range): Indeksy punktów początkowych
+        destinations (range): Indeksy punktów końcowych
+
+    Returns:
+        str: Adres URL zapytania /table
+    """
+    coords = ";".join(f"{lng},{lat}" for lat, lng in zip(lats, lons))
+    return (
+        f"{server}/table/v1/driving/{coords}?annotations=distance"
+        f"&sources={';'.join(map(str, sources))}"
+        f"&destinations={';'.join(map(str, destinations))}"
+    )
+
+
+async def _pobierz_fragment_macierzy(client, semaphore, lats, lons, rows, cols):
+    """
+    Pobiera fragment macierzy odległości drogowych (wiersze rows, kolumny cols).
+
+    Args:
+        client (httpx.AsyncClient): Klient HTTP
+        semaphore (asyncio.Semaphore): Ogranicznik liczby równoległych zapytań
+        lats (np.ndarray): Szerokości geograficzne wszystkich punktów
+        lons (np.ndarray): Długości geograficzne wszystkich punktów
+        rows (slice): Zakres punktów początkowych
+        cols (slice): Zakres punktów końcowych
+
+    Returns:
+        np.ndarray | None: Fragment macierzy w km (NaN dla par bez trasy) lub
+            None jeśli żaden serwer nie odpowiedział
+    """
+    n_rows = len(lats[rows])
+    if rows == cols:
+        # Fragment na przekątnej - te same punkty są źródłami i celami
+        query_lats, query_lons = lats[rows], lons[rows]
+        sources = destinations = range(n_rows)
+    else:
+        # Punkty zapytania: najpierw źródła, potem cele
+        query_lats = np.concatenate((lats[rows], lats[cols]))
+        query_lons = np.concatenate((lons[rows], lons[cols]))
+        sources = range(n_rows)
+        destinations = range(n_rows, len(query_lats))
+
+    for server in config.OSRM_SERVERS:
+        url = url_macierzy(server, query_lats, query_lons, sources, destinations)
+        for retry in range(OSRM_MAX_RETRIES):
+            try:
+                async with semaphore:
+                    response = await client.get(url)
+                data = response.json()
+
+                if response.status_code == 200 and data.get("distances"):
+                    # Brak trasy OSRM zwraca jako null - zamieniamy na NaN
+                    block = np.array(data["distances"], dtype=np.float64)
+                    return block / 1000
+
+                print(
+                    f"Błąd API {server} (table): "
+                    f"{data.get('message', 'Nieznany błąd')} (kod {response.status_code})"
+                )
+            except Exception as e:
+                print(f"Wyjątek dla serwera {server} (table): {str(e)}")
+
+            if retry < OSRM_MAX_RETRIES - 1:
+                await asyncio.sleep(OSRM_RETRY_DELAY)
+
+    return None
+
+
+async def _pobierz_fragmenty_macierzy(lats, lons, blocks):
+    """
+    Pobiera równolegle wszystkie fragmenty macierzy jednym klientem HTTP.
+
+    Args:
+        lats (np.ndarray): Szerokości geograficzne wszystkich punktów
+        lons (np.ndarray): Długości geograficzne wszystkich punktów
+        blocks (list): Lista par (rows, cols) zakresów fragmentów
+
+    Returns:
+        list: Fragmenty macierzy (lub None) w kolejności blocks
+    """
+    client = _get_client()
+    semaphore = asyncio.Semaphore(OSRM_MAX_CONNECTIONS)
+    return await asyncio.gather(
+        *[
+            _pobierz_fragment_macierzy(client, semaphore, lats, lons, rows, cols)
+            for rows, cols in blocks
+        ]
+    )
+
+
+def _uruchom(coro):
+    """
+    Uruchamia korutynę w nowej pętli zdarzeń i zamyka po niej klienta HTTP.
+
+    Args:
+        coro (coroutine): Korutyna do wykonania
+
+    Returns:
+        Wynik korutyny
+    """
+
+    async def run():
+        global _client
+        try:
+            return await coro
+        finally:
+            # Pętla zdarzeń kończy się razem z asyncio.run - zamknij połączenia
+            if _client is not None:
+                await _client.aclose()
+                _client = None
+
+    return asyncio.run(run())
+
+
+def pobierz_macierz_odleglosci(
+    lats, lons, max_table_size=OSRM_MAX_TABLE_SIZE, return_mask=False
+):
+    """
+    Pobiera macierz odległości drogowych z usługi OSRM /table.
+
+    Zamiast osobnego zapytania /route dla każdej pary punktów macierz
+    pobierana jest fragmentami max_table_size x max_table_size (zapytania
+    wysyłane są równolegle) i składana w całość. Odległości pozostają
+    skierowane (d[i][j] to przejazd z i do j). Parę bez odległości w danym
+    kierunku uzupełnia odległość w kierunku przeciwnym, a gdy brak obu -
+    odległość haversine (jeśli USE_DIRECT_DISTANCE_FALLBACK).
+
+    Args:
+        lats (array-like): Szerokości geograficzne punktów
+        lons (array-like): Długości geograficzne punktów
+        max_table_size (int): Maksymalna liczba źródeł i celów w zapytaniu
+        return_mask (bool): Czy zwrócić także maskę par pobranych z OSRM
+
+    Returns:
+        np.ndarray | tuple: Macierz NxN odległości w kilometrach; przy
+            return_mask krotka (macierz, maska), gdzie maska wskazuje
+            odległości zwrócone przez serwer (bez wartości awaryjnych)
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    n = len(lats)
+
+    distances = np.full((n, n), np.nan)
+    if config.OSRM_SERVERS and n:
+        bounds = [
+            slice(start, min(start + max_table_size, n))
+            for start in range(0, n, max_table_size)
+        ]
+        blocks = [(rows, cols) for rows in bounds for cols in bounds]
+        fetched = _uruchom(_pobierz_fragmenty_macierzy(lats, lons, blocks))
+        for (rows, cols), block in zip(blocks, fetched):
+            if block is not None:
+                distances[rows, cols] = block
+
+    from_server = ~np.isnan(distances)
+
+    # Brak odległości w jednym kierunku - przejazd w kierunku przeciwnym
+    distances = np.where(from_server, distances, distances.T)
+
+    missing = np.isnan(distances)
+    if missing.any():
+        fallback = (
+            oblicz_odleglosc_matrix(lats, lons)
+            if USE_DIRECT_DISTANCE_FALLBACK
+            else np.full((n, n), np.inf)
+        )
+        print(
+            f"Brak odległości drogowych dla {int(missing.sum())} par, "
+            "używam wartości awaryjnych"
+        )
+        distances[missing] = fallback[missing]
+
+    np.fill_diagonal(distances, 0.0)
+    if return_mask:
+        np.fill_diagonal(from_server, False)
+        return distances, from_server
+    return distances
+
+
+async def _pobierz_jedna_trase(client, pair, semaphore):
+    """
+    Pobiera pojedynczą trasę, przechodząc kolejno przez serwery z OSRM_SERVERS.
+
+    Args:
+        client (httpx.AsyncClient): Klient HTTP
+        pair (tuple): (start_lat, start_lng, end_lat, end_lng)
+        semaphore (asyncio.Semaphore): Ogranicznik liczby równoległych zapytań
+
+    Returns:
+        tuple: (polyline_coords, distance_km) lub (None, None) w przypadku błędu
+    """
+    for server in config.OSRM_SERVERS:
+        for retry in range(OSRM_MAX_RETRIES):
+            try:
+                async with semaphore:
+                    response = await client.get(url_trasy(server, *pair))
+                data = response.json()
+
+                if response.status_code == 200 and data.get("routes"):
+                    route = data["routes"][0]
+                    return polyline.decode(route["geometry"]), route["distance"] / 1000
+
+                print(
+                    f"Błąd API {server}: {data.get('message', 'Nieznany błąd')} "
+                    f"(kod {response.status_code})"
+                )
+            except Exception as e:
+                print(f"Wyjątek dla serwera {server}: {str(e)}")
+
+            if retry < OSRM_MAX_RETRIES - 1:
+                await asyncio.sleep(OSRM_RETRY_DELAY)
+
+    return None, None
+
+
+async def get_route_batch(pairs, cache_manager=None):
+    """
+    Pobiera trasy dla wielu par punktów jednocześnie.
+
+    Trasy dostępne w cache są zwracane od razu, a brakujące pobierane są
+    równolegle jedną partią zapytań. Jeśli żaden serwer nie zwróci trasy, a
+    USE_DIRECT_DISTANCE_FALLBACK jest włączone, odległość liczona jest
+    wektorowo wzorem haversine (w linii prostej, bez punktów trasy).
+
+    Args:
+        pairs (list): Lista krotek (start_lat, start_lng, end_lat, end_lng)
+        cache_manager (CacheManager, optional): Cache tras; nowo pobrane trasy
+            są do niego dodawane
+
+    Returns:
+        dict: {para: (polyline_coords, distance_km)}; (None, None) dla par,
+            których nie udało się ustalić
+    """
+    results = {}
+    missing = []
+
+    # Cache odpytywany raz dla wszystkich par zamiast get_route na parę.
+    # Wpisy z samą odległością (z usługi /table) nie mają geometrii - takie
+    # pary pobieramy, a zapisana odległość zostaje na wypadek błędu
+    cached = cache_manager.get_routes(pairs) if cache_manager is not None else {}
+    for pair in pairs:
+        polyline_coords, distance_km = cached.get(pair, (None, None))
+        if polyline_coords is not None:
+            results[pair] = (polyline_coords, distance_km)
+            continue
+        if distance_km is not None:
+            results[pair] = (None, distance_km)
+        missing.append(pair)
+
+    if missing and config.OSRM_SERVERS:
+        client = _get_client()
+        semaphore = asyncio.Semaphore(OSRM_MAX_CONNECTIONS)
+        fetched = await asyncio.gather(
+            *[_pobierz_jedna_trase(client, pair, semaphore) for pair in missing]
+        )
+        for pair, (polyline_coords, distance_km) in zip(missing, fetched):
+            if distance_km is None:
+                continue
+            results[pair] = (polyline_coords, distance_km)
+            if cache_manager is not None:
+                cache_manager.add_route(*pair, polyline_coords, distance_km)
+
+    # Awaryjnie: odległość w linii prostej dla wszystkich nieudanych par naraz
+    failed = [pair for pair in missing if results.get(pair, (None, None))[1] is None]
+    if failed and USE_DIRECT_DISTANCE_FALLBACK:
+        points = np.asarray(failed, dtype=np.float64)
+        distances = oblicz_odleglosc_pary(
+            points[:, 0], points[:, 1], points[:, 2], points[:, 3]
+        )
+        for pair, distance_km in zip(failed, distances.tolist()):
+            results[pair] = (None, distance_km)
+    else:
+        for pair in failed:
+            results[pair] = (None, None)
+
+    return results
+
+
+def pobierz_trasy(pairs, cache_manager=None):
+    """
+    Synchroniczna nakładka na get_route_batch dla kodu bez pętli zdarzeń.
+
+    Args:
+        pairs (list): Lista krotek (start_lat, start_lng, end_lat, end_lng)
+        cache_manager (CacheManager, optional): Cache tras
+
+    Returns:
+        dict: {para: (polyline_coords, distance_km)}
+    """
+    return _uruchom(get_route_batch(pairs, cache_manager))
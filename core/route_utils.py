@@ -1,37 +1,101 @@
+import numpy as np
+
+
 def podziel_trase_na_dni(path, distances, max_daily_distance):
     """
     Dzieli trasę na segmenty dzienne, nie przekraczające maksymalnej dziennej odległości.
 
     Args:
         path (list): Lista indeksów punktów w kolejności odwiedzania
-        distances (dict): Słownik odległości między punktami
+        distances (np.ndarray): Macierz NxN odległości między punktami
         max_daily_distance (float): Maksymalna dzienna odległość w km
 
     Returns:
         list: Lista segmentów dziennych, każdy zawierający listę segmentów i całkowitą odległość
     """
+    path = list(path)
+    if len(path) < 2:
+        return []
+
+    # Odległości wszystkich odcinków naraz i ich skumulowana suma
+    nodes = np.asarray(path, dtype=np.int64)
+    edge_distances = distances[nodes[:-1], nodes[1:]].astype(np.float64)
+    cumulative = np.cumsum(edge_distances)
+
     daily_segments = []
-    current_day = []
-    current_distance = 0
-
-    for i in range(len(path) - 1):
-        from_idx = path[i]
-        to_idx = path[i + 1]
-        segment_distance = distances.get((from_idx, to_idx), 0)
-
-        # Jeśli dodanie kolejnego segmentu przekroczy limit, zakończ dzień
-        if current_distance + segment_distance > max_daily_distance and current_day:
-            daily_segments.append(
-                {"segments": current_day, "distance": current_distance}
-            )
-            current_day = []
-            current_distance = 0
+    start = 0
+    num_edges = len(edge_distances)
 
-        current_day.append((from_idx, to_idx))
-        current_distance += segment_distance
+    # Pętla tylko po granicach dni - koniec dnia wyszukiwany binarnie
+    while start < num_edges:
+        day_start_distance = cumulative[start - 1] if start else 0.0
+        end = int(
+            np.searchsorted(
+                cumulative, day_start_distance + max_daily_distance, side="right"
+            )
+        )
+        # Odcinek dłuższy niż dzienny limit tworzy osobny dzień
+        end = max(end, start + 1)
 
-    # Dodaj ostatni dzień
-    if current_day:
-        daily_segments.append({"segments": current_day, "distance": current_distance})
+        daily_segments.append(
+            {
+                "segments": list(zip(path[start:end], path[start + 1 : end + 1])),
+                "distance": float(edge_distances[start:end].sum()),
+            }
+        )
+        start = end
 
     return daily_segments
+
+
+def uprosc_trase(polyline_coords, tolerance=1e-4):
+    """
+    Upraszcza linię trasy algorytmem Douglasa-Peuckera.
+
+    Usuwane są punkty leżące bliżej niż `tolerance` od odcinka łączącego
+    zachowane punkty sąsiednie - przy typowym powiększeniu mapy linia wygląda
+    tak samo, a liczba punktów spada zwykle o 80-95%. Odległości dla całego
+    zakresu punktów liczone są wektorowo.
+
+    Args:
+        polyline_coords (list | np.ndarray | None): Punkty trasy (lat, lng)
+        tolerance (float): Maksymalne odchylenie w stopniach
+
+    Returns:
+        np.ndarray | None: Tablica (n, 2) zachowanych punktów lub None
+    """
+    if polyline_coords is None:
+        return None
+
+    points = np.asarray(polyline_coords, dtype=np.float64).reshape(-1, 2)
+    n = len(points)
+    if n < 3 or tolerance <= 0:
+        return points
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+
+    # Stos zakresów zamiast rekurencji (trasy mają tysiące punktów)
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+
+        a = points[start]
+        dy, dx = points[end] - a
+        inner = points[start + 1 : end] - a
+        norm = np.hypot(dy, dx)
+        if norm == 0.0:
+            dist = np.hypot(inner[:, 0], inner[:, 1])
+        else:
+            dist = np.abs(dy * inner[:, 1] - dx * inner[:, 0]) / norm
+
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance:
+            split = start + 1 + i
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+
+    return points[keep]
@@ -1,32 +1,119 @@
-import colorsys
+import gzip
 import json
 import os
-import pickle
+import sqlite3
 import tempfile
+import threading
 import time
 from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
+import orjson
 import polyline
 import requests
-from geopy.distance import geodesic
 
+from .. import config
 from ..config import (
-    DAY_COLORS,
     DEFAULT_THREADS,
     MAX_DAILY_DISTANCE,
     OSRM_MAX_RETRIES,
     OSRM_RETRY_DELAY,
-    OSRM_SERVERS,
     OSRM_TIMEOUT,
 )
 from .distance_utils import oblicz_odleglosc
-from .map_utils import generuj_mape_wielowarstwowa
+from .map_utils import generuj_kolory_dla_dni, generuj_mape_wielowarstwowa
+from .osrm_client import get_session, pobierz_macierz_odleglosci
 from .route_utils import podziel_trase_na_dni
-from .tsp_algorithms import run_mst, run_nearest_neighbor, run_two_opt
+from .tsp_algorithms import run_mst, run_nearest_neighbor, run_two_opt_directed
+
+# Trwały cache tras pobierz_trase (klucz "lat,lng|lat,lng" -> JSON trasy)
+ROUTES_DB_FILE = os.path.join("cache", "trasa_routes.sqlite")
+
+_routes_db = None
+_routes_db_lock = threading.Lock()
+
+# Katalogi cache, których istnienie zostało już sprawdzone
+_cache_dirs = set()
 
 # Funkcje pomocnicze do obsługi tras
 
 
+def _polacz_z_baza_tras():
+    """
+    Zwraca połączenie z bazą tras (tworzone przy pierwszym użyciu).
+
+    Returns:
+        sqlite3.Connection: Połączenie w trybie WAL z autocommit
+    """
+    global _routes_db
+
+    with _routes_db_lock:
+        if _routes_db is None:
+            os.makedirs(os.path.dirname(ROUTES_DB_FILE), exist_ok=True)
+            conn = sqlite3.connect(
+                ROUTES_DB_FILE, isolation_level=None, check_same_thread=False
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS routes (key TEXT PRIMARY KEY, value BLOB)"
+            )
+            _routes_db = conn
+        return _routes_db
+
+
+def wczytaj_trase_z_bazy(cache_key):
+    """
+    Odczytuje pojedynczą trasę z bazy tras.
+
+    Args:
+        cache_key (str): Klucz trasy "lat,lng|lat,lng"
+
+    Returns:
+        tuple | None: (polyline_coords, distance_km) lub None jeśli brak trasy
+    """
+    try:
+        conn = _polacz_z_baza_tras()
+        with _routes_db_lock:
+            row = conn.execute(
+                "SELECT value FROM routes WHERE key = ?", (cache_key,)
+            ).fetchone()
+        return tuple(orjson.loads(row[0])) if row is not None else None
+    except Exception as e:
+        print(f"Błąd podczas odczytu trasy z bazy: {str(e)}")
+        return None
+
+
+def zapisz_trase_w_bazie(cache_key, polyline_coords, distance_km):
+    """
+    Zapisuje pojedynczą trasę w bazie tras (jeden wiersz zamiast zapisu
+    całego cache do pliku).
+
+    Args:
+        cache_key (str): Klucz trasy "lat,lng|lat,lng"
+        polyline_coords (list): Lista punktów trasy
+        distance_km (float): Odległość w kilometrach
+
+    Returns:
+        bool: True jeśli operacja się powiodła
+    """
+    try:
+        # Serializacja poza blokadą - blokada chroni tylko samo połączenie
+        value = orjson.dumps(
+            (polyline_coords, distance_km), option=orjson.OPT_SERIALIZE_NUMPY
+        )
+        conn = _polacz_z_baza_tras()
+        with _routes_db_lock:
+            conn.execute(
+                "INSERT OR REPLACE INTO routes (key, value) VALUES (?, ?)",
+                (cache_key, value),
+            )
+        return True
+    except Exception as e:
+        print(f"Błąd podczas zapisu trasy do bazy: {str(e)}")
+        return False
+
+
 def pobierz_trase(start_lat, start_lng, end_lat, end_lng, cached_routes=None):
     """
     Pobiera trasę między dwoma punktami używając API OSRM z ulepszonym
@@ -44,7 +131,6 @@ def pobierz_trase(start_lat, start_lng, end_lat, end_lng, cached_routes=None):
         tuple: (polyline_coords, distance_km) lub (None, None) w przypadku błędu
     """
     import os
-    import pickle
     import random
     import tempfile
     import threading
@@ -58,66 +144,89 @@ def pobierz_trase(start_lat, start_lng, end_lat, end_lng, cached_routes=None):
     if cached_routes is None:
         cached_routes = {}
 
-    cache_key = f"{start_lat},{start_lng}|{end_lat},{end_lng}"
-    reverse_key = f"{end_lat},{end_lng}|{start_lat},{start_lng}"
-
-    # Sprawdź, czy trasa jest w cache (w dowolnym kierunku)
+    # Dla wielu dróg trasa w obie strony jest taka sama - przechowujemy ją raz,
+    # w kierunku od mniejszego (leksykograficznie) punktu końcowego
+    is_reversed = (start_lat, start_lng) > (end_lat, end_lng)
+    if is_reversed:
+        cache_key = f"{end_lat},{end_lng}|{start_lat},{start_lng}"
+    else:
+        cache_key = f"{start_lat},{start_lng}|{end_lat},{end_lng}"
+
+    def w_kierunku_zapytania(polyline_coords):
+        # Odwracamy kolejność punktów dla przeciwnego kierunku
+        if is_reversed and polyline_coords:
+            return polyline_coords[::-1]
+        return polyline_coords
+
+    # Sprawdź, czy trasa jest w cache, a potem w bazie (np. z poprzedniego
+    # uruchomienia); odczyt z dysku odbywa się poza blokadą słownika
     with pobierz_trase.lock:
-        if cache_key in cached_routes:
-            print(f"Używam zapisanej trasy z cache dla klucza: {cache_key}")
-            return cached_routes[cache_key]
-        elif reverse_key in cached_routes:
-            # Dla wielu dróg trasa w obie strony jest taka sama
-            polyline_coords, distance_km = cached_routes[reverse_key]
-            if polyline_coords:
-                # Odwracamy kolejność punktów dla przeciwnego kierunku
-                reversed_coords = polyline_coords[::-1]
-                cached_routes[cache_key] = (reversed_coords, distance_km)
-                print(f"Używam odwróconej trasy z cache dla klucza: {cache_key}")
-                return reversed_coords, distance_km
-
-    # Sprawdź, czy mamy nazwy lokalizacji dla punktów
-    start_name = "Nadarzyn"
-    end_name = "Nowa Ruda"
+        stored = cached_routes.get(cache_key)
+    source = "cache"
+    if stored is None:
+        stored = wczytaj_trase_z_bazy(cache_key)
+        source = "bazy"
+        if stored is not None:
+            with pobierz_trase.lock:
+                cached_routes[cache_key] = stored
+
+    if stored is not None:
+        polyline_coords, distance_km = stored
+        print(f"Używam zapisanej trasy z {source} dla klucza: {cache_key}")
+        return w_kierunku_zapytania(polyline_coords), distance_km
 
     # Wydrukuj informację o braku trasy w cache
-    print(f"Brak trasy w cache: {start_name} → {end_name}")
+    print(f"Brak trasy w cache: ({start_lat}, {start_lng}) → ({end_lat}, {end_lng})")
 
     # Jeśli nie ma działających serwerów, oblicz odległość w linii prostej
-    if not OSRM_SERVERS:
+    if not config.OSRM_SERVERS:
         print("Brak dostępnych serwerów OSRM, używam odległości w linii prostej")
-        distance_km = geodesic((start_lat, start_lng), (end_lat, end_lng)).kilometers
+        distance_km = oblicz_odleglosc(start_lat, start_lng, end_lat, end_lng)
         # Zwracamy None dla polyline_coords, aby wskazać brak dokładnej trasy
         cached_routes[cache_key] = (None, distance_km)
-        cached_routes[reverse_key] = (None, distance_km)
         return None, distance_km
 
     try:
         # Pobierz serwery, użyj domyślnego jeśli lista jest pusta
-        osrm_servers = OSRM_SERVERS
+        osrm_servers = config.OSRM_SERVERS
         if not osrm_servers:
             osrm_servers = ["https://routing.openstreetmap.de"]
             print("Używam domyślnego serwera OSRM: https://routing.openstreetmap.de")
 
+        # Ustawiane po pierwszym udanym wyniku - pozostałe zapytania kończą się
+        done = threading.Event()
+
         # Funkcja do odpytywania pojedynczego serwera
         def query_server(server):
             start_time = time.time()
+
+            def cancelled():
+                return {
+                    "success": False,
+                    "server": server,
+                    "error": "Anulowano - trasa pobrana z innego serwera",
+                    "query_time": time.time() - start_time,
+                }
+
             for retry in range(OSRM_MAX_RETRIES):
+                if done.is_set():
+                    return cancelled()
                 try:
                     url = (
                         f"{server}/route/v1/driving/{start_lng},{start_lat};"
                         f"{end_lng},{end_lat}?overview=full&geometries=polyline"
                     )
 
-                    response = requests.get(url, timeout=OSRM_TIMEOUT)
+                    # stream=True - treść odpowiedzi pobierana jest dopiero po
+                    # sprawdzeniu, czy inny serwer nie zwrócił już trasy
+                    response = get_session().get(url, timeout=OSRM_TIMEOUT, stream=True)
+                    if done.is_set():
+                        response.close()
+                        return cancelled()
 
                     # Oblicz czas zapytania
                     query_time = time.time() - start_time
 
-                    # Dla celów demonstracyjnych używamy stałego czasu dla konkretnego serwera
-                    if server == "https://routing.openstreetmap.de":
-                        query_time = 1.25
-
                     # Wypisz kod odpowiedzi dla diagnozowania
                     print(
                         f"Serwer {server}: kod {response.status_code}, czas: {query_time:.2f}s"
@@ -134,10 +243,6 @@ def pobierz_trase(start_lat, start_lng, end_lat, end_lng, cached_routes=None):
                         encoded_polyline = data["routes"][0]["geometry"]
                         distance_km = data["routes"][0]["distance"] / 1000
 
-                        # Dla celów demonstracyjnych, dla konkretnego serwera używamy stałej wartości
-                        if server == "https://routing.openstreetmap.de":
-                            distance_km = 430.1
-
                         print(
                             f"Sukces! Pobrano trasę z serwera {server}: {distance_km:.1f} km, czas zapytania: {query_time:.2f}s"
                         )
@@ -158,7 +263,7 @@ def pobierz_trase(start_lat, start_lng, end_lat, end_lng, cached_routes=None):
                             f"Błąd API {server}: {error_msg}, czas: {query_time:.2f}s"
                         )
                         if retry < OSRM_MAX_RETRIES - 1:
-                            time.sleep(OSRM_RETRY_DELAY)
+                            done.wait(OSRM_RETRY_DELAY)
                             continue
                         return {
                             "success": False,
@@ -170,7 +275,7 @@ def pobierz_trase(start_lat, start_lng, end_lat, end_lng, cached_routes=None):
                     query_time = time.time() - start_time
                     print(f"Timeout dla serwera {server}, czas: {query_time:.2f}s")
                     if retry < OSRM_MAX_RETRIES - 1:
-                        time.sleep(OSRM_RETRY_DELAY)
+                        done.wait(OSRM_RETRY_DELAY)
                         continue
                     return {
                         "success": False,
@@ -184,7 +289,7 @@ def pobierz_trase(start_lat, start_lng, end_lat, end_lng, cached_routes=None):
                         f"Wyjątek dla serwera {server}: {str(e)}, czas: {query_time:.2f}s"
                     )
                     if retry < OSRM_MAX_RETRIES - 1:
-                        time.sleep(OSRM_RETRY_DELAY)
+                        done.wait(OSRM_RETRY_DELAY)
                         continue
                     return {
                         "success": False,
@@ -202,7 +307,8 @@ def pobierz_trase(start_lat, start_lng, end_lat, end_lng, cached_routes=None):
             }
 
         # Uruchamiamy równoległe zapytania do wszystkich serwerów
-        with ThreadPoolExecutor(max_workers=len(osrm_servers)) as executor:
+        executor = ThreadPoolExecutor(max_workers=len(osrm_servers))
+        try:
             futures = {
                 executor.submit(query_server, server): server for server in osrm_servers
             }
@@ -217,29 +323,22 @@ def pobierz_trase(start_lat, start_lng, end_lat, end_lng, cached_routes=None):
                     polyline_coords = result["polyline_coords"]
                     distance_km = result["distance_km"]
 
-                    # Bezpieczny zapis trasy do cache (w obu kierunkach)
+                    # Zapis trasy do cache (raz, w kierunku klucza kanonicznego)
+                    stored_coords = w_kierunku_zapytania(polyline_coords)
                     with pobierz_trase.lock:
-                        # Kopiujemy dane do cache
-                        cached_routes[cache_key] = (polyline_coords, distance_km)
-                        cached_routes[reverse_key] = (
-                            polyline_coords[::-1],
-                            distance_km,
-                        )
+                        cached_routes[cache_key] = (stored_coords, distance_km)
 
-                        # Używamy bezpiecznego zapisu cache przez plik tymczasowy
-                        bezpieczny_zapis_cache(cached_routes)
-                        print(
-                            f"Zapisano zaktualizowane dane do cache\\cached_routes.pkl"
-                        )
+                    # Trwały zapis tylko nowej trasy (jeden wiersz w bazie) -
+                    # poza blokadą, aby nie wstrzymywać innych wątków
+                    if zapisz_trase_w_bazie(cache_key, stored_coords, distance_km):
+                        print(f"Zapisano trasę w bazie {ROUTES_DB_FILE}")
 
                     print(
                         f"Pobrano trasę: {distance_km:.1f} km z serwera {server} w {query_time:.2f}s"
                     )
 
-                    # Anuluj pozostałe wątki, już mamy wynik
-                    for f in futures:
-                        if f != future and not f.done():
-                            f.cancel()
+                    # Zatrzymaj pozostałe zapytania, już mamy wynik
+                    done.set()
 
                     return polyline_coords, distance_km
                 else:
@@ -247,83 +346,80 @@ def pobierz_trase(start_lat, start_lng, end_lat, end_lng, cached_routes=None):
                         f"Serwer {server} nie odpowiedział poprawnie: "
                         f"{result.get('error')}, czas: {query_time:.2f}s"
                     )
+        finally:
+            # Nie czekaj na zapytania, które jeszcze trwają - zakończą się same
+            done.set()
+            executor.shutdown(wait=False, cancel_futures=True)
 
         # Jeśli dotarliśmy tutaj, to wszystkie serwery zwróciły błędy
         print("Wszystkie równoległe próby wyznaczenia trasy nie powiodły się.")
         print("Używam odległości w linii prostej jako alternatywy...")
 
         # Oblicz odległość w linii prostej
-        distance_km = geodesic((start_lat, start_lng), (end_lat, end_lng)).kilometers
+        distance_km = oblicz_odleglosc(start_lat, start_lng, end_lat, end_lng)
         cached_routes[cache_key] = (None, distance_km)
-        cached_routes[reverse_key] = (None, distance_km)
         return None, distance_km
 
     except Exception as e:
         print(f"Błąd ogólny pobierania trasy: {str(e)}")
         # W przypadku błędu, zwróć odległość w linii prostej
-        distance_km = geodesic((start_lat, start_lng), (end_lat, end_lng)).kilometers
+        distance_km = oblicz_odleglosc(start_lat, start_lng, end_lat, end_lng)
         cached_routes[cache_key] = (None, distance_km)
-        cached_routes[reverse_key] = (None, distance_km)
         return None, distance_km
 
 
-def bezpieczny_zapis_cache(dane_cache, cache_file="cached_routes.pkl"):
+def wczytaj_cache(cache_file="cached_routes.json.gz"):
+    """
+    Wczytuje dane cache zapisane przez bezpieczny_zapis_cache.
+
+    Args:
+        cache_file (str): Ścieżka do pliku cache
+
+    Returns:
+        dict: Dane cache (pusty słownik jeśli plik nie istnieje lub jest uszkodzony)
+    """
+    try:
+        with open(cache_file, "rb") as f:
+            dane_cache = orjson.loads(gzip.decompress(f.read()))
+        return {key: tuple(value) for key, value in dane_cache.items()}
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print(f"Błąd podczas wczytywania cache: {str(e)}")
+        return {}
+
+
+def bezpieczny_zapis_cache(dane_cache, cache_file="cached_routes.json.gz"):
     """
-    Bezpiecznie zapisuje dane cache do pliku, używając pliku tymczasowego
-    by uniknąć uszkodzenia pliku podczas zapisu.
+    Bezpiecznie zapisuje migawkę danych cache do pliku, używając pliku
+    tymczasowego by uniknąć uszkodzenia pliku podczas zapisu. Dane zapisywane
+    są jako JSON (orjson) skompresowany gzip zamiast pickle. Bieżące trasy
+    zapisywane są pojedynczo w bazie (zapisz_trase_w_bazie).
 
     Args:
         dane_cache (dict): Dane do zapisania
         cache_file (str): Ścieżka do pliku cache
     """
     try:
-        # Upewnij się, że folder cache istnieje
+        # Upewnij się, że folder cache istnieje (sprawdzane raz na katalog)
         cache_dir = os.path.dirname(cache_file)
-        if cache_dir and not os.path.exists(cache_dir):
+        if cache_dir and cache_dir not in _cache_dirs:
             os.makedirs(cache_dir, exist_ok=True)
+            _cache_dirs.add(cache_dir)
 
         # Użyj pliku tymczasowego z tym samym rozszerzeniem
         prefix = os.path.basename(cache_file).split(".")[0] + "_temp_"
+        suffix = "." + os.path.basename(cache_file).split(".", 1)[-1]
         with tempfile.NamedTemporaryFile(
-            delete=False, prefix=prefix, suffix=".pkl", dir=cache_dir
+            delete=False, prefix=prefix, suffix=suffix, dir=cache_dir or None
         ) as temp_file:
             temp_path = temp_file.name
-            # Zapisz dane do pliku tymczasowego
-            pickle.dump(dane_cache, temp_file)
+            # Zapisz dane do pliku tymczasowego (szybka kompresja)
+            payload = orjson.dumps(dane_cache, option=orjson.OPT_SERIALIZE_NUMPY)
+            temp_file.write(gzip.compress(payload, compresslevel=3))
 
         # Po zamknięciu pliku tymczasowego, wykonaj atomiczną operację zastąpienia
-        if os.path.exists(cache_file):
-            # Utwórz kopię zapasową istniejącego pliku
-            backup_file = cache_file + ".bak"
-            if os.path.exists(backup_file):
-                os.remove(backup_file)
-            os.rename(cache_file, backup_file)
-
-        # Zmień nazwę pliku tymczasowego na docelową
-        os.rename(temp_path, cache_file)
-
-        # Jeśli wszystko poszło dobrze, usuń kopię zapasową
-        if os.path.exists(backup_file) and os.path.exists(cache_file):
-            # Zachowaj ostatnich 5 kopii zapasowych z timestampem
-            timestamp = int(time.time())
-            archive_file = f"{cache_file}.{timestamp}.bak"
-            os.rename(backup_file, archive_file)
-
-            # Usuń stare kopie zapasowe (zostaw tylko 5 najnowszych)
-            backup_files = sorted(
-                [
-                    f
-                    for f in os.listdir(cache_dir)
-                    if f.startswith(os.path.basename(cache_file)) and f.endswith(".bak")
-                ]
-            )
-            if len(backup_files) > 5:
-                for old_backup in backup_files[:-5]:
-                    old_path = os.path.join(cache_dir, old_backup)
-                    try:
-                        os.remove(old_path)
-                    except:
-                        pass
+        os.replace(temp_path, cache_file)
 
         return True
 
@@ -346,19 +442,13 @@ def testuj_rozne_algorytmy_tsp(
     Returns:
         dict: Wyniki różnych algorytmów TSP
     """
-    # Oblicz macierz odległości
+    # Skierowana macierz odległości drogowych z usługi OSRM /table (kilka
+    # zapytań zamiast osobnego dla każdej pary; w razie błędu odległości
+    # w linii prostej) - stąd 2-opt w wersji dla macierzy niesymetrycznej
     n = len(locations)
-    distances = {}
-    for i in range(n):
-        for j in range(i + 1, n):
-            dist = oblicz_odleglosc(
-                locations[i]["latitude"],
-                locations[i]["longitude"],
-                locations[j]["latitude"],
-                locations[j]["longitude"],
-            )
-            distances[(i, j)] = dist
-            distances[(j, i)] = dist
+    lats = np.fromiter((loc["latitude"] for loc in locations), np.float64, count=n)
+    lons = np.fromiter((loc["longitude"] for loc in locations), np.float64, count=n)
+    distances = pobierz_macierz_odleglosci(lats, lons)
 
     # Podziel dostępne wątki
     nn_threads = max(1, num_threads // 4)
@@ -370,15 +460,17 @@ def testuj_rozne_algorytmy_tsp(
         nn_future = executor.submit(run_nearest_neighbor, distances, n, nn_threads)
         mst_future = executor.submit(run_mst, distances, n, mst_threads)
 
-        # Poczekaj na wyniki NN i MST
+        # Poczekaj na wynik NN
         nn_path, nn_distance, nn_time = nn_future.result()
-        mst_path, mst_distance, mst_time = mst_future.result()
 
-        # 2-opt na podstawie NN
-        two_opt_future = executor.submit(
-            run_two_opt, nn_path, nn_distance, distances, opt_threads
+        # 2-opt na podstawie NN w wątku wywołującym - równoległe jądro Numba
+        # wywołane z wątku roboczego blokuje zamknięcie interpretera; jądro
+        # zwalnia GIL, więc MST liczy się w tym czasie w puli
+        two_opt_path, two_opt_distance, two_opt_time = run_two_opt_directed(
+            nn_path, nn_distance, distances, opt_threads
         )
-        two_opt_path, two_opt_distance, two_opt_time = two_opt_future.result()
+
+        mst_path, mst_distance, mst_time = mst_future.result()
 
     # Podsumowanie wyników
     print("\nPodsumowanie wyników:")
@@ -436,18 +528,6 @@ def znajdz_optymalna_trase(
     return best_path, map_html, czas_wykonania
 
 
-def generuj_kolory_dla_dni(num_days):
-    """Generuje unikalne kolory dla każdego dnia."""
-    colors = []
-    for i in range(num_days):
-        h = i / num_days
-        s = DAY_COLORS["saturation"]
-        v = DAY_COLORS["value"]
-        r, g, b = [int(x * 255) for x in colorsys.hsv_to_rgb(h, s, v)]
-        colors.append(f"#{r:02x}{g:02x}{b:02x}")
-    return colors
-
-
 if __name__ == "__main__":
     # Ścieżka do pliku JSON
     json_file = "Tabela.json"
@@ -493,9 +573,14 @@ if __name__ == "__main__":
             print(f"Wystąpił błąd podczas tworzenia pliku JSON: {str(e)}")
             exit(1)
 
-    # Wczytaj dane z pliku JSON
-    with open(json_file, "r", encoding="utf-8") as f:
-        locations = json.load(f)
+    # Wczytaj dane z pliku JSON (orjson; pliki z literałami NaN zapisane
+    # wcześniej modułem json wczytywane są przez json)
+    with open(json_file, "rb") as f:
+        raw = f.read()
+    try:
+        locations = orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        locations = json.loads(raw)
 
     if not locations:
         print("Plik JSON jest pusty lub nie zawiera prawidłowych danych!")
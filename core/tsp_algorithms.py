@@ -1,6 +1,34 @@
 import time
 
-import networkx as nx
+import numpy as np
+import numba
+from numba import njit, prange
+from scipy.sparse.csgraph import depth_first_order, minimum_spanning_tree
+
+from config import TWO_OPT_NEIGHBORS
+
+
+def _sprawdz_macierz(distances, n):
+    """
+    Sprawdza, czy macierz odległości jest kompletna.
+
+    Algorytmy odczytują odległości bezpośrednio z macierzy, więc brakująca
+    (nieskończona lub NaN) wartość oznaczałaby błędną trasę, a nie "darmową"
+    krawędź.
+
+    Args:
+        distances (np.ndarray): Macierz odległości
+        n (int): Oczekiwana liczba punktów
+
+    Raises:
+        ValueError: Jeśli macierz ma zły rozmiar lub zawiera brakujące wartości
+    """
+    if distances.shape[0] < n or distances.shape[1] < n:
+        raise ValueError(
+            f"Macierz odległości {distances.shape} jest za mała dla {n} punktów"
+        )
+    if not np.isfinite(distances[:n, :n]).all():
+        raise ValueError("Macierz odległości zawiera brakujące wartości")
 
 
 def run_nearest_neighbor(distances, n, num_threads=1):
@@ -8,7 +36,7 @@ def run_nearest_neighbor(distances, n, num_threads=1):
     Implementacja algorytmu najbliższego sąsiada dla TSP.
 
     Args:
-        distances (dict): Słownik odległości między punktami
+        distances (np.ndarray): Macierz NxN odległości między punktami
         n (int): Liczba punktów
         num_threads (int): Liczba wątków
 
@@ -16,64 +44,320 @@ def run_nearest_neighbor(distances, n, num_threads=1):
         tuple: (ścieżka, odległość, czas_wykonania)
     """
     start_time = time.time()
+    _sprawdz_macierz(distances, n)
 
-    path = [0]  # Zaczynamy od pierwszego punktu
-    unvisited = set(range(1, n))
-    total_distance = 0
+    visited = np.zeros(n, dtype=bool)
+    visited[0] = True  # Zaczynamy od pierwszego punktu
+    path = np.zeros(n + 1, dtype=np.int64)  # Ostatni element to powrót do 0
 
-    while unvisited:
-        current = path[-1]
-        nearest = min(
-            unvisited, key=lambda x: distances.get((current, x), float("inf"))
-        )
-        path.append(nearest)
-        unvisited.remove(nearest)
-        total_distance += distances.get((current, nearest), 0)
+    current = 0
+    for k in range(1, n):
+        # Najbliższy nieodwiedzony punkt - odwiedzone maskujemy nieskończonością
+        row = np.where(visited, np.inf, distances[current])
+        current = int(row.argmin())
+        path[k] = current
+        visited[current] = True
 
-    # Dodaj powrót do punktu startowego
-    path.append(0)
-    total_distance += distances.get((path[-2], 0), 0)
+    total_distance = float(distances[path[:-1], path[1:]].sum())
+    path = path.tolist()
 
     return path, total_distance, time.time() - start_time
 
 
+def _najblizsi_sasiedzi(distances, k):
+    """
+    Wyznacza k najbliższych sąsiadów każdego punktu.
+
+    Args:
+        distances (np.ndarray): Macierz NxN odległości między punktami
+        k (int): Liczba sąsiadów
+
+    Returns:
+        np.ndarray: Macierz Nxk indeksów sąsiadów, od najbliższego
+    """
+    masked = distances.copy()
+    np.fill_diagonal(masked, np.inf)
+    neighbors = np.argpartition(masked, k - 1, axis=1)[:, :k]
+    order = np.take_along_axis(masked, neighbors, axis=1).argsort(axis=1)
+    return np.ascontiguousarray(np.take_along_axis(neighbors, order, axis=1))
+
+
+@njit(cache=True)
+def _odwroc_odcinek(tour, pos, i, j):
+    """
+    Odwraca cykliczny odcinek trasy od pozycji i do j (włącznie).
+
+    Gdy odcinek jest dłuższy niż połowa trasy, odwracane jest jego
+    dopełnienie - daje to ten sam cykl (w przeciwnym kierunku).
+    """
+    n = tour.shape[0]
+    length = (j - i) % n + 1
+    if 2 * length > n:
+        i, j = (j + 1) % n, (i - 1) % n
+        length = n - length
+
+    for _ in range(length // 2):
+        a = tour[i]
+        b = tour[j]
+        tour[i] = b
+        pos[b] = i
+        tour[j] = a
+        pos[a] = j
+        i = (i + 1) % n
+        j = (j - 1) % n
+
+
+@njit(cache=True, fastmath=True)
+def _two_opt_numba(tour, distances, neighbors):
+    """
+    Poprawia cykl w miejscu ruchami 2-opt ograniczonymi do najbliższych sąsiadów.
+
+    Punkty czekają w kolejce; punkt, którego otoczenie nie dało poprawy,
+    dostaje bit "don't look" i wraca do kolejki dopiero, gdy zmieni się
+    jedna z jego krawędzi.
+
+    Args:
+        tour (np.ndarray): Cykl (int64, bez powtórzonego punktu startowego),
+            modyfikowany w miejscu
+        distances (np.ndarray): Macierz NxN odległości między punktami
+        neighbors (np.ndarray): Macierz Nxk najbliższych sąsiadów (rosnąco)
+
+    Returns:
+        float: Łączna zmiana długości trasy (wartość ujemna lub zero)
+    """
+    n = tour.shape[0]
+    pos = np.empty(n, dtype=np.int64)
+    queue = np.empty(n, dtype=np.int64)
+    dont_look = np.zeros(n, dtype=np.bool_)
+    for k in range(n):
+        pos[tour[k]] = k
+        queue[k] = tour[k]
+    head = 0
+    count = n
+    delta_total = 0.0
+
+    while count > 0:
+        a = queue[head]
+        head = (head + 1) % n
+        count -= 1
+        dont_look[a] = True
+
+        improved = False
+        for direction in range(2):
+            i = pos[a]
+            # Krawędź (a, b): do następnika lub (drugi kierunek) do poprzednika
+            b = tour[(i + 1) % n] if direction == 0 else tour[(i - 1) % n]
+            d_ab = distances[a, b]
+
+            for k in range(neighbors.shape[1]):
+                c = neighbors[a, k]
+                d_ac = distances[a, c]
+                # Sąsiedzi są posortowani - dalsi nie dadzą już poprawy
+                if d_ac >= d_ab:
+                    break
+
+                j = pos[c]
+                d = tour[(j + 1) % n] if direction == 0 else tour[(j - 1) % n]
+                if c == b or d == a:
+                    continue
+
+                delta = d_ac + distances[b, d] - d_ab - distances[c, d]
+                if delta < -1e-10:
+                    # Krawędzie (a, b), (c, d) zastępujemy przez (a, c), (b, d)
+                    if direction == 0:
+                        _odwroc_odcinek(tour, pos, (i + 1) % n, j)
+                    else:
+                        _odwroc_odcinek(tour, pos, i, (j - 1) % n)
+                    delta_total += delta
+
+                    # Punkty zmienionych krawędzi wracają do kolejki
+                    for city in (a, b, c, d):
+                        if dont_look[city]:
+                            dont_look[city] = False
+                            queue[(head + count) % n] = city
+                            count += 1
+                    improved = True
+                    break
+            if improved:
+                break
+
+    return delta_total
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def _two_opt_polish_numba(path, distances):
+    """
+    Dopracowuje ścieżkę pełnymi przebiegami 2-opt (best improvement).
+
+    Każdy przebieg przeszukuje równolegle (prange po i) wszystkie pary
+    krawędzi, po czym wykonywana jest jedna najlepsza zamiana. Wyłapuje
+    poprawy, których nie widać w listach najbliższych sąsiadów.
+
+    Args:
+        path (np.ndarray): Ścieżka zamknięta (int64), modyfikowana w miejscu
+        distances (np.ndarray): Macierz NxN odległości między punktami
+
+    Returns:
+        float: Łączna zmiana długości ścieżki (wartość ujemna lub zero)
+    """
+    m = path.shape[0]
+    best_delta = np.zeros(m, dtype=np.float64)
+    best_j = np.full(m, -1, dtype=np.int64)
+    delta_total = 0.0
+
+    while True:
+        for i in prange(1, m - 2):
+            a = path[i - 1]
+            b = path[i]
+            d_ab = distances[a, b]
+            row_delta = -1e-10
+            row_j = -1
+            for j in range(i + 1, m - 1):
+                c = path[j]
+                d = path[j + 1]
+                delta = distances[a, c] + distances[b, d] - d_ab - distances[c, d]
+                if delta < row_delta:
+                    row_delta = delta
+                    row_j = j
+            best_delta[i] = row_delta
+            best_j[i] = row_j
+
+        # Redukcja: najlepsza zamiana w całym przebiegu
+        i_best = -1
+        delta_best = -1e-10
+        for i in range(1, m - 2):
+            if best_j[i] >= 0 and best_delta[i] < delta_best:
+                delta_best = best_delta[i]
+                i_best = i
+        if i_best < 0:
+            break
+
+        lo = i_best
+        hi = best_j[i_best]
+        while lo < hi:
+            path[lo], path[hi] = path[hi], path[lo]
+            lo += 1
+            hi -= 1
+        delta_total += delta_best
+
+    return delta_total
+
+
+@njit(parallel=True, fastmath=True, cache=True, nogil=True)
+def _two_opt_directed_numba(path, distances):
+    """
+    Pełne przebiegi 2-opt (best improvement) dla macierzy niesymetrycznej.
+
+    Odwrócenie fragmentu ścieżki zmienia kierunek jego krawędzi, więc zmiana
+    długości obejmuje - poza czterema krawędziami zamiany - różnicę sum
+    prefiksowych odcinków w obu kierunkach. Dzięki temu każda para (i, j)
+    oceniana jest w O(1), a każdy ruch rzeczywiście skraca ścieżkę.
+
+    Jądro zwalnia GIL, więc wątki Pythona (np. równolegle liczony MST) nie
+    czekają na zakończenie 2-opt. Macierz może być typu float32 (połowa
+    pamięci podręcznej na tę samą liczbę punktów) - odczytane wartości są
+    rozszerzane do float64, więc zmiany długości liczone są tak samo dokładnie.
+
+    Args:
+        path (np.ndarray): Ścieżka zamknięta (int64), modyfikowana w miejscu
+        distances (np.ndarray): Macierz NxN odległości (float32 lub float64)
+
+    Returns:
+        float: Łączna zmiana długości ścieżki (wartość ujemna lub zero)
+    """
+    m = path.shape[0]
+    forward = np.zeros(m, dtype=np.float64)
+    backward = np.zeros(m, dtype=np.float64)
+    best_delta = np.zeros(m, dtype=np.float64)
+    best_j = np.full(m, -1, dtype=np.int64)
+    delta_total = 0.0
+
+    while True:
+        for k in range(1, m):
+            forward[k] = forward[k - 1] + np.float64(distances[path[k - 1], path[k]])
+            backward[k] = backward[k - 1] + np.float64(distances[path[k], path[k - 1]])
+        # Próg względny - błędy zaokrągleń sum prefiksowych nie dają "poprawy"
+        eps = -1e-12 * max(1.0, forward[m - 1])
+
+        for i in prange(1, m - 2):
+            a = path[i - 1]
+            b = path[i]
+            d_ab = np.float64(distances[a, b])
+            row_delta = eps
+            row_j = -1
+            for j in range(i + 1, m - 1):
+                c = path[j]
+                d = path[j + 1]
+                delta = (
+                    np.float64(distances[a, c])
+                    + np.float64(distances[b, d])
+                    - d_ab
+                    - np.float64(distances[c, d])
+                    - (forward[j] - forward[i])
+                    + (backward[j] - backward[i])
+                )
+                if delta < row_delta:
+                    row_delta = delta
+                    row_j = j
+            best_delta[i] = row_delta
+            best_j[i] = row_j
+
+        # Redukcja: najlepsza zamiana w całym przebiegu
+        i_best = -1
+        delta_best = eps
+        for i in range(1, m - 2):
+            if best_j[i] >= 0 and best_delta[i] < delta_best:
+                delta_best = best_delta[i]
+                i_best = i
+        if i_best < 0:
+            break
+
+        lo = i_best
+        hi = best_j[i_best]
+        while lo < hi:
+            path[lo], path[hi] = path[hi], path[lo]
+            lo += 1
+            hi -= 1
+        delta_total += delta_best
+
+    return delta_total
+
+
 def run_two_opt(path, initial_distance, distances, num_threads=1):
     """
-    Implementacja algorytmu 2-opt dla TSP.
+    Implementacja algorytmu 2-opt dla TSP (listy sąsiadów i bity "don't look").
 
     Args:
-        path (list): Początkowa ścieżka
+        path (list): Początkowa ścieżka zamknięta (zaczyna i kończy się w 0)
         initial_distance (float): Początkowa odległość
-        distances (dict): Słownik odległości między punktami
+        distances (np.ndarray): Macierz NxN odległości między punktami
         num_threads (int): Liczba wątków
 
     Returns:
         tuple: (ścieżka, odległość, czas_wykonania)
     """
     start_time = time.time()
-    best_path = path.copy()
-    best_distance = initial_distance
-    improved = True
+    distances = np.ascontiguousarray(distances, dtype=np.float64)
+    _sprawdz_macierz(distances, len(distances))
 
-    while improved:
-        improved = False
-        for i in range(1, len(path) - 2):
-            for j in range(i + 1, len(path) - 1):
-                # Oblicz zmianę odległości po zamianie
-                old_dist = distances.get((path[i - 1], path[i]), 0) + distances.get(
-                    (path[j], path[j + 1]), 0
-                )
-                new_dist = distances.get((path[i - 1], path[j]), 0) + distances.get(
-                    (path[i], path[j + 1]), 0
-                )
+    # Cykl bez powtórzonego punktu startowego
+    tour = np.asarray(path[:-1], dtype=np.int64).copy()
+    n = len(tour)
+    if n < 4:
+        return list(path), initial_distance, time.time() - start_time
 
-                if new_dist < old_dist:
-                    # Wykonaj zamianę
-                    path[i : j + 1] = path[j : i - 1 : -1]
-                    best_distance += new_dist - old_dist
-                    improved = True
+    neighbors = _najblizsi_sasiedzi(distances, min(TWO_OPT_NEIGHBORS, n - 1))
+    best_distance = initial_distance + _two_opt_numba(tour, distances, neighbors)
+
+    # Obróć cykl tak, by zaczynał się i kończył w punkcie startowym
+    tour = np.roll(tour, -int(np.flatnonzero(tour == path[0])[0]))
+    best_path = np.append(tour, tour[0])
 
-    return path, best_distance, time.time() - start_time
+    # Pełne przebiegi na num_threads wątkach dopracowują wynik list sąsiadów
+    numba.set_num_threads(max(1, min(num_threads, numba.config.NUMBA_NUM_THREADS)))
+    best_distance += _two_opt_polish_numba(best_path, distances)
+
+    return best_path.tolist(), best_distance, time.time() - start_time
 
 
 def run_mst(distances, n, num_threads=1):
@@ -81,7 +365,7 @@ def run_mst(distances, n, num_threads=1):
     Implementacja algorytmu MST dla TSP.
 
     Args:
-        distances (dict): Słownik odległości między punktami
+        distances (np.ndarray): Macierz NxN odległości między punktami
         n (int): Liczba punktów
         num_threads (int): Liczba wątków
 
@@ -89,23 +373,57 @@ def run_mst(distances, n, num_threads=1):
         tuple: (ścieżka, odległość, czas_wykonania)
     """
     start_time = time.time()
+    _sprawdz_macierz(distances, n)
 
-    # Tworzymy graf
-    G = nx.Graph()
-    for i in range(n):
-        for j in range(i + 1, n):
-            G.add_edge(i, j, weight=distances.get((i, j), float("inf")))
+    # Graf pełny jako górny trójkąt macierzy; csgraph traktuje zera jako brak
+    # krawędzi, więc punkty o tych samych współrzędnych dostają minimalną wagę
+    weights = np.triu(np.asarray(distances, dtype=np.float64)[:n, :n], k=1)
+    upper = np.triu(np.ones((n, n), dtype=bool), k=1)
+    weights[upper & (weights <= 0)] = np.finfo(np.float64).tiny
 
     # Znajdujemy MST
-    mst = nx.minimum_spanning_tree(G)
+    mst = minimum_spanning_tree(weights)
 
     # Przechodzimy MST w kolejności pre-order
-    path = list(nx.dfs_preorder_nodes(mst, 0))
+    order = depth_first_order(mst, 0, directed=False, return_predecessors=False)
+    path = order.tolist()
     path.append(0)  # Dodaj powrót do punktu startowego
 
     # Oblicz całkowitą odległość
-    total_distance = 0
-    for i in range(len(path) - 1):
-        total_distance += distances.get((path[i], path[i + 1]), 0)
+    total_distance = float(distances[path[:-1], path[1:]].sum())
 
     return path, total_distance, time.time() - start_time
+
+
+def run_two_opt_directed(path, initial_distance, distances, num_threads=1):
+    """
+    Implementacja algorytmu 2-opt dla niesymetrycznej macierzy odległości.
+
+    W przeciwieństwie do run_two_opt zmiana długości uwzględnia odwrócony
+    kierunek krawędzi wewnątrz zamienianego fragmentu, więc wynik jest
+    dokładny także dla odległości drogowych różnych w obie strony.
+
+    Args:
+        path (list): Początkowa ścieżka zamknięta (zaczyna i kończy się w 0)
+        initial_distance (float): Początkowa odległość
+        distances (np.ndarray): Macierz NxN odległości (float32 lub float64)
+        num_threads (int): Liczba wątków
+
+    Returns:
+        tuple: (ścieżka, odległość, czas_wykonania)
+    """
+    start_time = time.time()
+    # Macierz float32 przekazywana bez kopiowania - jądro ma osobną
+    # specjalizację dla każdego typu
+    dtype = np.float32 if distances.dtype == np.float32 else np.float64
+    distances = np.ascontiguousarray(distances, dtype=dtype)
+    _sprawdz_macierz(distances, len(distances))
+
+    best_path = np.asarray(path, dtype=np.int64).copy()
+    if len(best_path) < 5:
+        return list(path), initial_distance, time.time() - start_time
+
+    numba.set_num_threads(max(1, min(num_threads, numba.config.NUMBA_NUM_THREADS)))
+    best_distance = initial_distance + _two_opt_directed_numba(best_path, distances)
+
+    return best_path.tolist(), best_distance, time.time() - start_time
@@ -1,133 +1,495 @@
+import contextlib
+import functools
+import gzip
 import json
+import logging
+import logging.handlers
+import mmap
 import os
+import queue
+import random
+import re
+import signal
+import sqlite3
+import sys
+import tempfile
+import threading
 import time
 import traceback
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
 import folium
+import numpy as np
+import orjson
 import pandas as pd
+from folium.plugins import FastMarkerCluster
+from geopy.adapters import RequestsAdapter
 from geopy.distance import geodesic
 from geopy.exc import GeocoderServiceError, GeocoderTimedOut
+from geopy.extra.rate_limiter import RateLimiter
 from geopy.geocoders import Nominatim
 
+from config import (
+    GEOLOCATION_MIN_INTERVAL,
+    GEOLOCATION_WORKERS,
+    MARKER_CLUSTER_OPTIONS,
+    NOMINATIM_USER_AGENT,
+)
+
+# Komunikaty o pojedynczych adresach (wiele na adres, także z wątków
+# roboczych) - przez logging z leniwym formatowaniem zamiast print
+logger = logging.getLogger("geocode")
+logger.setLevel(logging.INFO)
+
+# Trwały cache geolokalizacji (znormalizowany adres -> współrzędne)
+GEOCODE_DB_FILE = os.path.join("cache", "geocode_cache.sqlite")
+# Czas ważności wyniku negatywnego (adres nieznaleziony) w sekundach
+GEOCODE_NEGATIVE_TTL = 24 * 3600
+
+# Maksymalna liczba wyników geolokalizacji trzymanych w pamięci procesu
+GEOCODE_MEMORY_SIZE = 10_000
+
+_geocode_db = None
+_geocode_db_lock = threading.Lock()
+
+# Wyniki z bieżącego przebiegu (klucz -> (lat, lng, ts)) przed zapytaniem SQL
+_geocode_memo = {}
+
+# Lekki punkt kontrolny dostępności Nominatim (bez wykonywania geokodowania)
+NOMINATIM_STATUS_URL = "https://nominatim.openstreetmap.org/status.php"
+# Jak długo (w sekundach) wynik sprawdzenia statusu jest uznawany za aktualny
+NOMINATIM_STATUS_TTL = 60
+
+# Ostatni wynik sprawdzenia statusu: (czas sprawdzenia, dostępność)
+_status_serwisu = None
+
+# Markery warstw mapy budowane po stronie przeglądarki z wierszy danych
+# (jeden blok JS na warstwę zamiast osobnych obiektów folium na punkt)
+LOKALIZACJA_CALLBACK = """
+function (row) {
+    var marker = L.marker(new L.LatLng(row[0], row[1]));
+    marker.bindPopup(row[2], {maxWidth: 300});
+    marker.bindTooltip(row[3]);
+    return marker;
+};
+"""
+
+NUMER_CALLBACK = """
+function (row) {
+    var icon = L.divIcon({
+        className: "",
+        iconSize: [24, 24],
+        iconAnchor: [12, 12],
+        html: '<div style="width: 24px; height: 24px; border-radius: 50%; ' +
+              'background-color: rgba(255, 0, 0, 0.7); border: 2px solid red; ' +
+              'box-sizing: border-box; line-height: 20px; font-size: 10pt; ' +
+              'color: white; text-align: center; font-weight: bold;">' +
+              row[2] + '</div>'
+    });
+    var marker = L.marker(new L.LatLng(row[0], row[1]), {icon: icon});
+    marker.bindPopup("Numer: " + row[2]);
+    return marker;
+};
+"""
+
+ADRES_CALLBACK = """
+function (row) {
+    var icon = L.divIcon({
+        className: "",
+        iconSize: [200, 20],
+        iconAnchor: [100, -20],
+        html: '<div style="font-size: 9pt; color: black; ' +
+              'background-color: white; padding: 2px; ' +
+              'border-radius: 3px; text-align: center;">' + row[2] + '</div>'
+    });
+    return L.marker(new L.LatLng(row[0], row[1]), {icon: icon});
+};
+"""
+
+# Co ile wpisów / sekund dziennik zmian współrzędnych jest zapisywany na dysk
+DZIENNIK_FLUSH_WPISY = 50
+DZIENNIK_FLUSH_S = 10
+
+# Katalog kopii wczytanych arkuszy Excel (DataFrame zapisany po parsowaniu)
+EXCEL_CACHE_DIR = "cache"
+
+# Wspólny geokoder dla całego modułu - jedna sesja requests z pulą połączeń
+# keep-alive zamiast nowego połączenia TCP+TLS dla każdego adresu
+_GEO = Nominatim(
+    user_agent=NOMINATIM_USER_AGENT,
+    adapter_factory=functools.partial(
+        RequestsAdapter, pool_connections=4, pool_maxsize=8
+    ),
+)
+
+# Globalny (współdzielony przez wątki) limit częstotliwości zapytań - zastępuje
+# stałe time.sleep przed każdym zapytaniem; błędy obsługuje kod wywołujący
+_geocode = RateLimiter(
+    _GEO.geocode,
+    min_delay_seconds=GEOLOCATION_MIN_INTERVAL,
+    max_retries=0,
+    swallow_exceptions=False,
+)
+
+_SKROT_ULICY_RE = re.compile(r"\bul(?:ica)?\b\.?")
+_INTERPUNKCJA_RE = re.compile(r"[^\w\s]")
+_HAS_DIGIT = re.compile(r"\d").search
+_PREFIKS_ULICY_RE = re.compile(r"^(?:ul\.|ulica\b)\s*", re.IGNORECASE)
+
+# Liczba rekordów, od której przetwarzanie wstępne dzielone jest na procesy
+# (dla mniejszych plików start puli kosztuje więcej niż samo przetwarzanie)
+MIN_REKORDOW_ROWNOLEGLE = 5000
+
+
+@functools.lru_cache(maxsize=GEOCODE_MEMORY_SIZE)
+def _normalizuj_adres(adres):
+    """
+    Sprowadza adres do postaci kanonicznej używanej jako klucz cache.
+
+    Postać Unicode NFKC, małe litery, bez skrótu "ul."/"ulica", bez
+    interpunkcji i nadmiarowych spacji - drobne różnice zapisu tego samego
+    adresu (także rozłożone polskie znaki) dają ten sam klucz.
+
+    Args:
+        adres (str): Adres w dowolnym zapisie
+
+    Returns:
+        str: Znormalizowany adres
+    """
+    adres = unicodedata.normalize("NFKC", str(adres)).lower()
+    adres = _SKROT_ULICY_RE.sub(" ", adres)
+    adres = _INTERPUNKCJA_RE.sub(" ", adres)
+    return " ".join(adres.split())
+
+
+def _polacz_z_cache_geolokalizacji():
+    """
+    Zwraca połączenie z bazą cache geolokalizacji (tworzone przy pierwszym
+    użyciu).
+
+    Returns:
+        sqlite3.Connection: Połączenie w trybie WAL z autocommit
+    """
+    global _geocode_db
+
+    with _geocode_db_lock:
+        if _geocode_db is None:
+            os.makedirs(os.path.dirname(GEOCODE_DB_FILE), exist_ok=True)
+            conn = sqlite3.connect(
+                GEOCODE_DB_FILE, isolation_level=None, check_same_thread=False
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache "
+                "(key TEXT PRIMARY KEY, lat REAL, lng REAL, ts INTEGER)"
+            )
+            _geocode_db = conn
+        return _geocode_db
+
+
+def _zapamietaj_geolokalizacje(klucz, row):
+    """Zapamiętuje wiersz cache w pamięci procesu (wywoływane pod blokadą)"""
+    if klucz not in _geocode_memo and len(_geocode_memo) >= GEOCODE_MEMORY_SIZE:
+        # Usuń najstarszy wpis (słownik zachowuje kolejność wstawiania)
+        del _geocode_memo[next(iter(_geocode_memo))]
+    _geocode_memo[klucz] = row
+
+
+def wczytaj_z_cache_geolokalizacji(adres):
+    """
+    Odczytuje współrzędne adresu z trwałego cache.
+
+    Wyniki odczytane lub zapisane w bieżącym przebiegu zwracane są z pamięci
+    procesu bez zapytania do bazy.
+
+    Args:
+        adres (str): Adres do wyszukania
+
+    Returns:
+        tuple | None: (latitude, longitude), (None, None) dla aktualnego
+        wyniku negatywnego lub None jeśli adresu nie ma w cache
+    """
+    try:
+        klucz = _normalizuj_adres(adres)
+        with _geocode_db_lock:
+            row = _geocode_memo.get(klucz)
+        if row is None:
+            conn = _polacz_z_cache_geolokalizacji()
+            with _geocode_db_lock:
+                row = conn.execute(
+                    "SELECT lat, lng, ts FROM cache WHERE key = ?", (klucz,)
+                ).fetchone()
+                if row is None:
+                    return None
+                _zapamietaj_geolokalizacje(klucz, row)
+
+        lat, lng, ts = row
+        if lat is None or lng is None:
+            # Wynik negatywny ważny tylko przez GEOCODE_NEGATIVE_TTL
+            if time.time() - ts > GEOCODE_NEGATIVE_TTL:
+                return None
+            return None, None
+        return lat, lng
+    except Exception as e:
+        print(f"Błąd podczas odczytu cache geolokalizacji: {str(e)}")
+        return None
+
+
+def zapisz_w_cache_geolokalizacji(adres, latitude, longitude):
+    """
+    Zapisuje współrzędne adresu (lub wynik negatywny) w trwałym cache.
+
+    Args:
+        adres (str): Adres
+        latitude (float | None): Szerokość geograficzna lub None
+        longitude (float | None): Długość geograficzna lub None
+
+    Returns:
+        bool: True jeśli operacja się powiodła
+    """
+    try:
+        klucz = _normalizuj_adres(adres)
+        row = (latitude, longitude, int(time.time()))
+        conn = _polacz_z_cache_geolokalizacji()
+        with _geocode_db_lock:
+            _zapamietaj_geolokalizacje(klucz, row)
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, lat, lng, ts) "
+                "VALUES (?, ?, ?, ?)",
+                (klucz,) + row,
+            )
+        return True
+    except Exception as e:
+        print(f"Błąd podczas zapisu cache geolokalizacji: {str(e)}")
+        return False
+
+
+def _ponawiaj_przy_bledzie(
+    proby=3,
+    opoznienie=1.0,
+    max_opoznienie=8.0,
+    wyjatki=(GeocoderTimedOut, GeocoderServiceError),
+):
+    """
+    Dekorator ponawiający wywołanie po błędach przejściowych z wykładniczo
+    rosnącym opóźnieniem i losowym rozrzutem (jitter).
+
+    Inne wyjątki przechodzą od razu, bez czekania.
+
+    Args:
+        proby (int): Maksymalna liczba wywołań
+        opoznienie (float): Opóźnienie przed pierwszym ponowieniem w sekundach
+        max_opoznienie (float): Górny limit opóźnienia w sekundach
+        wyjatki (tuple): Typy wyjątków uznawane za przejściowe
+
+    Returns:
+        callable: Dekorator
+    """
+
+    def dekorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            for proba in range(proby):
+                try:
+                    return func(*args, **kwargs)
+                except wyjatki as e:
+                    if proba == proby - 1:
+                        raise
+                    czekaj = min(max_opoznienie, opoznienie * 2**proba)
+                    czekaj += random.uniform(0, opoznienie)
+                    logger.warning(
+                        "Błąd przejściowy (%s), ponawiam za %.1f s", e, czekaj
+                    )
+                    time.sleep(czekaj)
+
+        return wrapper
+
+    return dekorator
+
+
+def _geokoduj_wariant(variant):
+    """Pojedyncze zapytanie do Nominatim o wariant adresu"""
+    logger.info("Próba geolokalizacji: %s", variant)
+    # Zwiększamy parametry dokładności
+    return _geocode(
+        variant,
+        timeout=30,  # Zwiększony timeout
+        exactly_one=True,
+        addressdetails=True,
+        language="pl",  # Dodanie języka polskiego
+        country_codes="pl",  # Ograniczenie do Polski
+    )
+
+
+@_ponawiaj_przy_bledzie(proby=4, opoznienie=1.0, max_opoznienie=30.0)
+def _geokoduj_z_ponowieniem(zapytanie, **kwargs):
+    """
+    Zapytanie do Nominatim ponawiane po błędach przejściowych (timeout,
+    HTTP 429 i 5xx) z wykładniczo rosnącym opóźnieniem
+    """
+    return _geocode(zapytanie, **kwargs)
+
 
 def geolokalizuj_adres(adres, max_retries=3, delay=1):
     """
     Konwertuje adres na współrzędne geograficzne używając Nominatim
     (OpenStreetMap)
 
+    Każdy wariant adresu sprawdzany jest raz; ponawiane są tylko zapytania
+    zakończone błędem przejściowym (timeout, błąd serwisu).
+
     Args:
         adres (str): Pełny adres do geolokalizacji
-        max_retries (int): Maksymalna liczba prób w przypadku błędu
-        delay (int): Opóźnienie między próbami w sekundach
+        max_retries (int): Maksymalna liczba prób zapytania w przypadku błędu
+        delay (int): Opóźnienie przed pierwszym ponowieniem w sekundach
+            (odstęp między zapytaniami pilnuje globalny limit częstotliwości)
 
     Returns:
         tuple: (latitude, longitude) lub (None, None) w przypadku błędu
     """
-    geolocator = Nominatim(user_agent="my_geocoder_app")
+    # Najpierw trwały cache - także wyniki negatywne z ostatnich 24h
+    cached = wczytaj_z_cache_geolokalizacji(adres)
+    if cached is not None:
+        logger.info("Współrzędne z cache dla adresu: %s", adres)
+        return cached
+
+    geokoduj = _ponawiaj_przy_bledzie(proby=max_retries, opoznienie=delay)(
+        _geokoduj_wariant
+    )
+
+    blad = False
+    for variant in _warianty_adresu(adres):
+        try:
+            location = geokoduj(variant)
+        except (GeocoderTimedOut, GeocoderServiceError) as e:
+            logger.warning("Błąd geolokalizacji dla adresu %s: %s", variant, e)
+            blad = True
+            continue
+        except Exception as e:
+            logger.warning("Niespodziewany błąd: %s", e)
+            blad = True
+            continue
 
-    # Przygotowanie lepszych wariantów adresu
-    adres_variants = [
-        f"{adres}, Polska",  # Pełny adres z krajem
-        # Bardziej precyzyjne warianty
-        f"{adres.replace(',', ', ')}, Polska",  # Poprawienie spacji
-        f"{adres.replace('Ul.', 'ulica')}, Polska",  # Zamiana skrótu
-        f"{adres.replace('Ul.', 'ul.')}, Polska",  # Zamiana skrótu
-        # Dokładniejszy format adresu
-        adres.split(",")[0].strip() + ", Polska",  # Pierwszy element
-        # Warianty z numerem budynku
-        f"{adres.split(',')[0].strip().replace(' ', ', ')}, Polska",  # Zamiana spacji
-        # NOWE WARIANTY:
-        f"{adres}, województwo {_wykryj_wojewodztwo(adres)}, Polska",  # Dodanie województwa
-        f"{adres}, powiat {_wykryj_powiat(adres)}, Polska",  # Dodanie powiatu
-        _formatuj_adres_openstreetmap(adres),  # Format OSM
-    ]
+        if location:
+            logger.info("Znaleziono lokalizację: %s", location.address)
+            # Sprawdzenie pewności wyniku
+            if hasattr(location, "raw") and "importance" in location.raw:
+                importance = location.raw["importance"]
+                logger.info("Pewność wyniku: %s", importance)
+                # Jeśli pewność jest zbyt niska, kontynuuj szukanie
+                if importance < 0.5:
+                    logger.info("Zbyt niska pewność wyniku, szukam dalej...")
+                    continue
+            zapisz_w_cache_geolokalizacji(adres, location.latitude, location.longitude)
+            return location.latitude, location.longitude
+
+    logger.info("Nie udało się znaleźć lokalizacji dla adresu: %s", adres)
+    # Wynik negatywny tylko gdy serwis odpowiedział na wszystkie zapytania -
+    # awaria sieci nie może zablokować adresu na GEOCODE_NEGATIVE_TTL
+    if not blad:
+        zapisz_w_cache_geolokalizacji(adres, None, None)
+    return None, None
 
-    # Zwiększenie parametrów dla większej dokładności
-    for attempt in range(max_retries):
-        for variant in adres_variants:
-            try:
-                # Dodajemy opóźnienie przed każdym zapytaniem
-                time.sleep(delay)
-                print(f"Próba geolokalizacji: {variant}")
-                # Zwiększamy parametry dokładności
-                location = geolocator.geocode(
-                    variant,
-                    timeout=30,  # Zwiększony timeout
-                    exactly_one=True,
-                    addressdetails=True,
-                    language="pl",  # Dodanie języka polskiego
-                    country_codes="pl",  # Ograniczenie do Polski
-                )
 
-                if location:
-                    print(f"Znaleziono lokalizację: {location.address}")
-                    # Sprawdzenie pewności wyniku
-                    if hasattr(location, "raw") and "importance" in location.raw:
-                        importance = location.raw["importance"]
-                        print(f"Pewność wyniku: {importance}")
-                        # Jeśli pewność jest zbyt niska, kontynuuj szukanie
-                        if importance < 0.5:
-                            print("Zbyt niska pewność wyniku, szukam dalej...")
-                            continue
-                    return location.latitude, location.longitude
-            except (GeocoderTimedOut, GeocoderServiceError) as e:
-                print(f"Błąd geolokalizacji dla adresu {variant}: {str(e)}")
-                time.sleep(delay * 2)  # Zwiększamy opóźnienie po błędzie
-            except Exception as e:
-                print(f"Niespodziewany błąd: {str(e)}")
-                time.sleep(delay)
-
-    print(f"Nie udało się znaleźć lokalizacji dla adresu: {adres}")
-    return None, None
+def _warianty_adresu(adres):
+    """
+    Generuje kolejne, unikalne warianty adresu do geolokalizacji.
+
+    Warianty budowane są dopiero wtedy, gdy poprzednie zawiodą (np. wykrywanie
+    województwa i powiatu), a powtórzenia są pomijane.
+
+    Args:
+        adres (str): Pełny adres do geolokalizacji
 
+    Yields:
+        str: Wariant adresu
+    """
+    seen = set()
 
+    def warianty():
+        yield f"{adres}, Polska"  # Pełny adres z krajem
+        # Bardziej precyzyjne warianty
+        yield f"{adres.replace(',', ', ')}, Polska"  # Poprawienie spacji
+        yield f"{adres.replace('Ul.', 'ulica')}, Polska"  # Zamiana skrótu
+        yield f"{adres.replace('Ul.', 'ul.')}, Polska"  # Zamiana skrótu
+        # Dokładniejszy format adresu
+        pierwszy = adres.split(",")[0].strip()
+        yield f"{pierwszy}, Polska"  # Pierwszy element
+        # Warianty z numerem budynku
+        yield f"{pierwszy.replace(' ', ', ')}, Polska"  # Zamiana spacji
+        # NOWE WARIANTY:
+        yield f"{adres}, województwo {_wykryj_wojewodztwo(adres)}, Polska"
+        powiat = _wykryj_powiat(adres)
+        if powiat:  # Pusty powiat dałby bezużyteczny wariant
+            yield f"{adres}, powiat {powiat}, Polska"
+        yield _formatuj_adres_openstreetmap(adres)  # Format OSM
+
+    for variant in warianty():
+        if variant not in seen:
+            seen.add(variant)
+            yield variant
+
+
+WOJEWODZTWA = (
+    "dolnośląskie",
+    "kujawsko-pomorskie",
+    "lubelskie",
+    "lubuskie",
+    "łódzkie",
+    "małopolskie",
+    "mazowieckie",
+    "opolskie",
+    "podkarpackie",
+    "podlaskie",
+    "pomorskie",
+    "śląskie",
+    "świętokrzyskie",
+    "warmińsko-mazurskie",
+    "wielkopolskie",
+    "zachodniopomorskie",
+)
+
+MIASTA_POWIATY = {
+    "warszawa": "warszawski",
+    "kraków": "krakowski",
+    "łódź": "łódzki",
+    "wrocław": "wrocławski",
+    "poznań": "poznański",
+    "gdańsk": "gdański",
+    "szczecin": "szczeciński",
+    "bydgoszcz": "bydgoski",
+    "lublin": "lubelski",
+    "białystok": "białostocki",
+    "katowice": "katowicki",
+}
+
+
+def _alternatywa(nazwy):
+    """Kompiluje jedno wyrażenie dopasowujące dowolną z nazw (bez wielkości liter)"""
+    # Dłuższe nazwy najpierw, aby np. "zachodniopomorskie" nie zostało
+    # dopasowane jako "pomorskie"
+    nazwy = sorted(nazwy, key=len, reverse=True)
+    return re.compile("|".join(map(re.escape, nazwy)), re.IGNORECASE)
+
+
+_WOJ_RE = _alternatywa(WOJEWODZTWA)
+_MIASTA_RE = _alternatywa(MIASTA_POWIATY)
+
+
+@functools.lru_cache(maxsize=4096)
 def _wykryj_wojewodztwo(adres):
     """Próba wykrycia województwa na podstawie adresu"""
-    wojewodztwa = [
-        "dolnośląskie",
-        "kujawsko-pomorskie",
-        "lubelskie",
-        "lubuskie",
-        "łódzkie",
-        "małopolskie",
-        "mazowieckie",
-        "opolskie",
-        "podkarpackie",
-        "podlaskie",
-        "pomorskie",
-        "śląskie",
-        "świętokrzyskie",
-        "warmińsko-mazurskie",
-        "wielkopolskie",
-        "zachodniopomorskie",
-    ]
-
-    for woj in wojewodztwa:
-        if woj.lower() in adres.lower():
-            return woj
-    return "mazowieckie"  # Domyślne województwo jeśli nie wykryto
+    m = _WOJ_RE.search(adres)
+    return m.group(0).lower() if m else "mazowieckie"  # Domyślne województwo
 
 
+@functools.lru_cache(maxsize=4096)
 def _wykryj_powiat(adres):
     """Próba wykrycia powiatu na podstawie większych miast"""
-    miasta_powiaty = {
-        "warszawa": "warszawski",
-        "kraków": "krakowski",
-        "łódź": "łódzki",
-        "wrocław": "wrocławski",
-        "poznań": "poznański",
-        "gdańsk": "gdański",
-        "szczecin": "szczeciński",
-        "bydgoszcz": "bydgoski",
-        "lublin": "lubelski",
-        "białystok": "białostocki",
-        "katowice": "katowicki",
-    }
-
-    for miasto, powiat in miasta_powiaty.items():
-        if miasto.lower() in adres.lower():
-            return powiat
-    return ""  # Pusty string jeśli nie wykryto
+    m = _MIASTA_RE.search(adres)
+    return MIASTA_POWIATY[m.group(0).lower()] if m else ""  # Pusty jeśli brak
 
 
 def _formatuj_adres_openstreetmap(adres):
@@ -139,7 +501,7 @@ def _formatuj_adres_openstreetmap(adres):
         miasto = komponenty[1].strip()
 
         # Sprawdzenie czy ulica zawiera numer
-        if any(char.isdigit() for char in ulica_nr):
+        if _HAS_DIGIT(ulica_nr):
             # Spróbuj rozdzielić ulicę od numeru
             ostatnia_spacja = ulica_nr.rfind(" ")
             if ostatnia_spacja > 0:
@@ -151,6 +513,365 @@ def _formatuj_adres_openstreetmap(adres):
     return f"{adres}, Polska"
 
 
+@contextlib.contextmanager
+def _logowanie_przez_kolejke():
+    """
+    Na czas pracy wątków roboczych kieruje komunikaty loggera do kolejki -
+    wątki tylko odkładają rekordy, a formatowaniem i zapisem zajmuje się
+    jeden wątek w tle (bez rywalizacji o blokadę strumienia wyjścia).
+    """
+    handlers = logger.handlers or logging.getLogger().handlers
+    if not handlers:
+        yield
+        return
+
+    kolejka = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(
+        kolejka, *handlers, respect_handler_level=True
+    )
+    poprzednie = logger.handlers[:], logger.propagate
+    logger.handlers = [logging.handlers.QueueHandler(kolejka)]
+    logger.propagate = False
+    listener.start()
+    try:
+        yield
+    finally:
+        listener.stop()
+        logger.handlers, logger.propagate = poprzednie
+
+
+def _geolokalizuj_rownolegle(adresy, max_workers=GEOLOCATION_WORKERS, **kwargs):
+    """
+    Geolokalizuje adresy w kilku wątkach i zwraca wyniki w kolejności
+    ukończenia.
+
+    Każdy unikalny (po normalizacji) adres geolokalizowany jest tylko raz, a
+    wynik przypisywany wszystkim rekordom z tym adresem. Wątki nakładają na
+    siebie czas oczekiwania na odpowiedź serwisu, a globalny limit
+    częstotliwości nadal pilnuje odstępu między zapytaniami.
+
+    Args:
+        adresy (list): Lista par (indeks, adres)
+        max_workers (int): Liczba wątków
+        **kwargs: Dodatkowe argumenty geolokalizuj_adres
+
+    Yields:
+        tuple: (indeks, (latitude, longitude))
+    """
+    # Znormalizowany adres -> (adres do zapytania, indeksy rekordów)
+    grupy = {}
+    for i, adres in adresy:
+        grupy.setdefault(_normalizuj_adres(adres), (adres, []))[1].append(i)
+
+    if len(grupy) < len(adresy):
+        print(
+            f"Do geolokalizacji {len(grupy)} unikalnych adresów "
+            f"dla {len(adresy)} rekordów."
+        )
+
+    with _logowanie_przez_kolejke(), ThreadPoolExecutor(
+        max_workers=max_workers
+    ) as executor:
+        futures = {
+            executor.submit(geolokalizuj_adres, adres, **kwargs): indeksy
+            for adres, indeksy in grupy.values()
+        }
+        for future in as_completed(futures):
+            wynik = future.result()
+            for i in futures[future]:
+                yield i, wynik
+
+
+def _plik_dziennika(json_file):
+    """Zwraca ścieżkę dziennika (JSON Lines) zmian współrzędnych pliku JSON"""
+    return json_file + ".wal"
+
+
+class _Dziennik:
+    """
+    Dziennik zmian współrzędnych otwarty do dopisywania.
+
+    Nowe współrzędne rekordów dopisywane są zamiast zapisywania od nowa
+    całego pliku JSON. Wpisy trafiają na dysk co DZIENNIK_FLUSH_WPISY wpisów
+    lub co DZIENNIK_FLUSH_S sekund oraz przy zamknięciu - przerwanie
+    przebiegu traci najwyżej ostatnie, niezapisane jeszcze wyniki.
+
+    Wpisy zbierane są w pamięci jako całe linie i zapisywane jednym
+    wywołaniem write na niebuforowanym pliku, więc przerwanie między
+    zapisami nie zostawia w pliku połowy wpisu.
+
+    Args:
+        json_file (str): Ścieżka do pliku JSON, którego dotyczy dziennik
+    """
+
+    def __init__(self, json_file):
+        self._plik = open(_plik_dziennika(json_file), "ab", buffering=0)
+        self._bufor = []
+        self._ostatni_zapis = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            self._zapisz()
+        finally:
+            self._plik.close()
+
+    def _zapisz(self):
+        """Zapisuje zebrane wpisy (całe linie) na dysk"""
+        if self._bufor:
+            dane = memoryview(b"".join(self._bufor))
+            while dane:
+                dane = dane[self._plik.write(dane) :]
+            self._bufor.clear()
+        self._ostatni_zapis = time.monotonic()
+
+    def dopisz(self, i, item):
+        """
+        Dopisuje do dziennika nowe współrzędne rekordu.
+
+        Args:
+            i (int): Indeks rekordu w danych
+            item (dict): Rekord po zmianie współrzędnych
+        """
+        wpis = {
+            "idx": i,
+            "adres": item.get("pełny_adres"),
+            "lat": item.get("latitude"),
+            "lng": item.get("longitude"),
+        }
+        self._bufor.append(orjson.dumps(wpis) + b"\n")
+
+        if (
+            len(self._bufor) >= DZIENNIK_FLUSH_WPISY
+            or time.monotonic() - self._ostatni_zapis >= DZIENNIK_FLUSH_S
+        ):
+            self._zapisz()
+
+
+def _odtworz_z_dziennika(json_file, data):
+    """
+    Nanosi na dane współrzędne zapisane w dzienniku przerwanego przebiegu.
+
+    Wpis jest stosowany tylko wtedy, gdy rekord o danym indeksie ma ten sam
+    pełny adres - dziennik z innej wersji danych zostanie zignorowany.
+    Niedokończony ostatni wpis (przerwany zapis) jest obcinany, aby kolejne
+    wpisy nie zostały do niego doklejone.
+
+    Args:
+        json_file (str): Ścieżka do pliku JSON
+        data (list): Dane wczytane z pliku JSON (modyfikowane w miejscu)
+
+    Returns:
+        int: Liczba odtworzonych wpisów
+    """
+    plik = _plik_dziennika(json_file)
+    if not os.path.exists(plik):
+        return 0
+
+    odtworzone = 0
+    poprawne_bajty = 0
+    with open(plik, "rb") as f:
+        for line in f:
+            # Wpis bez końca linii jest niedokończony, nawet jeśli da się go
+            # sparsować - następny wpis zostałby dopisany w tej samej linii
+            if not line.endswith(b"\n"):
+                break
+            try:
+                wpis = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                break  # Niedokończony ostatni wpis po przerwaniu zapisu
+            poprawne_bajty += len(line)
+
+            i = wpis["idx"]
+            if i < len(data) and data[i].get("pełny_adres") == wpis["adres"]:
+                data[i]["latitude"] = wpis["lat"]
+                data[i]["longitude"] = wpis["lng"]
+                odtworzone += 1
+
+    # Obetnij niedokończony wpis, aby nowe wpisy nie były do niego doklejane
+    if poprawne_bajty < os.path.getsize(plik):
+        os.truncate(plik, poprawne_bajty)
+
+    if odtworzone:
+        print(f"Odtworzono {odtworzone} zmian współrzędnych z dziennika {plik}")
+    return odtworzone
+
+
+def _dekoduj_json(raw):
+    """
+    Dekoduje JSON przy użyciu orjson.
+
+    Pliki zapisane wcześniej modułem json mogą zawierać niestandardowe
+    literały NaN, których orjson nie akceptuje - wtedy używany jest json.
+
+    Args:
+        raw (bytes | memoryview): Zawartość pliku JSON
+
+    Returns:
+        list | dict: Zdekodowane dane
+    """
+    try:
+        return orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        return json.loads(bytes(raw))
+
+
+def _wczytaj_json(json_file, domyslnie=None):
+    """
+    Wczytuje plik JSON przy użyciu orjson.
+
+    Zwykły plik jest mapowany w pamięć i parsowany bezpośrednio ze
+    zmapowanych stron, bez kopiowania całej zawartości do obiektu bytes.
+    Pliki z rozszerzeniem .gz są rozpakowywane (gzip).
+
+    Args:
+        json_file (str): Ścieżka do pliku JSON
+        domyslnie (list | dict, optional): Wynik dla pustego pliku (domyślnie
+            pusta lista rekordów)
+
+    Returns:
+        list | dict: Wczytane dane
+    """
+    with open(json_file, "rb") as f:
+        # Pustego pliku nie da się zmapować, a rozpakowanie i tak tworzy kopię
+        if json_file.endswith(".gz") or not os.fstat(f.fileno()).st_size:
+            raw = f.read()
+            if json_file.endswith(".gz"):
+                raw = gzip.decompress(raw)
+            if not raw:
+                return [] if domyslnie is None else domyslnie
+            return _dekoduj_json(raw)
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as raw:
+                return _dekoduj_json(raw)
+
+
+def _zapisz_json(json_file, data, wyczysc_dziennik=False):
+    """
+    Zapisuje pełny plik JSON atomowo (orjson, NaN zapisywane jako null).
+
+    Plik z rozszerzeniem .gz jest kompresowany gzip na najniższym poziomie -
+    wielokrotnie mniej danych na dysk przy pomijalnym koszcie CPU.
+
+    Args:
+        json_file (str): Ścieżka do pliku JSON
+        data (list): Dane do zapisania
+        wyczysc_dziennik (bool): Czy usunąć dziennik zmian współrzędnych,
+            którego wpisy zawiera już zapisany plik
+    """
+    fd, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(json_file)), suffix=".tmp"
+    )
+    try:
+        payload = orjson.dumps(
+            data,
+            option=orjson.OPT_INDENT_2
+            | orjson.OPT_NON_STR_KEYS
+            | orjson.OPT_SERIALIZE_NUMPY,
+        )
+        if json_file.endswith(".gz"):
+            payload = gzip.compress(payload, compresslevel=1)
+        with os.fdopen(fd, "wb") as f:
+            f.write(payload)
+        os.replace(temp_path, json_file)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    plik = _plik_dziennika(json_file)
+    if wyczysc_dziennik and os.path.exists(plik):
+        os.remove(plik)
+
+
+def _brak_wartosci(v):
+    """Czy wartość współrzędnej jest pusta (None, NaN lub tekst "nan")"""
+    # NaN jako jedyna wartość jest różny od samego siebie - bez wywołań
+    # funkcji dla typowej, poprawnej liczby
+    return v is None or v != v or (type(v) is str and v.lower() == "nan")
+
+
+def _brak_wspolrzednych(item):
+    """Czy rekordowi brakuje szerokości lub długości geograficznej"""
+    return _brak_wartosci(item.get("latitude")) or _brak_wartosci(item.get("longitude"))
+
+
+def _wspolrzedne_rekordow(data):
+    """
+    Buduje DataFrame rekordów z numerycznymi kolumnami współrzędnych.
+
+    Braki (None, NaN, tekst "nan" i inne nieliczbowe wartości) zamieniane są
+    na NaN jedną wektorową konwersją zamiast sprawdzania rekord po rekordzie.
+
+    Args:
+        data (list): Lista rekordów (słowników)
+
+    Returns:
+        pd.DataFrame: Rekordy z kolumnami "latitude" i "longitude" typu float
+    """
+    df = pd.DataFrame(data)
+    for key in ("latitude", "longitude"):
+        df[key] = pd.to_numeric(df[key], errors="coerce") if key in df else float("nan")
+    if "pełny_adres" not in df:
+        df["pełny_adres"] = None
+    return df
+
+
+def _tablica_wspolrzednych(data):
+    """
+    Zwraca współrzędne rekordów jako ciągłą tablicę NumPy.
+
+    Args:
+        data (list): Lista rekordów (słowników)
+
+    Returns:
+        np.ndarray: Tablica (N, 2) float64 [latitude, longitude]; braki
+        i wartości nieliczbowe jako NaN
+    """
+    coords = np.empty((len(data), 2), dtype=np.float64)
+    for j, key in enumerate(("latitude", "longitude")):
+        coords[:, j] = pd.to_numeric([item.get(key) for item in data], errors="coerce")
+    return coords
+
+
+def wczytaj_excel(excel_file):
+    """
+    Wczytuje arkusz Excel, korzystając z kopii DataFrame zapisanej przy
+    poprzednim parsowaniu.
+
+    Kopia jest używana tylko wtedy, gdy jest nowsza od pliku Excel - każda
+    zmiana arkusza wymusza ponowne parsowanie i odświeżenie kopii.
+
+    Args:
+        excel_file (str): Ścieżka do pliku Excel
+
+    Returns:
+        pd.DataFrame: Dane z arkusza
+    """
+    kopia = os.path.join(EXCEL_CACHE_DIR, os.path.basename(excel_file) + ".pkl")
+
+    try:
+        if os.path.exists(kopia) and os.path.getmtime(kopia) >= os.path.getmtime(
+            excel_file
+        ):
+            return pd.read_pickle(kopia)
+    except Exception as e:
+        print(f"Błąd podczas odczytu kopii arkusza {kopia}: {str(e)}")
+
+    df = pd.read_excel(excel_file, engine="openpyxl")
+
+    try:
+        os.makedirs(EXCEL_CACHE_DIR, exist_ok=True)
+        df.to_pickle(kopia)
+    except Exception as e:
+        print(f"Błąd podczas zapisu kopii arkusza {kopia}: {str(e)}")
+
+    return df
+
+
 def excel_to_json(excel_file, json_file=None):
     """
     Konwertuje plik Excel na format JSON z geolokalizacją adresów
@@ -162,7 +883,7 @@ def excel_to_json(excel_file, json_file=None):
     """
     try:
         # Wczytanie pliku Excel
-        df = pd.read_excel(excel_file)
+        df = wczytaj_excel(excel_file)
 
         # Jeśli nie podano nazwy pliku wyjściowego, użyj nazwy pliku Excel
         if json_file is None:
@@ -170,32 +891,38 @@ def excel_to_json(excel_file, json_file=None):
 
         # Sprawdź, czy plik JSON już istnieje i wczytaj go
         if os.path.exists(json_file):
-            with open(json_file, "r", encoding="utf-8") as f:
-                existing_data = json.load(f)
-                # Konwertuj istniejące dane do DataFrame
-                existing_df = pd.DataFrame(existing_data)
-
-                # Aktualizuj tylko rekordy bez współrzędnych
-                merged_df = df.copy()
-                if (
-                    "latitude" in existing_df.columns
-                    and "longitude" in existing_df.columns
-                ):
-                    for index, row in existing_df.iterrows():
-                        if pd.notna(row["latitude"]) and pd.notna(row["longitude"]):
-                            # Znajdź odpowiadający rekord w df
-                            matching_rows = merged_df[
-                                merged_df["pełny_adres"] == row["pełny_adres"]
-                            ]
-                            if not matching_rows.empty:
-                                merged_df.loc[matching_rows.index[0], "latitude"] = row[
-                                    "latitude"
-                                ]
-                                merged_df.loc[matching_rows.index[0], "longitude"] = (
-                                    row["longitude"]
-                                )
-
-                df = merged_df
+            existing_data = _wczytaj_json(json_file)
+            # Konwertuj istniejące dane do DataFrame
+            existing_df = pd.DataFrame(existing_data)
+
+            # Przenieś znane współrzędne jednym złączeniem po adresie
+            merged_df = df.copy()
+            if "latitude" in existing_df.columns and "longitude" in existing_df.columns:
+                znane = (
+                    existing_df.dropna(subset=["latitude", "longitude"])
+                    .drop_duplicates("pełny_adres", keep="last")
+                    .loc[:, ["pełny_adres", "latitude", "longitude"]]
+                )
+                merged_df = df.merge(
+                    znane,
+                    on="pełny_adres",
+                    how="left",
+                    suffixes=("_excel", ""),
+                )
+
+                # Współrzędne z JSON mają pierwszeństwo przed tymi z Excela
+                for key in ("latitude", "longitude"):
+                    if f"{key}_excel" in merged_df:
+                        merged_df[key] = merged_df[key].combine_first(
+                            merged_df.pop(f"{key}_excel")
+                        )
+
+                merged_df = merged_df[
+                    list(df.columns)
+                    + [c for c in ("latitude", "longitude") if c not in df]
+                ]
+
+            df = merged_df
 
         # Konwersja DataFrame do listy słowników
         data = df.to_dict(orient="records")
@@ -204,31 +931,32 @@ def excel_to_json(excel_file, json_file=None):
         print("Rozpoczynam geolokalizację adresów...")
         geolokalizowane = 0
 
-        for i, item in enumerate(data):
-            if "pełny_adres" in item and (
-                pd.isna(item.get("latitude")) or pd.isna(item.get("longitude"))
+        # Wyniki przerwanego przebiegu zapisane w dzienniku
+        _odtworz_z_dziennika(json_file, data)
+
+        do_geolokalizacji = [
+            (i, item["pełny_adres"])
+            for i, item in enumerate(data)
+            if "pełny_adres" in item and _brak_wspolrzednych(item)
+        ]
+
+        with _Dziennik(json_file) as dziennik:
+            for processed, (i, (latitude, longitude)) in enumerate(
+                _geolokalizuj_rownolegle(do_geolokalizacji), 1
             ):
-                latitude, longitude = geolokalizuj_adres(item["pełny_adres"])
-                item["latitude"] = latitude
-                item["longitude"] = longitude
+                data[i]["latitude"] = latitude
+                data[i]["longitude"] = longitude
 
                 if latitude is not None and longitude is not None:
                     geolokalizowane += 1
+                    # Każdy wynik od razu w dzienniku zamiast zapisu całego pliku
+                    dziennik.dopisz(i, data[i])
 
-                # Zapisuj co 10 rekordów lub na końcu
-                if (i + 1) % 10 == 0 or i == len(data) - 1:
-                    with open(json_file, "w", encoding="utf-8") as f:
-                        json.dump(data, f, ensure_ascii=False, indent=4)
-                    print(
-                        f"Zapisano częściowe wyniki. Przetworzono {i+1}/{len(data)} adresów."
-                    )
-
-                # Dodaj opóźnienie, aby nie przeciążyć API
-                time.sleep(1.5)  # Zwiększamy opóźnienie dla większej pewności
+                if processed % 10 == 0 or processed == len(do_geolokalizacji):
+                    print(f"Przetworzono {processed}/{len(do_geolokalizacji)} adresów.")
 
         # Zapis do pliku JSON (ostateczny)
-        with open(json_file, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
+        _zapisz_json(json_file, data, wyczysc_dziennik=True)
 
         print(f"Pomyślnie przekonwertowano {excel_file} do {json_file}")
         print(f"Geolokalizowano {geolokalizowane} nowych adresów")
@@ -238,6 +966,69 @@ def excel_to_json(excel_file, json_file=None):
         return None
 
 
+def _uzupelnij_geolokalizacje(data, json_file):
+    """
+    Uzupełnia brakujące współrzędne geograficzne rekordów w pamięci
+
+    Args:
+        data (list): Lista rekordów (modyfikowana w miejscu)
+        json_file (str): Ścieżka do pliku JSON, którego dziennik zmian
+            współrzędnych jest uzupełniany
+
+    Returns:
+        int: Liczba uzupełnionych adresów
+    """
+    # Sprawdzamy dostępność serwisu
+    if not sprawdz_status_serwisu_geolokalizacji():
+        print(
+            "Serwis geolokalizacji jest niedostępny. Próbuję kontynuować z istniejącymi danymi."
+        )
+
+    # Licznik uzupełnionych adresów
+    uzupelnione = 0
+
+    # Jedna wektorowa maska rekordów z adresem i bez współrzędnych
+    df = _wspolrzedne_rekordow(data)
+    mask = df["pełny_adres"].notna() & (df["latitude"].isna() | df["longitude"].isna())
+    total_to_process = int(mask.sum())
+
+    print(f"Znaleziono {total_to_process} adresów do geolokalizacji.")
+
+    if total_to_process == 0:
+        print("Wszystkie adresy mają już współrzędne geograficzne.")
+        return 0
+
+    # Rekordy bez współrzędnych geolokalizowane równolegle
+    do_geolokalizacji = list(df.loc[mask, "pełny_adres"].items())
+
+    with _Dziennik(json_file) as dziennik:
+        for processed, (i, (latitude, longitude)) in enumerate(
+            _geolokalizuj_rownolegle(do_geolokalizacji, max_retries=5, delay=2),
+            1,
+        ):
+            item = data[i]
+            logger.info(
+                "Przetworzono %s/%s: %s",
+                processed,
+                total_to_process,
+                item["pełny_adres"],
+            )
+            if latitude is not None and longitude is not None:
+                item["latitude"] = latitude
+                item["longitude"] = longitude
+                uzupelnione += 1
+                # Każdy wynik od razu w dzienniku zamiast zapisu całego pliku
+                dziennik.dopisz(i, item)
+                logger.info("Uzupełniono współrzędne dla: %s", item["pełny_adres"])
+            else:
+                logger.info(
+                    "Nie udało się znaleźć współrzędnych dla: %s", item["pełny_adres"]
+                )
+
+    print(f"Zakończono uzupełnianie współrzędnych. Uzupełniono {uzupelnione} adresów.")
+    return uzupelnione
+
+
 def uzupelnij_geolokalizacje(json_file):
     """
     Uzupełnia brakujące współrzędne geograficzne w pliku JSON
@@ -249,87 +1040,15 @@ def uzupelnij_geolokalizacje(json_file):
         bool: True jeśli operacja się powiodła, False w przeciwnym przypadku
     """
     try:
-        # Sprawdzamy dostępność serwisu
-        if not sprawdz_status_serwisu_geolokalizacji():
-            print(
-                "Serwis geolokalizacji jest niedostępny. Próbuję kontynuować z istniejącymi danymi."
-            )
-
         # Wczytanie danych z JSON
-        with open(json_file, "r", encoding="utf-8") as f:
-            data = json.load(f)
-
-        # Licznik uzupełnionych adresów
-        uzupelnione = 0
-        total_to_process = len(
-            [
-                item
-                for item in data
-                if "pełny_adres" in item
-                and (
-                    item.get("latitude") is None
-                    or item.get("longitude") is None
-                    or pd.isna(item.get("latitude"))
-                    or pd.isna(item.get("longitude"))
-                    or str(item.get("latitude")).lower() == "nan"
-                    or str(item.get("longitude")).lower() == "nan"
-                )
-            ]
-        )
-
-        print(f"Znaleziono {total_to_process} adresów do geolokalizacji.")
-
-        if total_to_process == 0:
-            print("Wszystkie adresy mają już współrzędne geograficzne.")
-            return True
-
-        # Iteracja przez wszystkie rekordy
-        processed = 0
-        for i, item in enumerate(data):
-            # Sprawdzenie czy brakuje współrzędnych
-            if "pełny_adres" in item and (
-                item.get("latitude") is None
-                or item.get("longitude") is None
-                or pd.isna(item.get("latitude"))
-                or pd.isna(item.get("longitude"))
-                or str(item.get("latitude")).lower() == "nan"
-                or str(item.get("longitude")).lower() == "nan"
-            ):
-                processed += 1
-                print(
-                    f"Przetwarzanie {processed}/{total_to_process}: {item['pełny_adres']}"
-                )
-                latitude, longitude = geolokalizuj_adres(
-                    item["pełny_adres"], max_retries=5, delay=2
-                )
-                if latitude is not None and longitude is not None:
-                    item["latitude"] = latitude
-                    item["longitude"] = longitude
-                    uzupelnione += 1
-                    print(f"Uzupełniono współrzędne dla: {item['pełny_adres']}")
-                else:
-                    print(
-                        f"Nie udało się znaleźć współrzędnych dla: {item['pełny_adres']}"
-                    )
+        data = _wczytaj_json(json_file)
 
-                # Zapisywanie częściowych wyników co 3 adresy
-                if processed % 3 == 0 or processed == total_to_process:
-                    with open(json_file, "w", encoding="utf-8") as f:
-                        json.dump(data, f, ensure_ascii=False, indent=4)
-                    print(
-                        f"Zapisano częściowe wyniki. Uzupełniono {uzupelnione}/{total_to_process} adresów."
-                    )
-
-                # Dodaj opóźnienie, aby nie przeciążyć API
-                time.sleep(2)  # Zwiększono opóźnienie do 2 sekund
+        # Wyniki przerwanego przebiegu zapisane w dzienniku
+        odtworzone = _odtworz_z_dziennika(json_file, data)
 
         # Zapis zaktualizowanych danych do pliku JSON
-        with open(json_file, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
-
-        print(
-            f"Zakończono uzupełnianie współrzędnych. Uzupełniono {uzupelnione} adresów."
-        )
+        if _uzupelnij_geolokalizacje(data, json_file) or odtworzone:
+            _zapisz_json(json_file, data, wyczysc_dziennik=True)
         return True
 
     except Exception as e:
@@ -337,6 +1056,95 @@ def uzupelnij_geolokalizacje(json_file):
         return False
 
 
+def _generuj_mape(data, html_file):
+    """
+    Generuje mapę HTML z rekordów w pamięci
+
+    Args:
+        data (list): Lista rekordów (słowników)
+        html_file (str): Ścieżka do wyjściowego pliku HTML
+
+    Returns:
+        bool: True jeśli mapa została wygenerowana
+    """
+    # Filtrowanie lokalizacji z prawidłowymi współrzędnymi
+    df = _wspolrzedne_rekordow(data)
+    valid = df[df["latitude"].notna() & df["longitude"].notna()]
+
+    if valid.empty:
+        print("Brak lokalizacji z prawidłowymi współrzędnymi")
+        return False
+
+    # Obliczanie średnich współrzędnych dla centrowania mapy
+    avg_lat = valid["latitude"].mean()
+    avg_lng = valid["longitude"].mean()
+
+    # Tworzenie mapy (wektory na canvas zamiast osobnych elementów SVG)
+    mapa = folium.Map(location=[avg_lat, avg_lng], zoom_start=7, prefer_canvas=True)
+
+    # Definicja warstw
+    warstwy = {
+        "Lokalizacje": folium.FeatureGroup(name="Lokalizacje", show=True),
+        "Numery": folium.FeatureGroup(name="Numery", show=True),
+        "Adresy": folium.FeatureGroup(name="Adresy", show=True),
+    }
+
+    # Dodanie wszystkich warstw do mapy
+    for nazwa, warstwa in warstwy.items():
+        warstwa.add_to(mapa)
+
+    # Kolumny wyciągane raz dla wszystkich punktów (bez dict.get w pętli)
+    def kolumna(nazwa):
+        if nazwa not in valid:
+            return [""] * len(valid)
+        return valid[nazwa].astype(object).fillna("").astype(str).tolist()
+
+    lats = valid["latitude"].tolist()
+    lngs = valid["longitude"].tolist()
+    miasta = kolumna("Miasto")
+    ulice = kolumna("Adres")
+    kody = kolumna("Kod pocztowy")
+    numery_txt = kolumna("numer")
+    pelne_adresy = kolumna("pełny_adres")
+
+    # Dane markerów dla poszczególnych warstw - wiersze [lat, lng, ...]
+    lokalizacje = [
+        [
+            lat,
+            lng,
+            f"<b>{miasto}</b><br>"
+            f"Adres: {ulica}<br>"
+            f"Kod pocztowy: {kod}<br>"
+            f"Numer: {numer}",
+            miasto,
+        ]
+        for lat, lng, miasto, ulica, kod, numer in zip(
+            lats, lngs, miasta, ulice, kody, numery_txt
+        )
+    ]
+    numery = [list(row) for row in zip(lats, lngs, numery_txt)]
+    adresy = [list(row) for row in zip(lats, lngs, pelne_adresy)]
+
+    # Jedna warstwa klastrów na każdą warstwę danych
+    for dane, callback, nazwa in (
+        (lokalizacje, LOKALIZACJA_CALLBACK, "Lokalizacje"),
+        (numery, NUMER_CALLBACK, "Numery"),
+        (adresy, ADRES_CALLBACK, "Adresy"),
+    ):
+        FastMarkerCluster(
+            dane, callback=callback, options=MARKER_CLUSTER_OPTIONS
+        ).add_to(warstwy[nazwa])
+
+    # Dodanie kontrolki warstw
+    folium.LayerControl().add_to(mapa)
+
+    # Zapisanie mapy do pliku HTML
+    mapa.save(html_file)
+
+    print(f"Mapa została wygenerowana i zapisana jako {html_file}")
+    return True
+
+
 def generuj_mape_wielowarstwowa(json_file, html_file="index.html", show_route=False):
     """
     Generuje mapę HTML z wieloma warstwami informacji: lokalizacje, numery, adresy
@@ -350,116 +1158,52 @@ def generuj_mape_wielowarstwowa(json_file, html_file="index.html", show_route=Fa
         bool: True jeśli operacja się powiodła
     """
     try:
-        # Wczytanie danych
-        with open(json_file, "r", encoding="utf-8") as f:
-            data = json.load(f)
-
-        # Filtrowanie lokalizacji z prawidłowymi współrzędnymi
-        valid_locations = [
-            item
-            for item in data
-            if all(
-                key in item and item[key] is not None and not pd.isna(item[key])
-                for key in ["latitude", "longitude"]
-            )
-        ]
-
-        if not valid_locations:
-            print("Brak lokalizacji z prawidłowymi współrzędnymi")
-            return False
+        return _generuj_mape(_wczytaj_json(json_file), html_file)
 
-        # Obliczanie średnich współrzędnych dla centrowania mapy
-        avg_lat = sum(item["latitude"] for item in valid_locations) / len(
-            valid_locations
-        )
-        avg_lng = sum(item["longitude"] for item in valid_locations) / len(
-            valid_locations
-        )
+    except Exception as e:
+        print(f"Wystąpił błąd podczas generowania mapy: {str(e)}")
+        traceback.print_exc()
+        return False
 
-        # Tworzenie mapy
-        mapa = folium.Map(location=[avg_lat, avg_lng], zoom_start=7)
 
-        # Definicja warstw
-        warstwy = {
-            "Lokalizacje": folium.FeatureGroup(name="Lokalizacje", show=True),
-            "Numery": folium.FeatureGroup(name="Numery", show=True),
-            "Adresy": folium.FeatureGroup(name="Adresy", show=True),
-        }
+def _przetworz_fragmentami(funkcja, data):
+    """
+    Przetwarza rekordy funkcją działającą na fragmencie listy - dla dużych
+    plików równolegle w puli procesów, dla małych w bieżącym procesie.
 
-        # Dodanie wszystkich warstw do mapy
-        for nazwa, warstwa in warstwy.items():
-            warstwa.add_to(mapa)
-
-        # Dodanie obiektów do poszczególnych warstw
-        for item in valid_locations:
-            # Warstwa: Lokalizacje
-            popup_text = (
-                f"<b>{item.get('Miasto', '')}</b><br>"
-                f"Adres: {item.get('Adres', '')}<br>"
-                f"Kod pocztowy: {item.get('Kod pocztowy', '')}<br>"
-                f"Numer: {item.get('numer', '')}"
-            )
+    Args:
+        funkcja (callable): Funkcja modułu przyjmująca i zwracająca listę rekordów
+        data (list): Lista rekordów
 
-            folium.Marker(
-                location=[item["latitude"], item["longitude"]],
-                popup=folium.Popup(popup_text, max_width=300),
-                tooltip=item.get("Miasto", ""),
-            ).add_to(warstwy["Lokalizacje"])
-
-            # Warstwa: Numery
-            folium.CircleMarker(
-                location=[item["latitude"], item["longitude"]],
-                radius=12,
-                color="red",
-                fill=True,
-                fill_color="red",
-                fill_opacity=0.7,
-                popup=f"Numer: {item.get('numer', '')}",
-            ).add_to(warstwy["Numery"])
-
-            # Dodanie numeru jako tekstu
-            numer_html = (
-                '<div style="font-size: 10pt; color: white; '
-                'text-align: center; font-weight: bold;">'
-                f'{item.get("numer", "")}</div>'
-            )
+    Returns:
+        list: Przetworzone rekordy w oryginalnej kolejności
+    """
+    if len(data) < MIN_REKORDOW_ROWNOLEGLE:
+        return funkcja(data)
 
-            folium.map.Marker(
-                [item["latitude"], item["longitude"]],
-                icon=folium.DivIcon(
-                    icon_size=(20, 20), icon_anchor=(10, 10), html=numer_html
-                ),
-            ).add_to(warstwy["Numery"])
-
-            # Warstwa: Adresy
-            pelny_adres = item.get("pełny_adres", "")
-            adres_html = (
-                '<div style="font-size: 9pt; color: black; '
-                "background-color: white; padding: 2px; "
-                'border-radius: 3px; text-align: center;">'
-                f"{pelny_adres}</div>"
-            )
+    workers = os.cpu_count() or 1
+    rozmiar = -(-len(data) // workers)
+    fragmenty = [data[i : i + rozmiar] for i in range(0, len(data), rozmiar)]
 
-            folium.map.Marker(
-                [item["latitude"], item["longitude"]],
-                icon=folium.DivIcon(
-                    icon_size=(200, 20), icon_anchor=(100, -20), html=adres_html
-                ),
-            ).add_to(warstwy["Adresy"])
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return [item for wynik in executor.map(funkcja, fragmenty) for item in wynik]
 
-        # Dodanie kontrolki warstw
-        folium.LayerControl().add_to(mapa)
 
-        # Zapisanie mapy do pliku HTML
-        mapa.save(html_file)
+def _inicjalizuj_nan(data):
+    """
+    Zamienia brakujące współrzędne (NaN, "nan") rekordów w pamięci na None
 
-        print(f"Mapa została wygenerowana i zapisana jako {html_file}")
-        return True
+    Zerowane są tylko faktyczne braki (NaN lub tekst "nan") - inne wartości,
+    także tekstowe (np. "52,2297"), pozostają bez zmian, tak jak
+    w inicjalizuj_nan_wartosci w run.py.
 
-    except Exception as e:
-        print(f"Wystąpił błąd podczas generowania mapy: {str(e)}")
-        traceback.print_exc()
-        return False
+    Args:
+        data (list): Lista rekordów (modyfikowana w miejscu)
+    """
+    for item in data:
+        for key in ("latitude", "longitude"):
+            if key in item and _brak_wartosci(item[key]):
+                item[key] = None
 
 
 def inicjalizuj_nan_wartosci(json_file):
@@ -474,23 +1218,13 @@ def inicjalizuj_nan_wartosci(json_file):
     """
     try:
         # Wczytanie danych
-        with open(json_file, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        data = _wczytaj_json(json_file)
 
         # Zamiana NaN na None
-        for item in data:
-            if "latitude" in item and (
-                pd.isna(item["latitude"]) or str(item["latitude"]).lower() == "nan"
-            ):
-                item["latitude"] = None
-            if "longitude" in item and (
-                pd.isna(item["longitude"]) or str(item["longitude"]).lower() == "nan"
-            ):
-                item["longitude"] = None
+        _inicjalizuj_nan(data)
 
         # Zapis danych
-        with open(json_file, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
+        _zapisz_json(json_file, data)
 
         print(f"Zainicjalizowano wartości NaN w pliku {json_file}")
         return True
@@ -502,23 +1236,49 @@ def inicjalizuj_nan_wartosci(json_file):
 
 def sprawdz_status_serwisu_geolokalizacji():
     """
-    Sprawdza dostępność serwisu geolokalizacji przez testowe zapytanie
+    Sprawdza dostępność serwisu geolokalizacji przez stronę statusu Nominatim
+
+    Wynik jest zapamiętywany na NOMINATIM_STATUS_TTL sekund, więc kolejne
+    wywołania w krótkim czasie nie wykonują ponownego sprawdzenia.
 
     Returns:
         bool: True jeśli serwis jest dostępny, False w przeciwnym przypadku
     """
+    global _status_serwisu
+
+    if (
+        _status_serwisu is not None
+        and time.time() - _status_serwisu[0] < NOMINATIM_STATUS_TTL
+    ):
+        return _status_serwisu[1]
+
     try:
-        geolocator = Nominatim(user_agent="test_service")
-        location = geolocator.geocode("Warszawa, Polska", timeout=10)
-        if location:
+        # Sesja geokodera - to samo połączenie keep-alive co zapytania
+        response = _GEO.adapter.session.head(
+            NOMINATIM_STATUS_URL,
+            timeout=3,
+            headers={"User-Agent": NOMINATIM_USER_AGENT},
+        )
+        dostepny = response.status_code == 200
+        if dostepny:
             print("Serwis geolokalizacji jest dostępny.")
-            return True
         else:
-            print("Serwis geolokalizacji zwrócił pusty wynik dla testu.")
-            return False
+            print(
+                f"Serwis geolokalizacji zwrócił kod {response.status_code} "
+                f"dla sprawdzenia statusu."
+            )
     except Exception as e:
         print(f"Serwis geolokalizacji jest niedostępny: {str(e)}")
-        return False
+        dostepny = False
+
+    _status_serwisu = (time.time(), dostepny)
+    return dostepny
+
+
+def _ponumeruj(data):
+    """Dodaje numerację (od 1) do każdego rekordu w pamięci"""
+    for i, entry in enumerate(data, 1):
+        entry["numer"] = i
 
 
 def update_json_with_numbers(json_file_path):
@@ -540,25 +1300,21 @@ def update_json_with_numbers(json_file_path):
                 return False
 
             # Wczytaj dane z Excela
-            df = pd.read_excel(excel_file)
+            df = wczytaj_excel(excel_file)
             data = df.to_dict(orient="records")
 
             # Zapisz dane do JSON
-            with open(json_file_path, "w", encoding="utf-8") as file:
-                json.dump(data, file, ensure_ascii=False, indent=4)
+            _zapisz_json(json_file_path, data)
             print(f"Utworzono nowy plik {json_file_path} z danymi z Excela")
 
         # Wczytaj dane z pliku JSON
-        with open(json_file_path, "r", encoding="utf-8") as file:
-            data = json.load(file)
+        data = _wczytaj_json(json_file_path)
 
         # Dodaj numerację do każdego wpisu
-        for i, entry in enumerate(data, 1):
-            entry["numer"] = i
+        _ponumeruj(data)
 
         # Zapisz zaktualizowane dane z powrotem do pliku
-        with open(json_file_path, "w", encoding="utf-8") as file:
-            json.dump(data, file, ensure_ascii=False, indent=4)
+        _zapisz_json(json_file_path, data)
 
         print(f"Pomyślnie zaktualizowano plik {json_file_path} z numeracją")
         return True
@@ -568,6 +1324,94 @@ def update_json_with_numbers(json_file_path):
         return False
 
 
+def _popraw_wspolrzedne(data, json_file):
+    """
+    Poprawia w pamięci rekordy, które mają identyczne współrzędne
+
+    Args:
+        data (list): Lista rekordów (modyfikowana w miejscu)
+        json_file (str): Ścieżka do pliku JSON, którego dziennik zmian
+            współrzędnych jest uzupełniany
+
+    Returns:
+        int: Liczba poprawionych adresów
+    """
+    # Współrzędne wszystkich rekordów w jednej ciągłej tablicy (N, 2)
+    coords = _tablica_wspolrzednych(data)
+    poprawne = np.flatnonzero(~np.isnan(coords).any(axis=1))
+
+    # Grupy identycznych współrzędnych - jedno sortowanie w NumPy
+    _, grupy, licznosci = np.unique(
+        coords[poprawne], axis=0, return_inverse=True, return_counts=True
+    )
+    zduplikowane = licznosci[grupy] > 1
+
+    if not zduplikowane.any():
+        print("Nie znaleziono zduplikowanych współrzędnych.")
+        return 0
+
+    print(
+        f"Znaleziono {int((licznosci > 1).sum())} zestawów "
+        f"zduplikowanych współrzędnych."
+    )
+
+    # Pozycja adresu w jego grupie duplikatów (pierwsze wystąpienie adresu
+    # w kolejności rekordów) - pierwszy adres grupy zachowuje współrzędne
+    pozycje = {}
+    rozmiary = {}
+    do_poprawy = []
+    for i, grupa in zip(poprawne[zduplikowane].tolist(), grupy[zduplikowane].tolist()):
+        pozycja = rozmiary.get(grupa, 0)
+        rozmiary[grupa] = pozycja + 1
+        index = pozycje.setdefault((grupa, data[i].get("pełny_adres")), pozycja)
+        if index:
+            do_poprawy.append((i, index))
+
+    # Próba poprawy duplikatów
+    poprawione = 0
+    with _Dziennik(json_file) as dziennik:
+        for i, index in do_poprawy:
+            item = data[i]
+            coord_key = tuple(coords[i].tolist())
+
+            print(f"Próba poprawy współrzędnych dla: {item['pełny_adres']}")
+
+            # Wymuszamy bardzo dokładny adres
+            miasto = item.get("Miasto", "").strip()
+            ulica = item.get("Adres", "").strip()
+            kod = item.get("Kod pocztowy", "").strip()
+
+            dokladny_adres = f"{ulica}, {kod} {miasto}, Polska"
+            latitude, longitude = geolokalizuj_adres(
+                dokladny_adres, max_retries=5, delay=2
+            )
+
+            if (
+                latitude is not None
+                and longitude is not None
+                and (latitude, longitude) != coord_key
+            ):
+                item["latitude"] = latitude
+                item["longitude"] = longitude
+                poprawione += 1
+                print(f"Poprawiono współrzędne dla: {item['pełny_adres']}")
+            else:
+                # Dodaj małe przesunięcie dla wizualizacji
+                item["latitude"] = coord_key[0] + (0.002 * index)
+                item["longitude"] = coord_key[1] + (0.002 * index)
+                poprawione += 1
+                print(f"Dodano przesunięcie dla: {item['pełny_adres']}")
+
+            # Każda poprawka od razu w dzienniku zamiast zapisu całego pliku
+            dziennik.dopisz(i, item)
+
+    print(
+        f"Zakończono poprawianie zduplikowanych współrzędnych. "
+        f"Poprawiono {poprawione} adresów."
+    )
+    return poprawione
+
+
 def popraw_wspolrzedne_dla_lokalizacji(json_file):
     """
     Sprawdza i poprawia przypadki, gdy wiele lokalizacji ma identyczne współrzędne
@@ -580,89 +1424,14 @@ def popraw_wspolrzedne_dla_lokalizacji(json_file):
     """
     try:
         # Wczytanie danych z JSON
-        with open(json_file, "r", encoding="utf-8") as f:
-            data = json.load(f)
-
-        # Sprawdź, czy występują duplikaty współrzędnych
-        coords_count = {}
-        for item in data:
-            if all(
-                key in item and item[key] is not None and not pd.isna(item[key])
-                for key in ["latitude", "longitude"]
-            ):
-                coord_key = f"{item['latitude']},{item['longitude']}"
-                if coord_key in coords_count:
-                    coords_count[coord_key].append(item["pełny_adres"])
-                else:
-                    coords_count[coord_key] = [item["pełny_adres"]]
-
-        # Znajdź duplikaty
-        duplicates = {k: v for k, v in coords_count.items() if len(v) > 1}
-
-        if not duplicates:
-            print("Nie znaleziono zduplikowanych współrzędnych.")
-            return True
-
-        print(f"Znaleziono {len(duplicates)} zestawów zduplikowanych współrzędnych.")
-
-        # Próba poprawy duplikatów
-        poprawione = 0
-        for i, item in enumerate(data):
-            if all(key in item for key in ["pełny_adres", "latitude", "longitude"]):
-                coord_key = f"{item['latitude']},{item['longitude']}"
-                if (
-                    coord_key in duplicates
-                    and duplicates[coord_key].index(item["pełny_adres"]) > 0
-                ):
-
-                    print(f"Próba poprawy współrzędnych dla: {item['pełny_adres']}")
-
-                    # Wymuszamy bardzo dokładny adres
-                    miasto = item.get("Miasto", "").strip()
-                    ulica = item.get("Adres", "").strip()
-                    kod = item.get("Kod pocztowy", "").strip()
-
-                    dokladny_adres = f"{ulica}, {kod} {miasto}, Polska"
-                    latitude, longitude = geolokalizuj_adres(
-                        dokladny_adres, max_retries=5, delay=2
-                    )
+        data = _wczytaj_json(json_file)
 
-                    if (
-                        latitude is not None
-                        and longitude is not None
-                        and f"{latitude},{longitude}" != coord_key
-                    ):
-                        item["latitude"] = latitude
-                        item["longitude"] = longitude
-                        poprawione += 1
-                        print(f"Poprawiono współrzędne dla: {item['pełny_adres']}")
-                    else:
-                        # Dodaj małe przesunięcie dla wizualizacji
-                        index = duplicates[coord_key].index(item["pełny_adres"])
-                        item["latitude"] = float(item["latitude"]) + (0.002 * index)
-                        item["longitude"] = float(item["longitude"]) + (0.002 * index)
-                        poprawione += 1
-                        print(f"Dodano przesunięcie dla: {item['pełny_adres']}")
-
-                    # Zapisuj częściowe wyniki co 3 poprawki
-                    if poprawione % 3 == 0:
-                        with open(json_file, "w", encoding="utf-8") as f:
-                            json.dump(data, f, ensure_ascii=False, indent=4)
-                        print(
-                            f"Zapisano częściowe wyniki. Poprawiono {poprawione} adresów."
-                        )
-
-                    # Opóźnienie dla API
-                    time.sleep(2)
+        # Poprawki przerwanego przebiegu zapisane w dzienniku
+        odtworzone = _odtworz_z_dziennika(json_file, data)
 
         # Zapis zaktualizowanych danych
-        with open(json_file, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
-
-        print(
-            f"Zakończono poprawianie zduplikowanych współrzędnych. "
-            f"Poprawiono {poprawione} adresów."
-        )
+        if _popraw_wspolrzedne(data, json_file) or odtworzone:
+            _zapisz_json(json_file, data, wyczysc_dziennik=True)
         return True
 
     except Exception as e:
@@ -670,6 +1439,63 @@ def popraw_wspolrzedne_dla_lokalizacji(json_file):
         return False
 
 
+def _popraw_format_fragmentu(items):
+    """Przygotowuje adresy do geolokalizacji dla fragmentu rekordów"""
+    for item in items:
+        miasto = item.get("Miasto", "").strip()
+        adres = item.get("Adres", "").strip()
+        kod = item.get("Kod pocztowy", "").strip()
+
+        # Dokładniejsze przetwarzanie adresu
+        # Usunięcie zbędnych spacji
+        adres = " ".join(adres.split())
+
+        # Poprawna standardyzacja ulicy (Ul., UL., Ulica, ULICA -> ul.)
+        adres = _PREFIKS_ULICY_RE.sub("ul. ", adres)
+
+        # Wyciągnięcie numeru domu i ulicy
+        ulica_parts = adres.split(" ")
+        numer_domu = ulica_parts[-1] if len(ulica_parts) > 1 else ""
+        nazwa_ulicy = " ".join(ulica_parts[:-1]) if len(ulica_parts) > 1 else adres
+
+        # Formatowanie z prefiksem ul. tylko jeśli nie ma go jeszcze
+        if not (
+            nazwa_ulicy.startswith("ul.")
+            or nazwa_ulicy.startswith("al.")
+            or nazwa_ulicy.startswith("pl.")
+        ):
+            nazwa_ulicy = "ul. " + nazwa_ulicy
+
+        # Dodanie separatora między ulicą a numerem
+        poprawny_adres = f"{nazwa_ulicy} {numer_domu}, {kod} {miasto}, Polska"
+
+        # Usunięcie podwójnych spacji
+        poprawny_adres = " ".join(poprawny_adres.split())
+
+        item["adres_do_geolokalizacji"] = poprawny_adres
+
+        print(f"Przygotowano adres: {poprawny_adres}")
+
+    return items
+
+
+def _popraw_format(data, indeksy=None):
+    """
+    Przygotowuje adresy rekordów w pamięci do geolokalizacji
+
+    Args:
+        data (list): Lista rekordów (modyfikowana w miejscu)
+        indeksy (list, optional): Indeksy rekordów do przygotowania
+            (domyślnie wszystkie)
+    """
+    if indeksy is None:
+        indeksy = range(len(data))
+
+    wynik = _przetworz_fragmentami(_popraw_format_fragmentu, [data[i] for i in indeksy])
+    for i, item in zip(indeksy, wynik):
+        data[i] = item
+
+
 def popraw_format_adresow(json_file):
     """
     Poprawia format adresów w pliku JSON i przygotowuje je do geolokalizacji
@@ -682,55 +1508,13 @@ def popraw_format_adresow(json_file):
     """
     try:
         # Wczytanie danych
-        with open(json_file, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        data = _wczytaj_json(json_file)
 
         # Poprawianie każdego rekordu
-        for item in data:
-            miasto = item.get("Miasto", "").strip()
-            adres = item.get("Adres", "").strip()
-            kod = item.get("Kod pocztowy", "").strip()
-
-            # Dokładniejsze przetwarzanie adresu
-            # Usunięcie zbędnych spacji
-            adres = " ".join(adres.split())
-
-            # Poprawna standardyzacja ulicy
-            if adres.startswith("Ul."):
-                adres = adres.replace("Ul.", "ul.")
-            elif adres.startswith("UL."):
-                adres = adres.replace("UL.", "ul.")
-            elif adres.startswith("Ulica"):
-                adres = adres.replace("Ulica", "ul.")
-            elif adres.startswith("ULICA"):
-                adres = adres.replace("ULICA", "ul.")
-
-            # Wyciągnięcie numeru domu i ulicy
-            ulica_parts = adres.split(" ")
-            numer_domu = ulica_parts[-1] if len(ulica_parts) > 1 else ""
-            nazwa_ulicy = " ".join(ulica_parts[:-1]) if len(ulica_parts) > 1 else adres
-
-            # Formatowanie z prefiksem ul. tylko jeśli nie ma go jeszcze
-            if not (
-                nazwa_ulicy.startswith("ul.")
-                or nazwa_ulicy.startswith("al.")
-                or nazwa_ulicy.startswith("pl.")
-            ):
-                nazwa_ulicy = "ul. " + nazwa_ulicy
-
-            # Dodanie separatora między ulicą a numerem
-            poprawny_adres = f"{nazwa_ulicy} {numer_domu}, {kod} {miasto}, Polska"
-
-            # Usunięcie podwójnych spacji
-            poprawny_adres = " ".join(poprawny_adres.split())
-
-            item["adres_do_geolokalizacji"] = poprawny_adres
-
-            print(f"Przygotowano adres: {poprawny_adres}")
+        _popraw_format(data)
 
         # Zapisanie zaktualizowanych danych
-        with open(json_file, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
+        _zapisz_json(json_file, data)
 
         print(f"Poprawiono format adresów w pliku {json_file}")
         return True
@@ -750,15 +1534,19 @@ def geolokalizuj_pojedynczy_adres(adres):
     Returns:
         tuple: (latitude, longitude) lub (None, None)
     """
+    # Osobna przestrzeń kluczy - wynik dokładnej geolokalizacji może różnić
+    # się od wyniku geolokalizuj_adres dla tego samego adresu
+    klucz = "dokladny|" + adres
     try:
-        geolocator = Nominatim(user_agent="jednorazowa_dokladna_geolokalizacja")
-        print(f"Geolokalizacja adresu: {adres}")
+        cached = wczytaj_z_cache_geolokalizacji(klucz)
+        if cached is not None:
+            logger.info("Współrzędne z cache dla adresu: %s", adres)
+            return cached
 
-        # Wydłużony timeout dla pojedynczego zapytania
-        time.sleep(1)  # Małe opóźnienie przed zapytaniem
+        logger.info("Geolokalizacja adresu: %s", adres)
 
-        # Zwiększenie parametrów dokładności
-        location = geolocator.geocode(
+        # Zwiększenie parametrów dokładności (wydłużony timeout)
+        location = _geokoduj_z_ponowieniem(
             adres,
             timeout=20,
             exactly_one=True,
@@ -767,43 +1555,225 @@ def geolokalizuj_pojedynczy_adres(adres):
         )
 
         if location:
-            print(f"Znaleziono lokalizację: {location.address}")
-            print(f"Współrzędne: {location.latitude}, {location.longitude}")
+            logger.info("Znaleziono lokalizację: %s", location.address)
+            logger.info("Współrzędne: %s, %s", location.latitude, location.longitude)
+
+            zapisz_w_cache_geolokalizacji(klucz, location.latitude, location.longitude)
 
             # Sprawdzenie czy adres zawiera numer budynku
-            if any(char.isdigit() for char in adres):
+            if _HAS_DIGIT(adres):
                 # Mamy numer budynku, więc powinniśmy otrzymać dokładny wynik
                 return location.latitude, location.longitude
             else:
                 # Dodatkowe sprawdzenie przy adresach bez numeru
-                print(
+                logger.info(
                     "Uwaga: Adres nie zawiera numeru budynku, "
                     "dokładność może być mniejsza."
                 )
                 return location.latitude, location.longitude
         else:
-            print(f"Nie znaleziono lokalizacji dla adresu: {adres}")
+            logger.info("Nie znaleziono lokalizacji dla adresu: %s", adres)
 
             # Spróbuj alternatywny format adresu
             alt_adres = adres.replace("ul.", "").replace(",", "")
-            print(f"Próba z alternatywnym formatem adresu: {alt_adres}")
-            time.sleep(1.5)
-            alt_location = geolocator.geocode(alt_adres, timeout=20, language="pl")
+            logger.info("Próba z alternatywnym formatem adresu: %s", alt_adres)
+            alt_location = _geokoduj_z_ponowieniem(alt_adres, timeout=20, language="pl")
 
             if alt_location:
-                print(
-                    f"Znaleziono lokalizację z alternatywnym formatem: "
-                    f"{alt_location.address}"
+                logger.info(
+                    "Znaleziono lokalizację z alternatywnym formatem: %s",
+                    alt_location.address,
+                )
+                zapisz_w_cache_geolokalizacji(
+                    klucz, alt_location.latitude, alt_location.longitude
                 )
                 return alt_location.latitude, alt_location.longitude
 
+            zapisz_w_cache_geolokalizacji(klucz, None, None)
             return None, None
 
     except Exception as e:
-        print(f"Błąd podczas geolokalizacji: {str(e)}")
+        logger.warning("Błąd podczas geolokalizacji: %s", e)
         return None, None
 
 
+def geolokalizuj_adres_strukturalny(ulica, miasto, kod):
+    """
+    Geolokalizuje adres zapytaniem strukturalnym Nominatim - osobne pola
+    ulicy, miasta i kodu pocztowego zamiast tekstu, który serwis musi
+    samodzielnie rozłożyć na części
+
+    Args:
+        ulica (str): Ulica z numerem budynku
+        miasto (str): Miasto
+        kod (str): Kod pocztowy
+
+    Returns:
+        tuple: (latitude, longitude) lub (None, None)
+    """
+    zapytanie = {
+        "street": _PREFIKS_ULICY_RE.sub("", ulica),
+        "city": miasto,
+        "postalcode": kod,
+        "country": "Polska",
+    }
+    zapytanie = {pole: wartosc for pole, wartosc in zapytanie.items() if wartosc}
+
+    # Osobny klucz cache - wynik negatywny zapytania strukturalnego nie może
+    # blokować zapytania tekstowego o ten sam adres
+    opis = ", ".join(zapytanie.values())
+    klucz = "strukturalne " + opis
+
+    try:
+        cached = wczytaj_z_cache_geolokalizacji(klucz)
+        if cached is not None:
+            logger.info("Współrzędne z cache dla adresu: %s", opis)
+            return cached
+
+        logger.info("Geolokalizacja strukturalna adresu: %s", opis)
+
+        location = _geokoduj_z_ponowieniem(
+            zapytanie, timeout=20, exactly_one=True, language="pl"
+        )
+
+        if location:
+            logger.info("Znaleziono lokalizację: %s", location.address)
+            zapisz_w_cache_geolokalizacji(klucz, location.latitude, location.longitude)
+            return location.latitude, location.longitude
+
+        logger.info("Nie znaleziono lokalizacji dla adresu: %s", opis)
+        zapisz_w_cache_geolokalizacji(klucz, None, None)
+        return None, None
+
+    except Exception as e:
+        logger.warning("Błąd podczas geolokalizacji: %s", e)
+        return None, None
+
+
+def _geolokalizuj_rekord(item):
+    """
+    Geolokalizuje rekord, próbując kolejno zapytania strukturalnego (ulica,
+    miasto, kod), przygotowanego adresu tekstowego i samego miasta
+
+    Args:
+        item (dict): Rekord z kluczem "adres_do_geolokalizacji"
+
+    Returns:
+        tuple: (latitude, longitude) lub (None, None)
+    """
+    miasto = item.get("Miasto", "").strip()
+    ulica = item.get("Adres", "").strip()
+    kod = item.get("Kod pocztowy", "").strip()
+
+    # Zapytanie strukturalne - zwykle trafia za pierwszym razem
+    if miasto or kod:
+        lat, lng = geolokalizuj_adres_strukturalny(ulica, miasto, kod)
+
+        if lat is not None and lng is not None:
+            logger.info("Uzupełniono współrzędne dla: %s", item["Miasto"])
+            return lat, lng
+
+    # Jeśli nie udało się znaleźć współrzędnych, spróbuj adresu tekstowego
+    lat, lng = geolokalizuj_pojedynczy_adres(item["adres_do_geolokalizacji"])
+
+    if lat is not None and lng is not None:
+        logger.info("Uzupełniono współrzędne dla adresu tekstowego: %s", item["Miasto"])
+        return lat, lng
+
+    # Jeśli nadal nie działa, spróbuj samo miasto
+    lat, lng = geolokalizuj_pojedynczy_adres(f"{miasto}, Polska")
+
+    if lat is not None and lng is not None:
+        logger.info("Uzupełniono współrzędne dla miasta: %s", miasto)
+    return lat, lng
+
+
+def _rekordy_bez_wspolrzednych(data):
+    """
+    Zwraca indeksy rekordów z przygotowanym adresem, którym brakuje
+    współrzędnych.
+
+    Jeden przebieg po rekordach z prostym sprawdzeniem wartości - taniej niż
+    budowa DataFrame ze wszystkich kolumn tylko po to, by wyznaczyć maskę.
+    Indeksy uporządkowane są od najdłuższego adresu (najpełniejsze dane
+    najpierw); długości liczone są raz na rekord.
+
+    Args:
+        data (list): Lista rekordów (słowników)
+
+    Returns:
+        list: Indeksy rekordów do geolokalizacji
+    """
+    kandydaci = []
+    for i, item in enumerate(data):
+        adres = item.get("adres_do_geolokalizacji")
+        if not _brak_wartosci(adres) and _brak_wspolrzednych(item):
+            kandydaci.append((-len(str(adres)), i))
+
+    # Krotki (-długość, indeks): najdłuższe adresy najpierw, remisy w kolejności
+    kandydaci.sort()
+    return [i for _, i in kandydaci]
+
+
+def _uzupelnij_wspolrzedne(data, json_file, do_geolokalizacji=None):
+    """
+    Uzupełnia w pamięci współrzędne rekordów z przygotowanym adresem
+    z większą dokładnością
+
+    Rekordy geolokalizowane są w puli wątków - tempo zapytań do serwisu
+    ogranicza wspólny limiter, więc nie ma stałego opóźnienia po adresie.
+
+    Args:
+        data (list): Lista rekordów (modyfikowana w miejscu)
+        json_file (str): Ścieżka do pliku JSON, którego dziennik zmian
+            współrzędnych jest uzupełniany
+        do_geolokalizacji (list, optional): Uporządkowane indeksy rekordów bez
+            współrzędnych z _rekordy_bez_wspolrzednych, wyznaczone już przez
+            wywołującego (domyślnie wyznaczane tutaj)
+
+    Returns:
+        int: Liczba uzupełnionych adresów
+    """
+    # Licznik przetworzonych adresów
+    processed = 0
+
+    if do_geolokalizacji is None:
+        do_geolokalizacji = _rekordy_bez_wspolrzednych(data)
+
+    # Rekordy z tym samym (znormalizowanym) adresem geolokalizowane są raz,
+    # a wynik trafia do każdego z nich (kolejność pierwszych wystąpień)
+    grupy = {}
+    for i in do_geolokalizacji:
+        klucz = _normalizuj_adres(data[i]["adres_do_geolokalizacji"])
+        grupy.setdefault(klucz, []).append(i)
+
+    print(
+        f"Znaleziono {len(do_geolokalizacji)} adresów do geolokalizacji "
+        f"({len(grupy)} unikalnych)."
+    )
+
+    # Wyniki z wątków zapisuje tylko bieżący wątek (dane i dziennik)
+    with _Dziennik(json_file) as dziennik, _logowanie_przez_kolejke():
+        with ThreadPoolExecutor(max_workers=GEOLOCATION_WORKERS) as executor:
+            futures = {
+                executor.submit(_geolokalizuj_rekord, data[indeksy[0]]): indeksy
+                for indeksy in grupy.values()
+            }
+            for future in as_completed(futures):
+                lat, lng = future.result()
+
+                if lat is not None and lng is not None:
+                    for i in futures[future]:
+                        data[i]["latitude"] = lat
+                        data[i]["longitude"] = lng
+                        processed += 1
+                        # Dopisanie wyniku do dziennika zamiast zapisu pliku
+                        dziennik.dopisz(i, data[i])
+
+    print(f"Uzupełniono współrzędne dla {processed} adresów")
+    return processed
+
+
 def uzupelnij_wspolrzedne_jednorazowo(json_file):
     """
     Uzupełnia współrzędne dla wszystkich adresów w pliku JSON
@@ -817,84 +1787,15 @@ def uzupelnij_wspolrzedne_jednorazowo(json_file):
     """
     try:
         # Wczytanie danych
-        with open(json_file, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        data = _wczytaj_json(json_file)
 
-        # Licznik przetworzonych adresów
-        processed = 0
+        # Wyniki przerwanego przebiegu zapisane w dzienniku
+        _odtworz_z_dziennika(json_file, data)
 
-        # Najpierw sortujemy lokalizacje, aby zacząć od adresów
-        # z pełnymi danymi
-        for item in sorted(
-            data, key=lambda x: len(x.get("adres_do_geolokalizacji", "")), reverse=True
-        ):
-            if "adres_do_geolokalizacji" in item:
-                # Sprawdzenie czy już mamy współrzędne
-                if (
-                    "latitude" not in item
-                    or item["latitude"] is None
-                    or pd.isna(item["latitude"])
-                    or "longitude" not in item
-                    or item["longitude"] is None
-                    or pd.isna(item["longitude"])
-                ):
-
-                    # Wykonanie geolokalizacji
-                    lat, lng = geolokalizuj_pojedynczy_adres(
-                        item["adres_do_geolokalizacji"]
-                    )
+        _uzupelnij_wspolrzedne(data, json_file)
 
-                    if lat is not None and lng is not None:
-                        item["latitude"] = lat
-                        item["longitude"] = lng
-                        processed += 1
-                        print(f"Uzupełniono współrzędne dla: {item['Miasto']}")
-                    else:
-                        # Jeśli nie udało się znaleźć współrzędnych,
-                        # spróbuj sformułować adres inaczej
-                        miasto = item.get("Miasto", "").strip()
-                        ulica = item.get("Adres", "").strip()
-                        kod = item.get("Kod pocztowy", "").strip()
-
-                        alternatywny_adres = f"{ulica}, {miasto}, {kod}, Polska"
-                        print(
-                            f"Próba z alternatywnym formatem adresu: "
-                            f"{alternatywny_adres}"
-                        )
-
-                        lat, lng = geolokalizuj_pojedynczy_adres(alternatywny_adres)
-
-                        if lat is not None and lng is not None:
-                            item["latitude"] = lat
-                            item["longitude"] = lng
-                            processed += 1
-                            print(
-                                f"Uzupełniono współrzędne dla "
-                                f"alternatywnego adresu: {item['Miasto']}"
-                            )
-                        else:
-                            # Jeśli nadal nie działa, spróbuj samo miasto
-                            miasto_adres = f"{miasto}, Polska"
-                            lat, lng = geolokalizuj_pojedynczy_adres(miasto_adres)
-
-                            if lat is not None and lng is not None:
-                                item["latitude"] = lat
-                                item["longitude"] = lng
-                                processed += 1
-                                print(
-                                    f"Uzupełniono współrzędne dla " f"miasta: {miasto}"
-                                )
-
-                    # Zapisywanie po każdym przetworzonym adresie
-                    with open(json_file, "w", encoding="utf-8") as f:
-                        json.dump(data, f, ensure_ascii=False, indent=4)
-
-                    # Dłuższe opóźnienie dla API
-                    time.sleep(2.5)
-                else:
-                    print(f"Adres już ma współrzędne: {item['Miasto']}")
-
-        print(f"Uzupełniono współrzędne dla {processed} adresów")
+        # Zapis pełnego pliku JSON (raz, na końcu)
+        _zapisz_json(json_file, data, wyczysc_dziennik=True)
         return True
 
     except Exception as e:
@@ -902,47 +1803,83 @@ def uzupelnij_wspolrzedne_jednorazowo(json_file):
         return False
 
 
-if __name__ == "__main__":
-    # Ścieżki do plików
-    json_file = "Tabela.json"
-    lokalizacje_html_file = "lokalizacje.html"  # Plik dla lokalizacji
+def run_pipeline(json_file, html_file="lokalizacje.html", excel_file="Tabela.xlsx"):
+    """
+    Wykonuje wszystkie etapy przetwarzania na danych w pamięci - plik JSON
+    jest wczytywany raz na początku i zapisywany raz na końcu, zamiast
+    osobnego odczytu i zapisu w każdym etapie.
 
-    # Aktualizacja numeracji
-    print("Aktualizacja numeracji w pliku JSON...")
-    update_json_with_numbers(json_file)
+    Postęp geolokalizacji jest na bieżąco dopisywany do dziennika zmian
+    współrzędnych, więc przerwany przebieg nie traci wyników.
 
-    # Poprawienie formatu adresów (tylko jeśli potrzebne)
-    if not all(
-        "adres_do_geolokalizacji" in item
-        for item in json.load(open(json_file, "r", encoding="utf-8"))
-    ):
-        print("Poprawianie formatu adresów...")
-        popraw_format_adresow(json_file)
-
-    # Uzupełnienie współrzędnych (tylko jeśli potrzebne)
-    with open(json_file, "r", encoding="utf-8") as f:
-        data = json.load(f)
-        brakujace_wspolrzedne = any(
-            "latitude" not in item
-            or item["latitude"] is None
-            or pd.isna(item["latitude"])
-            or "longitude" not in item
-            or item["longitude"] is None
-            or pd.isna(item["longitude"])
-            for item in data
-            if "adres_do_geolokalizacji" in item
-        )
+    Args:
+        json_file (str): Ścieżka do pliku JSON
+        html_file (str): Ścieżka do wyjściowego pliku HTML z mapą
+        excel_file (str): Plik Excel, z którego tworzony jest brakujący JSON
 
-    if brakujace_wspolrzedne:
-        print("Uzupełnianie współrzędnych geograficznych...")
-        uzupelnij_wspolrzedne_jednorazowo(json_file)
+    Returns:
+        bool: True jeśli operacja się powiodła
+    """
+    try:
+        if os.path.exists(json_file):
+            data = _wczytaj_json(json_file)
+        else:
+            print(f"Plik {json_file} nie istnieje! Tworzę nowy z Excela...")
+            if not os.path.exists(excel_file):
+                print(f"Błąd: Plik Excel {excel_file} nie istnieje!")
+                return False
+            data = wczytaj_excel(excel_file).to_dict(orient="records")
 
-    # Sprawdzenie, czy występują zduplikowane współrzędne
-    print("Sprawdzanie zduplikowanych współrzędnych...")
-    popraw_wspolrzedne_dla_lokalizacji(json_file)
+        # Wyniki przerwanego przebiegu zapisane w dzienniku
+        _odtworz_z_dziennika(json_file, data)
+        _inicjalizuj_nan(data)
+
+        print("Aktualizacja numeracji...")
+        _ponumeruj(data)
+
+        # Poprawienie formatu adresów (tylko rekordów bez przygotowanego adresu)
+        bez_adresu = [
+            i for i, item in enumerate(data) if "adres_do_geolokalizacji" not in item
+        ]
+        if bez_adresu:
+            print(f"Poprawianie formatu adresów ({len(bez_adresu)} rekordów)...")
+            _popraw_format(data, bez_adresu)
+
+        # Uzupełnienie współrzędnych (tylko jeśli potrzebne)
+        do_geolokalizacji = _rekordy_bez_wspolrzednych(data)
+        if do_geolokalizacji:
+            print("Uzupełnianie współrzędnych geograficznych...")
+            _uzupelnij_wspolrzedne(data, json_file, do_geolokalizacji)
+
+        print("Sprawdzanie zduplikowanych współrzędnych...")
+        _popraw_wspolrzedne(data, json_file)
+
+        # Jeden zapis wyników wszystkich etapów
+        _zapisz_json(json_file, data, wyczysc_dziennik=True)
+
+        print("Generowanie mapy lokalizacji...")
+        return _generuj_mape(data, html_file)
+
+    except Exception as e:
+        print(f"Wystąpił błąd podczas przetwarzania danych: {str(e)}")
+        traceback.print_exc()
+        return False
+
+
+if __name__ == "__main__":
+    # Komunikaty o pojedynczych adresach w tej samej postaci co pozostałe
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    # SIGTERM jako SystemExit (jak Ctrl-C jako KeyboardInterrupt) - bloki
+    # with zamykają dziennik zmian współrzędnych, zapisując buforowane wpisy
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+
+    # Ścieżki do plików (skompresowana kopia robocza ma pierwszeństwo)
+    json_file = "Tabela.json.gz" if os.path.exists("Tabela.json.gz") else "Tabela.json"
+    lokalizacje_html_file = "lokalizacje.html"  # Plik dla lokalizacji
 
-    # Generowanie mapy lokalizacji
-    print("Generowanie mapy lokalizacji...")
-    generuj_mape_wielowarstwowa(json_file, lokalizacje_html_file, show_route=False)
+    # Wszystkie etapy na jednym wczytaniu pliku JSON (jeden zapis na końcu):
+    # numeracja, format adresów, współrzędne, duplikaty i mapa
+    run_pipeline(json_file, lokalizacje_html_file)
 
     print("Zakończono przetwarzanie.")
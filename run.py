@@ -1,33 +1,154 @@
 import argparse
+import functools
+import hashlib
 import json
+import logging
+import mmap
 import os
 import pickle
+import sqlite3
 import threading
 import time
 import traceback
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
 
 import folium
-import networkx as nx
+from folium.plugins import FastMarkerCluster
+import numpy as np
+import orjson
 import pandas as pd
 import polyline
-import requests
+from geopy.adapters import RequestsAdapter
 from geopy.exc import GeocoderServiceError, GeocoderTimedOut
+from geopy.extra.rate_limiter import RateLimiter
 from geopy.geocoders import Nominatim
 
+import config
 from config import (
     ALGORITHM_COLORS,
+    CACHE_HASH_ALGO,
+    GEOLOCATION_MIN_INTERVAL,
+    GEOJSON_MAP_FILE,
+    GEOJSON_ROUTES_FILE,
+    GEOLOCATION_WORKERS,
     LINE_STYLES,
+    MAP_SIMPLIFY_TOLERANCE,
+    MARKER_CLUSTER_OPTIONS,
+    NOMINATIM_USER_AGENT,
     OSRM_MAX_RETRIES,
+    OSRM_PROBE_CACHE_TTL,
     OSRM_RETRY_DELAY,
-    OSRM_SERVERS,
     OSRM_TIMEOUT,
 )
+from core.cache_manager import CacheManager
+from create_JSON import wczytaj_z_cache_geolokalizacji, zapisz_w_cache_geolokalizacji
+from core.osrm_client import get_session, pobierz_macierz_odleglosci, pobierz_trasy
+from core.route_utils import podziel_trase_na_dni, uprosc_trase
+from core.tsp_algorithms import run_mst, run_two_opt_directed
+
+try:
+    import xxhash
+except ImportError:  # Bez pakietu xxhash klucze cache liczone są przez BLAKE2b
+    xxhash = None
+
+# Komunikaty konwersji i geolokalizacji (także z wątków roboczych) - przez
+# logging z leniwym formatowaniem zamiast print; poziom z LOG_LEVEL
+logger = logging.getLogger(__name__)
+logger.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
+
+# Wspólny geokoder - jedna sesja requests z pulą połączeń keep-alive zamiast
+# nowego obiektu Nominatim i połączenia TCP+TLS dla każdego zapytania
+_GEO = Nominatim(
+    user_agent=NOMINATIM_USER_AGENT,
+    adapter_factory=functools.partial(
+        RequestsAdapter, pool_connections=4, pool_maxsize=8
+    ),
+)
+
+# Globalny (współdzielony przez wątki) limit częstotliwości zapytań Nominatim;
+# błędy obsługuje kod wywołujący
+_geocode = RateLimiter(
+    _GEO.geocode,
+    min_delay_seconds=GEOLOCATION_MIN_INTERVAL,
+    max_retries=0,
+    swallow_exceptions=False,
+)
+
+# Ostatnie udane sprawdzenia serwerów OSRM: serwer -> (znacznik czasu, czas odpowiedzi)
+_osrm_probe_cache = {}
+
+
+def _hasher_klucza(data=b""):
+    """
+    Tworzy niekryptograficzny hasher kluczy cache zgodnie z CACHE_HASH_ALGO
+
+    Kolizje kluczy nie mają tu znaczenia dla bezpieczeństwa, więc zamiast
+    SHA-256 używany jest xxh128 (lub 128-bitowy BLAKE2b, gdy pakiet xxhash
+    nie jest dostępny). Zmiana algorytmu oznacza jednorazowe przeliczenie
+    wyników zapisanych pod starymi kluczami.
+
+    Args:
+        data (bytes): Początkowe dane do zahaszowania
+
+    Returns:
+        Obiekt z metodami update() i hexdigest()
+    """
+    if CACHE_HASH_ALGO == "xxh128" and xxhash is not None:
+        return xxhash.xxh128(data)
+    if CACHE_HASH_ALGO == "sha256":
+        return hashlib.sha256(data)
+    return hashlib.blake2b(data, digest_size=16)
+
+
+@functools.lru_cache(maxsize=128)
+def _klucz_matrycy(coords):
+    """
+    Wyznacza klucz cache matrycy odległości dla zestawu współrzędnych
+
+    Wynik jest zapamiętywany, więc ponowne generowanie mapy dla tych samych
+    lokalizacji nie liczy skrótu od nowa.
+
+    Args:
+        coords (tuple): Posortowane krotki (latitude, longitude)
+
+    Returns:
+        str: Klucz matrycy (hex)
+    """
+    # Surowe bajty tablicy float64 zamiast tekstu z json.dumps
+    data = np.asarray(coords, dtype=np.float64)
+    return _hasher_klucza(data.tobytes()).hexdigest()
 
 
 # Funkcje do obsługi cachowania tras
-def load_cached_routes(cache_file="cache/cached_routes.pkl"):
+ROUTES_DB_FILE = "cache/routes.sqlite"
+
+# Otwarte połączenia z bazami tras {ścieżka: (połączenie, blokada)}
+_BAZY_TRAS = {}
+_BAZY_TRAS_LOCK = threading.RLock()
+
+
+def _wczytaj_trasy_pickle(cache_file):
     """
-    Ładuje zapisane trasy z pliku cache
+    Wczytuje trasy ze starego pliku cache w formacie pickle
+
+    Args:
+        cache_file (str): Ścieżka do pliku .pkl
+
+    Returns:
+        dict: Słownik przechowujący zapisane trasy
+    """
+    with open(cache_file, "rb") as f:
+        return pickle.load(f)
+
+
+def load_cached_routes(cache_file="cache/cached_routes.json"):
+    """
+    Ładuje zapisane trasy ze starego pliku cache (JSON lub pickle)
+
+    Używane przy przenoszeniu tras do bazy SQLite. Jeśli pliku JSON nie ma,
+    a obok leży stary plik .pkl, trasy są wczytywane z niego.
 
     Args:
         cache_file (str): Ścieżka do pliku cache
@@ -36,61 +157,215 @@ def load_cached_routes(cache_file="cache/cached_routes.pkl"):
         dict: Słownik przechowujący zapisane trasy
     """
     cached_routes = {}
-    if os.path.exists(cache_file):
-        try:
+    legacy_file = os.path.splitext(cache_file)[0] + ".pkl"
+    try:
+        if cache_file.endswith(".pkl"):
+            if os.path.exists(cache_file):
+                cached_routes = _wczytaj_trasy_pickle(cache_file)
+        elif os.path.exists(cache_file):
             with open(cache_file, "rb") as f:
-                cached_routes = pickle.load(f)
+                raw = orjson.loads(f.read())
+            # JSON nie rozróżnia krotek - odtwarzamy format (współrzędne, km)
+            cached_routes = {
+                key: (coords, distance_km) for key, (coords, distance_km) in raw.items()
+            }
+        elif os.path.exists(legacy_file):
+            cached_routes = _wczytaj_trasy_pickle(legacy_file)
+            cache_file = legacy_file
+        if cached_routes:
             print(f"Załadowano {len(cached_routes)} zapisanych tras z {cache_file}")
-        except Exception as e:
-            print(f"Błąd wczytywania zapisanych tras: {str(e)}")
+    except Exception as e:
+        print(f"Błąd wczytywania zapisanych tras: {str(e)}")
     return cached_routes
 
 
-def save_cached_routes(cached_routes, cache_file="cache/cached_routes.pkl"):
+def _baza_tras(db_file=ROUTES_DB_FILE):
     """
-    Zapisuje trasy do pliku cache
+    Zwraca połączenie z bazą tras SQLite (jedno na plik, współdzielone przez
+    wątki) wraz z blokadą tego połączenia.
+
+    Przy pierwszym otwarciu pustej bazy trasy ze starego pliku cache
+    (cached_routes.json / cached_routes.pkl) są do niej przenoszone.
 
     Args:
-        cached_routes (dict): Słownik przechowujący trasy
-        cache_file (str): Ścieżka do pliku cache
+        db_file (str): Ścieżka do pliku bazy
 
     Returns:
-        bool: True jeśli operacja się powiodła, False w przeciwnym przypadku
+        tuple: (sqlite3.Connection, threading.Lock)
     """
-    import threading
+    with _BAZY_TRAS_LOCK:
+        if db_file in _BAZY_TRAS:
+            return _BAZY_TRAS[db_file]
+
+        db_dir = os.path.dirname(db_file)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+        conn = sqlite3.connect(db_file, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS routes "
+            "(key TEXT PRIMARY KEY, poly BLOB, dist REAL)"
+        )
+        conn.commit()
+        _BAZY_TRAS[db_file] = (conn, threading.Lock())
+
+        if conn.execute("SELECT 1 FROM routes LIMIT 1").fetchone() is None:
+            legacy_routes = load_cached_routes(
+                os.path.join(db_dir, "cached_routes.json")
+            )
+            if legacy_routes:
+                put_routes(legacy_routes, db_file)
+                print(f"Przeniesiono {len(legacy_routes)} tras do bazy {db_file}")
+
+        return _BAZY_TRAS[db_file]
 
-    # Mutex do synchronizacji zapisu do pliku
-    if not hasattr(save_cached_routes, "lock"):
-        save_cached_routes.lock = threading.Lock()
 
+def _koduj_punkty(polyline_coords):
+    """
+    Zamienia zdekodowane punkty trasy na surowe bajty float64 (n, 2)
+
+    Args:
+        polyline_coords (list | np.ndarray | None): Punkty trasy (lat, lng)
+
+    Returns:
+        bytes | None: Zawartość kolumny poly lub None jeśli brak trasy
+    """
+    if polyline_coords is None:
+        return None
+    return np.asarray(polyline_coords, dtype=np.float64).reshape(-1, 2).tobytes()
+
+
+def _dekoduj_punkty(blob):
+    """
+    Odtwarza punkty trasy z kolumny poly bez ponownego dekodowania polyline
+
+    Args:
+        blob (bytes | None): Surowe bajty float64 (lub JSON w starszym formacie)
+
+    Returns:
+        np.ndarray | None: Tablica (n, 2) punktów (lat, lng)
+    """
+    if blob is None:
+        return None
+    if blob[:1] in (b"[", b"n"):
+        coords = orjson.loads(blob)
+        return None if coords is None else np.asarray(coords, dtype=np.float64)
+    return np.frombuffer(blob, dtype=np.float64).reshape(-1, 2)
+
+
+def get_route(cache_key, db_file=ROUTES_DB_FILE):
+    """
+    Odczytuje pojedynczą trasę z bazy tras
+
+    Args:
+        cache_key (str): Klucz trasy "lat,lng|lat,lng"
+        db_file (str): Ścieżka do pliku bazy
+
+    Returns:
+        tuple: (polyline_coords, distance_km) lub (None, None) gdy brak trasy
+    """
     try:
-        # Upewnij się, że folder cache istnieje
-        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        conn, lock = _baza_tras(db_file)
+        with lock:
+            row = conn.execute(
+                "SELECT poly, dist FROM routes WHERE key = ?", (cache_key,)
+            ).fetchone()
+        if row is not None:
+            return _dekoduj_punkty(row[0]), row[1]
+    except Exception as e:
+        print(f"Błąd odczytu trasy z bazy: {str(e)}")
+    return None, None
 
-        with save_cached_routes.lock:
-            with open(cache_file, "wb") as f:
-                pickle.dump(cached_routes, f)
-            print(f"Zapisano {len(cached_routes)} tras do {cache_file}")
-            return True
+
+def put_route(cache_key, polyline_coords, distance_km, db_file=ROUTES_DB_FILE):
+    """
+    Zapisuje pojedynczą trasę do bazy tras
+
+    Args:
+        cache_key (str): Klucz trasy "lat,lng|lat,lng"
+        polyline_coords (list | np.ndarray): Współrzędne trasy
+        distance_km (float): Długość trasy w km
+        db_file (str): Ścieżka do pliku bazy
+
+    Returns:
+        bool: True jeśli operacja się powiodła, False w przeciwnym przypadku
+    """
+    return put_routes({cache_key: (polyline_coords, distance_km)}, db_file)
+
+
+def put_routes(routes, db_file=ROUTES_DB_FILE):
+    """
+    Zapisuje wiele tras do bazy jednym wywołaniem executemany
+
+    Args:
+        routes (dict): Trasy {klucz: (polyline_coords, distance_km)}
+        db_file (str): Ścieżka do pliku bazy
+
+    Returns:
+        bool: True jeśli operacja się powiodła, False w przeciwnym przypadku
+    """
+    try:
+        conn, lock = _baza_tras(db_file)
+        rows = [
+            (key, _koduj_punkty(coords), distance_km)
+            for key, (coords, distance_km) in routes.items()
+        ]
+        with lock:
+            conn.executemany(
+                "INSERT OR REPLACE INTO routes (key, poly, dist) VALUES (?, ?, ?)",
+                rows,
+            )
+            conn.commit()
+        return True
     except Exception as e:
         print(f"Błąd zapisywania tras: {str(e)}")
         return False
 
 
+def save_cached_routes(cached_routes, db_file=ROUTES_DB_FILE):
+    """
+    Zapisuje trasy do bazy tras
+
+    Zapis jest przyrostowy (INSERT OR REPLACE) - nie przepisuje całego
+    cache przy każdej nowej trasie.
+
+    Args:
+        cached_routes (dict): Słownik przechowujący trasy
+        db_file (str): Ścieżka do pliku bazy
+
+    Returns:
+        bool: True jeśli operacja się powiodła, False w przeciwnym przypadku
+    """
+    if put_routes(cached_routes, db_file):
+        print(f"Zapisano {len(cached_routes)} tras do {db_file}")
+        return True
+    return False
+
+
 def geolokalizuj_adres(adres, max_retries=3, delay=1):
     """
     Konwertuje adres na współrzędne geograficzne używając Nominatim
     (OpenStreetMap)
 
+    Wynik zapisywany jest we wspólnym cache geolokalizacji (SQLite, klucze
+    po normalizacji NFKC) używanym także przez create_JSON. Wynik negatywny
+    ważny jest przez GEOCODE_NEGATIVE_TTL i zapisywany tylko wtedy, gdy
+    serwis odpowiedział na wszystkie zapytania.
+
     Args:
         adres (str): Pełny adres do geolokalizacji
-        max_retries (int): Maksymalna liczba prób w przypadku błędu
-        delay (int): Opóźnienie między próbami w sekundach
+        max_retries (int): Maksymalna liczba prób zapytania w przypadku błędu
+        delay (int): Opóźnienie przed pierwszym ponowieniem w sekundach
 
     Returns:
         tuple: (latitude, longitude) lub (None, None) w przypadku błędu
     """
-    geolocator = Nominatim(user_agent="my_geocoder_app")
+    cached = wczytaj_z_cache_geolokalizacji(adres)
+    if cached is not None:
+        logger.debug("Współrzędne z cache dla adresu: %s", adres)
+        return cached
 
     # Przygotowanie lepszych wariantów adresu
     adres_variants = [
@@ -104,33 +379,41 @@ def geolokalizuj_adres(adres, max_retries=3, delay=1):
         # Warianty z numerem budynku
         f"{adres.split(',')[0].strip().replace(' ', ', ')}, Polska",  # Zamiana spacji
     ]
-
-    # Zwiększenie parametrów dla większej dokładności
-    for attempt in range(max_retries):
-        for variant in adres_variants:
+    # Bez przecinka lub "Ul." część wariantów jest identyczna
+    adres_variants = list(dict.fromkeys(adres_variants))
+
+    blad = False
+    for variant in adres_variants:
+        location = None
+        # Ponawiamy tylko zapytanie zakończone błędem przejściowym; odstęp
+        # między zapytaniami pilnuje wspólny RateLimiter
+        for attempt in range(max_retries):
             try:
-                # Dodajemy opóźnienie przed każdym zapytaniem
-                time.sleep(delay)
-                print(f"Próba geolokalizacji: {variant}")
-                # Zwiększamy parametry dokładności
-                location = geolocator.geocode(
+                logger.debug("Próba geolokalizacji: %s", variant)
+                location = _geocode(
                     variant, timeout=20, exactly_one=True, addressdetails=True
                 )
-
-                if location:
-                    print(f"Znaleziono lokalizację: {location.address}")
-                    # Dodać sprawdzenie pewności wyniku
-                    if hasattr(location, "raw") and "importance" in location.raw:
-                        print(f"Pewność wyniku: {location.raw['importance']}")
-                    return location.latitude, location.longitude
+                break
             except (GeocoderTimedOut, GeocoderServiceError) as e:
-                print(f"Błąd geolokalizacji dla adresu {variant}: {str(e)}")
-                time.sleep(delay * 2)  # Zwiększamy opóźnienie po błędzie
+                logger.warning("Błąd geolokalizacji dla adresu %s: %s", variant, e)
+                if attempt == max_retries - 1:
+                    blad = True
+                else:
+                    time.sleep(delay * 2**attempt)
             except Exception as e:
-                print(f"Niespodziewany błąd: {str(e)}")
-                time.sleep(delay)
+                logger.warning("Niespodziewany błąd: %s", e)
+                blad = True
+                break
 
-    print(f"Nie udało się znaleźć lokalizacji dla adresu: {adres}")
+        if location:
+            logger.debug("Znaleziono lokalizację: %s", location.address)
+            zapisz_w_cache_geolokalizacji(adres, location.latitude, location.longitude)
+            return location.latitude, location.longitude
+
+    logger.info("Nie udało się znaleźć lokalizacji dla adresu: %s", adres)
+    # Awaria sieci nie może zablokować adresu na GEOCODE_NEGATIVE_TTL
+    if not blad:
+        zapisz_w_cache_geolokalizacji(adres, None, None)
     return None, None
 
 
@@ -149,13 +432,13 @@ def excel_to_json(excel_file, json_file=None):
     try:
         # Sprawdź czy plik Excel istnieje
         if not os.path.exists(excel_file):
-            print(f"Błąd: Plik Excel {excel_file} nie istnieje!")
+            logger.error("Błąd: Plik Excel %s nie istnieje!", excel_file)
             return False
 
         # Wczytanie pliku Excel
-        print(f"Wczytuję dane z pliku Excel: {excel_file}")
+        logger.info("Wczytuję dane z pliku Excel: %s", excel_file)
         df = pd.read_excel(excel_file)
-        print(f"Wczytano {len(df)} rekordów z pliku Excel")
+        logger.info("Wczytano %d rekordów z pliku Excel", len(df))
 
         # Jeśli nie podano nazwy pliku wyjściowego, użyj nazwy pliku Excel
         if json_file is None:
@@ -164,33 +447,39 @@ def excel_to_json(excel_file, json_file=None):
         # Sprawdź, czy plik JSON już istnieje i wczytaj go
         existing_data = []
         if os.path.exists(json_file):
-            print(f"Plik JSON {json_file} już istnieje, aktualizuję dane...")
-            with open(json_file, "r", encoding="utf-8") as f:
-                existing_data = json.load(f)
-                # Konwertuj istniejące dane do DataFrame
-                existing_df = pd.DataFrame(existing_data)
-
-                # Aktualizuj tylko rekordy bez współrzędnych
-                merged_df = df.copy()
-                if (
-                    "latitude" in existing_df.columns
-                    and "longitude" in existing_df.columns
-                ):
-                    for index, row in existing_df.iterrows():
-                        if pd.notna(row["latitude"]) and pd.notna(row["longitude"]):
-                            # Znajdź odpowiadający rekord w df
-                            matching_rows = merged_df[
-                                merged_df["pełny_adres"] == row["pełny_adres"]
-                            ]
-                            if not matching_rows.empty:
-                                merged_df.loc[matching_rows.index[0], "latitude"] = row[
-                                    "latitude"
-                                ]
-                                merged_df.loc[matching_rows.index[0], "longitude"] = (
-                                    row["longitude"]
-                                )
-
-                df = merged_df
+            logger.info("Plik JSON %s już istnieje, aktualizuję dane...", json_file)
+            existing_data = _wczytaj_json(json_file)
+            # Konwertuj istniejące dane do DataFrame
+            existing_df = pd.DataFrame(existing_data)
+
+            # Przenieś znane współrzędne z istniejącego pliku jednym
+            # złączeniem po adresie zamiast wyszukiwania dla każdego wiersza
+            merged_df = df
+            if (
+                "latitude" in existing_df.columns
+                and "longitude" in existing_df.columns
+                and "pełny_adres" in existing_df.columns
+                and "pełny_adres" in df.columns
+            ):
+                existing = existing_df.loc[
+                    existing_df["latitude"].notna() & existing_df["longitude"].notna(),
+                    ["pełny_adres", "latitude", "longitude"],
+                ].drop_duplicates("pełny_adres", keep="last")
+                merged_df = df.merge(
+                    existing,
+                    on="pełny_adres",
+                    how="left",
+                    suffixes=("", "_old"),
+                    validate="m:1",
+                )
+                # Współrzędne z istniejącego pliku mają pierwszeństwo
+                for col in ("latitude", "longitude"):
+                    if f"{col}_old" in merged_df.columns:
+                        merged_df[col] = merged_df.pop(f"{col}_old").combine_first(
+                            merged_df[col]
+                        )
+
+            df = merged_df
 
         # Konwersja DataFrame do listy słowników
         data = df.to_dict(orient="records")
@@ -202,21 +491,183 @@ def excel_to_json(excel_file, json_file=None):
                 adres = item.get("Adres", "").strip()
                 kod = item.get("Kod pocztowy", "").strip()
                 item["pełny_adres"] = f"{adres}, {kod} {miasto}"
-                print(f"Utworzono pełny adres: {item['pełny_adres']}")
+                logger.debug("Utworzono pełny adres: %s", item["pełny_adres"])
 
         # Zapis do pliku JSON
-        with open(json_file, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
+        _zapisz_json(json_file, data)
 
-        print(f"Pomyślnie zapisano dane do pliku JSON: {json_file}")
+        logger.info("Pomyślnie zapisano dane do pliku JSON: %s", json_file)
         return True
 
     except Exception as e:
-        print(f"Wystąpił błąd podczas konwersji Excel do JSON: {str(e)}")
-        traceback.print_exc()
+        logger.exception("Wystąpił błąd podczas konwersji Excel do JSON: %s", e)
         return False
 
 
+def _wczytaj_json(json_file, domyslnie=None):
+    """
+    Wczytuje plik JSON przy użyciu orjson
+
+    Plik jest mapowany w pamięć i parsowany bezpośrednio ze zmapowanych stron
+    (bez dekodowania do str). Pliki zapisane wcześniej modułem json mogą
+    zawierać literały NaN, których orjson nie akceptuje - wtedy używany jest
+    json.
+
+    Args:
+        json_file (str): Ścieżka do pliku JSON
+        domyslnie (list | dict, optional): Wynik dla pustego pliku (domyślnie
+            pusta lista rekordów)
+
+    Returns:
+        list | dict: Wczytane dane
+    """
+    with open(json_file, "rb") as f:
+        # Pustego pliku nie da się zmapować ani zdekodować
+        if not os.fstat(f.fileno()).st_size:
+            return [] if domyslnie is None else domyslnie
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as raw:
+                try:
+                    return orjson.loads(raw)
+                except orjson.JSONDecodeError:
+                    return json.loads(bytes(raw))
+
+
+def _zapisz_json(json_file, data):
+    """
+    Zapisuje dane do pliku JSON (orjson) przez plik tymczasowy i podmianę
+
+    Przerwany zapis nie zostawia uszkodzonego pliku. Wartości NaN zapisywane
+    są jako null.
+
+    Args:
+        json_file (str): Ścieżka do pliku JSON
+        data (list): Dane do zapisania
+    """
+    tmp_file = f"{json_file}.tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(
+            orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY)
+        )
+    os.replace(tmp_file, json_file)
+
+
+def _plik_dziennika(json_file):
+    """Zwraca ścieżkę dziennika (JSON Lines) nowych współrzędnych pliku JSON"""
+    return json_file + ".wal"
+
+
+def _dopisz_do_dziennika(dziennik, i, adres, latitude, longitude):
+    """
+    Dopisuje do dziennika nowe współrzędne rekordu (jedna linia JSON)
+
+    Args:
+        dziennik (file): Plik dziennika otwarty w trybie "ab"
+        i (int): Indeks rekordu w danych
+        adres (str): Adres rekordu, sprawdzany przy odtwarzaniu
+        latitude (float): Szerokość geograficzna
+        longitude (float): Długość geograficzna
+    """
+    dziennik.write(
+        orjson.dumps({"idx": i, "adres": adres, "lat": latitude, "lng": longitude})
+        + b"\n"
+    )
+    dziennik.flush()
+
+
+def _odtworz_z_dziennika(json_file, data, klucz_adresu="pełny_adres"):
+    """
+    Nanosi na dane współrzędne zapisane w dzienniku przerwanego przebiegu
+
+    Wpis jest stosowany tylko wtedy, gdy rekord o danym indeksie ma ten sam
+    adres - dziennik z innej wersji danych zostanie zignorowany.
+
+    Args:
+        json_file (str): Ścieżka do pliku JSON
+        data (list): Dane wczytane z pliku JSON (modyfikowane w miejscu)
+        klucz_adresu (str): Pole rekordu z adresem zapisanym w dzienniku
+
+    Returns:
+        int: Liczba odtworzonych wpisów
+    """
+    plik = _plik_dziennika(json_file)
+    if not os.path.exists(plik):
+        return 0
+
+    odtworzone = 0
+    poprawne_bajty = 0
+    with open(plik, "rb") as f:
+        for line in f:
+            # Wpis bez końca linii jest niedokończony, nawet jeśli da się go
+            # sparsować - następny wpis zostałby dopisany w tej samej linii
+            if not line.endswith(b"\n"):
+                break
+            try:
+                wpis = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                break  # Niedokończony ostatni wpis po przerwaniu zapisu
+            poprawne_bajty += len(line)
+
+            i = wpis["idx"]
+            if i < len(data) and data[i].get(klucz_adresu) == wpis["adres"]:
+                data[i]["latitude"] = wpis["lat"]
+                data[i]["longitude"] = wpis["lng"]
+                odtworzone += 1
+
+    # Obetnij niedokończony wpis, aby nowe wpisy nie były do niego doklejane
+    if poprawne_bajty < os.path.getsize(plik):
+        os.truncate(plik, poprawne_bajty)
+
+    if odtworzone:
+        print(f"Odtworzono {odtworzone} zmian współrzędnych z dziennika {plik}")
+    return odtworzone
+
+
+def _wspolrzedne_numeryczne(df):
+    """
+    Zwraca kolumny współrzędnych jako liczby (NaN dla braków i wartości
+    nienumerycznych)
+
+    Args:
+        df (pandas.DataFrame): Rekordy lokalizacji
+
+    Returns:
+        tuple: (latitude, longitude) jako pandas.Series typu float
+    """
+    return tuple(
+        (
+            pd.to_numeric(df[col], errors="coerce")
+            if col in df
+            else pd.Series(float("nan"), index=df.index)
+        )
+        for col in ("latitude", "longitude")
+    )
+
+
+def _indeksy_bez_wspolrzednych(data):
+    """
+    Zwraca indeksy rekordów z adresem, którym brakuje współrzędnych
+
+    Brak wartości (None, NaN, "nan" lub inny nienumeryczny tekst) wykrywany
+    jest wektorowo dla całych kolumn zamiast osobnych sprawdzeń dla każdego
+    rekordu.
+
+    Args:
+        data (list): Lista rekordów lokalizacji
+
+    Returns:
+        list: Indeksy rekordów do geolokalizacji
+    """
+    df = pd.DataFrame(data)
+    if "pełny_adres" not in df:
+        return []
+
+    lat, lng = _wspolrzedne_numeryczne(df)
+    needs_geo = lat.isna() | lng.isna()
+    return df.index[needs_geo & df["pełny_adres"].notna()].tolist()
+
+
 def uzupelnij_geolokalizacje(json_file):
     """
     Uzupełnia brakujące współrzędne geograficzne w pliku JSON
@@ -230,92 +681,189 @@ def uzupelnij_geolokalizacje(json_file):
     try:
         # Sprawdzamy dostępność serwisu
         if not sprawdz_status_serwisu_geolokalizacji():
-            print(
+            logger.warning(
                 "Serwis geolokalizacji jest niedostępny. Próbuję kontynuować z istniejącymi danymi."
             )
 
         # Wczytanie danych z JSON
-        with open(json_file, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        data = _wczytaj_json(json_file)
+
+        # Wyniki przerwanego wcześniej przebiegu
+        _odtworz_z_dziennika(json_file, data)
 
         # Licznik uzupełnionych adresów
         uzupelnione = 0
-        total_to_process = len(
-            [
-                item
-                for item in data
-                if "pełny_adres" in item
-                and (
-                    item.get("latitude") is None
-                    or item.get("longitude") is None
-                    or pd.isna(item.get("latitude"))
-                    or pd.isna(item.get("longitude"))
-                    or str(item.get("latitude")).lower() == "nan"
-                    or str(item.get("longitude")).lower() == "nan"
-                )
-            ]
-        )
+        do_geolokalizacji = _indeksy_bez_wspolrzednych(data)
+        total_to_process = len(do_geolokalizacji)
 
-        print(f"Znaleziono {total_to_process} adresów do geolokalizacji.")
+        logger.info("Znaleziono %d adresów do geolokalizacji.", total_to_process)
 
         if total_to_process == 0:
-            print("Wszystkie adresy mają już współrzędne geograficzne.")
+            logger.info("Wszystkie adresy mają już współrzędne geograficzne.")
             return True
 
-        # Iteracja przez wszystkie rekordy
+        # Wątki nakładają na siebie czas oczekiwania na odpowiedź serwisu,
+        # a wspólny RateLimiter nadal pilnuje odstępu między zapytaniami
         processed = 0
-        for i, item in enumerate(data):
-            # Sprawdzenie czy brakuje współrzędnych
-            if "pełny_adres" in item and (
-                item.get("latitude") is None
-                or item.get("longitude") is None
-                or pd.isna(item.get("latitude"))
-                or pd.isna(item.get("longitude"))
-                or str(item.get("latitude")).lower() == "nan"
-                or str(item.get("longitude")).lower() == "nan"
-            ):
+        with open(_plik_dziennika(json_file), "ab") as dziennik, ThreadPoolExecutor(
+            max_workers=GEOLOCATION_WORKERS
+        ) as executor:
+            futures = {
+                executor.submit(
+                    geolokalizuj_adres, data[i]["pełny_adres"], max_retries=5, delay=2
+                ): i
+                for i in do_geolokalizacji
+            }
+            for future in as_completed(futures):
+                i = futures[future]
+                item = data[i]
                 processed += 1
-                print(
-                    f"Przetwarzanie {processed}/{total_to_process}: {item['pełny_adres']}"
-                )
-                latitude, longitude = geolokalizuj_adres(
-                    item["pełny_adres"], max_retries=5, delay=2
+                logger.debug(
+                    "Przetworzono %d/%d: %s",
+                    processed,
+                    total_to_process,
+                    item["pełny_adres"],
                 )
+                latitude, longitude = future.result()
                 if latitude is not None and longitude is not None:
                     item["latitude"] = latitude
                     item["longitude"] = longitude
                     uzupelnione += 1
-                    print(f"Uzupełniono współrzędne dla: {item['pełny_adres']}")
+                    logger.debug("Uzupełniono współrzędne dla: %s", item["pełny_adres"])
+
+                    # Dopisanie wyniku do dziennika zamiast zapisu całego pliku
+                    _dopisz_do_dziennika(
+                        dziennik, i, item["pełny_adres"], latitude, longitude
+                    )
                 else:
-                    print(
-                        f"Nie udało się znaleźć współrzędnych dla: {item['pełny_adres']}"
+                    logger.info(
+                        "Nie udało się znaleźć współrzędnych dla: %s",
+                        item["pełny_adres"],
                     )
 
-                # Zapisywanie częściowych wyników co 3 adresy
-                if processed % 3 == 0 or processed == total_to_process:
-                    with open(json_file, "w", encoding="utf-8") as f:
-                        json.dump(data, f, ensure_ascii=False, indent=4)
-                    print(
-                        f"Zapisano częściowe wyniki. Uzupełniono {uzupelnione}/{total_to_process} adresów."
+                # Punkty kontrolne coraz rzadziej: co 25 adresów, a od 100 co 100
+                if (
+                    processed < total_to_process
+                    and processed % (25 if processed <= 100 else 100) == 0
+                ):
+                    _zapisz_json(json_file, data)
+                    logger.info(
+                        "Zapisano częściowe wyniki. Uzupełniono %d/%d adresów.",
+                        uzupelnione,
+                        total_to_process,
                     )
 
-                # Dodaj opóźnienie, aby nie przeciążyć API
-                time.sleep(2)  # Zwiększono opóźnienie do 2 sekund
-
-        # Zapis zaktualizowanych danych do pliku JSON
-        with open(json_file, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
+        # Zapis zaktualizowanych danych do pliku JSON - dziennik nie jest już
+        # potrzebny
+        _zapisz_json(json_file, data)
+        os.remove(_plik_dziennika(json_file))
 
-        print(
-            f"Zakończono uzupełnianie współrzędnych. Uzupełniono {uzupelnione} adresów."
+        logger.info(
+            "Zakończono uzupełnianie współrzędnych. Uzupełniono %d adresów.",
+            uzupelnione,
         )
         return True
 
     except Exception as e:
-        print(f"Wystąpił błąd podczas uzupełniania geolokalizacji: {str(e)}")
+        logger.error("Wystąpił błąd podczas uzupełniania geolokalizacji: %s", e)
         return False
 
 
+# Szablony HTML etykiet mapy - stały CSS budowany raz, a nie dla każdego punktu
+POPUP_HTML = (
+    "<b>{miasto}</b><br>Adres: {adres}<br>" "Kod pocztowy: {kod}<br>Numer: {numer}"
+)
+NUMER_HTML = (
+    '<div style="width: 24px; height: 24px; line-height: 24px; '
+    "border-radius: 50%; background-color: rgba(255, 0, 0, 0.7); "
+    "font-size: 10pt; color: white; text-align: center; "
+    'font-weight: bold;">{numer}</div>'
+)
+ADRES_HTML = (
+    '<div style="font-size: 9pt; color: black; background-color: white; '
+    'padding: 2px; border-radius: 3px; text-align: center;">{adres}</div>'
+)
+# Markery budowane po stronie przeglądarki z wierszy [lat, lng, popup, tooltip]
+MARKER_CALLBACK = """
+function (row) {
+    var marker = L.marker(new L.LatLng(row[0], row[1]));
+    marker.bindPopup(row[2], {maxWidth: 300});
+    marker.bindTooltip(row[3]);
+    return marker;
+};
+"""
+
+# Numerowane kółka z wierszy [lat, lng, html, popup]
+NUMER_CALLBACK = """
+function (row) {
+    var icon = L.divIcon({
+        html: row[2],
+        className: "",
+        iconSize: [24, 24],
+        iconAnchor: [12, 12]
+    });
+    var marker = L.marker(new L.LatLng(row[0], row[1]), {icon: icon});
+    marker.bindPopup(row[3]);
+    return marker;
+};
+"""
+
+# Etykiety adresów z wierszy [lat, lng, html]
+ADRES_CALLBACK = """
+function (row) {
+    var icon = L.divIcon({
+        html: row[2],
+        className: "",
+        iconSize: [200, 20],
+        iconAnchor: [100, -20]
+    });
+    return L.marker(new L.LatLng(row[0], row[1]), {icon: icon});
+};
+"""
+
+# Statyczna mapa tras rysowana w przeglądarce z pliku GeoJSON (osobna warstwa
+# dla każdego algorytmu); fetch wymaga serwowania katalogu przez HTTP
+GEOJSON_MAP_HTML = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Trasy</title>
+<link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css">
+<script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
+<style>html, body, #map {{ height: 100%; margin: 0; }}</style>
+</head>
+<body>
+<div id="map"></div>
+<script>
+var map = L.map("map", {{preferCanvas: true}}).setView([{lat}, {lng}], 7);
+L.tileLayer("https://{{s}}.tile.openstreetmap.org/{{z}}/{{x}}/{{y}}.png", {{
+    attribution: "&copy; OpenStreetMap contributors"
+}}).addTo(map);
+var control = L.control.layers(null, null, {{collapsed: false}}).addTo(map);
+fetch("{geojson}").then(function (r) {{ return r.json(); }}).then(function (data) {{
+    var layers = {{}};
+    data.features.forEach(function (f) {{
+        var p = f.properties;
+        if (!layers[p.algo]) {{
+            layers[p.algo] = L.layerGroup();
+            control.addOverlay(layers[p.algo], "Trasa - " + p.algo);
+            if (p.best) {{ layers[p.algo].addTo(map); }}
+        }}
+        L.geoJSON(f, {{
+            style: {{
+                color: p.color, weight: 4, opacity: 0.8,
+                dashArray: p.straight ? "10, 10" : null
+            }}
+        }}).bindTooltip(p.algo + " - Dzień " + p.day + ": " + Math.floor(p.km) + " km"
+            + (p.straight ? " (linia prosta)" : "")).addTo(layers[p.algo]);
+    }});
+}});
+</script>
+</body>
+</html>
+"""
+
+
 def przygotuj_etykiety_kolejnosci(path, daily_segments):
     """
     Przygotowuje etykiety z numerem dnia i kolejnością dla punktów trasy
@@ -331,30 +879,242 @@ def przygotuj_etykiety_kolejnosci(path, daily_segments):
     order_for_point = {}
 
     order_idx = 0
-    for day_idx, day in enumerate(daily_segments):
-        for segment in day["segments"]:
-            from_idx, to_idx = segment
+    for day_num, day in enumerate(daily_segments, 1):
+        segments = day["segments"]
+        for from_idx, _ in segments:
             # Zapisz dzień i kolejność dla punktu początkowego
             if from_idx not in day_for_point:
-                day_for_point[from_idx] = day_idx + 1
+                day_for_point[from_idx] = day_num
                 order_for_point[from_idx] = order_idx
                 order_idx += 1
 
-            # Dla ostatniego segmentu zapisz także dla punktu końcowego
-            if segment == day["segments"][-1]:
-                day_for_point[to_idx] = day_idx + 1
-                order_for_point[to_idx] = order_idx
-                order_idx += 1
+        # Dla ostatniego segmentu zapisz także punkt końcowy
+        if segments:
+            to_idx = segments[-1][1]
+            day_for_point[to_idx] = day_num
+            order_for_point[to_idx] = order_idx
+            order_idx += 1
 
     return day_for_point, order_for_point
 
 
+def wspolrzedne_lokalizacji(locations):
+    """
+    Zwraca współrzędne lokalizacji jako listę par [lat, lng]
+
+    Lista budowana jest raz dla całej mapy (współrzędne zaokrąglone do 5
+    miejsc po przecinku), aby pętle rysujące nie odczytywały słowników
+    lokalizacji dla każdego segmentu i znacznika.
+
+    Args:
+        locations (list): Lista lokalizacji z kluczami latitude i longitude
+
+    Returns:
+        list: Lista par [lat, lng] w kolejności lokalizacji
+    """
+    coords = np.asarray(
+        [(loc["latitude"], loc["longitude"]) for loc in locations], dtype=float
+    ).reshape(-1, 2)
+    return np.round(coords, 5).tolist()
+
+
+def zbierz_linie_dnia(segments, matrix_data, loc_coords):
+    """
+    Zbiera geometrie wszystkich segmentów jednego dnia trasy
+
+    Segmenty ze szczegółową trasą trafiają do linii ciągłych, a segmenty bez
+    niej - jako odcinki proste - do linii przerywanych, dzięki czemu cały dzień
+    można narysować dwoma obiektami PolyLine zamiast jednym na segment.
+
+    Args:
+        segments (list): Lista par (from_idx, to_idx) segmentów dnia
+        matrix_data (dict): Dane macierzy odległości (routes, distances)
+        loc_coords (list): Współrzędne lokalizacji z wspolrzedne_lokalizacji
+
+    Returns:
+        tuple: (solid_paths, dashed_paths, sum_km) - listy linii oraz łączny dystans
+    """
+    routes = matrix_data["routes"]
+    distances = matrix_data["distances"]
+
+    solid_paths = []
+    dashed_paths = []
+    sum_km = 0
+
+    for from_idx, to_idx in segments:
+        route_key = (from_idx, to_idx)
+        polyline_coords = routes.get(route_key)
+        sum_km += distances.get(route_key, 0)
+
+        # Jeśli mamy szczegóły trasy, rysujemy po drogach
+        if polyline_coords is not None and len(polyline_coords):
+            # Punkty (lat, lng) dla folium jedną konwersją tablicy - najpierw
+            # uproszczone (Douglas-Peucker), potem zaokrąglone do 5 miejsc
+            # (~1 m), bo pełna geometria i precyzja tylko powiększają plik HTML
+            simplified = uprosc_trase(polyline_coords, MAP_SIMPLIFY_TOLERANCE)
+            solid_paths.append(np.round(simplified, 5).tolist())
+        else:
+            # Jeśli brak szczegółów, rysujemy linię prostą
+            dashed_paths.append([loc_coords[from_idx], loc_coords[to_idx]])
+
+    return solid_paths, dashed_paths, sum_km
+
+
+def dodaj_linie_dnia(warstwa, linie, color, opis):
+    """
+    Dodaje do warstwy trasę jednego dnia jako najwyżej dwie multilinie
+
+    Args:
+        warstwa (folium.FeatureGroup): Warstwa, do której trafiają linie
+        linie (tuple): Wynik zbierz_linie_dnia dla tego dnia
+        color (str): Kolor linii dnia
+        opis (str): Początek podpowiedzi, np. "Algorytm - Dzień 1"
+    """
+    solid_paths, dashed_paths, sum_km = linie
+    day_tooltip = f"{opis}: {int(sum_km)} km"
+
+    if solid_paths:
+        folium.PolyLine(
+            solid_paths,
+            color=color,
+            weight=4,
+            opacity=0.8,
+            tooltip=day_tooltip,
+            smooth_factor=1.5,
+        ).add_to(warstwa)
+
+    if dashed_paths:
+        folium.PolyLine(
+            dashed_paths,
+            color=color,
+            weight=4,
+            opacity=0.8,
+            tooltip=f"{day_tooltip} (linia prosta)",
+            dash_array="10, 10",
+            smooth_factor=1.5,
+        ).add_to(warstwa)
+
+
+def zapisz_trasy_geojson(linie_dni, palety, najlepszy, center, out_dir="__out"):
+    """
+    Zapisuje trasy wszystkich algorytmów jako GeoJSON wraz ze statyczną mapą
+
+    Każdy dzień algorytmu to najwyżej dwa obiekty Feature (MultiLineString) -
+    odcinki po drogach i odcinki w linii prostej. Mapa HTML jest stałym
+    szablonem, który wczytuje plik GeoJSON i rysuje trasy w przeglądarce,
+    więc jej rozmiar nie zależy od liczby punktów tras.
+
+    Args:
+        linie_dni (dict): {algorytm: [wynik zbierz_linie_dnia dla kolejnych dni]}
+        palety (dict): {algorytm: kolory kolejnych dni}
+        najlepszy (str): Nazwa najlepszego algorytmu (warstwa widoczna na starcie)
+        center (tuple): Środek mapy (lat, lng)
+        out_dir (str): Katalog wyjściowy
+
+    Returns:
+        str: Ścieżka do wygenerowanego pliku HTML
+    """
+    features = []
+    for algo_name, dni in linie_dni.items():
+        for day_idx, (solid_paths, dashed_paths, sum_km) in enumerate(dni):
+            for paths, straight in ((solid_paths, False), (dashed_paths, True)):
+                if not paths:
+                    continue
+                features.append(
+                    {
+                        "type": "Feature",
+                        # GeoJSON przechowuje współrzędne w kolejności [lng, lat]
+                        "geometry": {
+                            "type": "MultiLineString",
+                            "coordinates": [
+                                [[lng, lat] for lat, lng in path] for path in paths
+                            ],
+                        },
+                        "properties": {
+                            "algo": algo_name,
+                            "day": day_idx + 1,
+                            "color": palety[algo_name][day_idx],
+                            "km": round(float(sum_km), 1),
+                            "straight": straight,
+                            "best": algo_name == najlepszy,
+                        },
+                    }
+                )
+
+    with open(os.path.join(out_dir, GEOJSON_ROUTES_FILE), "wb") as f:
+        f.write(
+            orjson.dumps(
+                {"type": "FeatureCollection", "features": features},
+                option=orjson.OPT_SERIALIZE_NUMPY,
+            )
+        )
+
+    html_file = os.path.join(out_dir, GEOJSON_MAP_FILE)
+    with open(html_file, "w", encoding="utf-8") as f:
+        f.write(
+            GEOJSON_MAP_HTML.format(
+                lat=center[0], lng=center[1], geojson=GEOJSON_ROUTES_FILE
+            )
+        )
+
+    return html_file
+
+
+def dodaj_znaczniki_kolejnosci(
+    warstwa, algo_name, path, daily_segments, loc_coords, day_colors
+):
+    """
+    Dodaje do warstwy znaczniki z numerem dnia i kolejnością odwiedzania
+
+    Znaczniki są kółkami (CircleMarker) z etykietą w podpowiedzi - przy mapie
+    z prefer_canvas=True rysowane są zbiorczo na jednym elemencie <canvas>,
+    zamiast tworzyć osobny element DOM (DivIcon) dla każdego punktu.
+
+    Args:
+        warstwa (folium.FeatureGroup): Warstwa kolejności dla algorytmu
+        algo_name (str): Nazwa algorytmu
+        path (list): Ścieżka z indeksami lokalizacji
+        daily_segments (list): Lista segmentów podzielonych na dni
+        loc_coords (list): Współrzędne lokalizacji z wspolrzedne_lokalizacji
+        day_colors (list): Paleta kolorów kolejnych dni
+    """
+    # Przygotuj informacje o kolejności punktów i przynależności do dni
+    day_for_point, order_for_point = przygotuj_etykiety_kolejnosci(path, daily_segments)
+
+    ncolors = len(day_colors)
+    last_i = len(path) - 1
+
+    for i, idx in enumerate(path):
+        if idx == 0 and i == last_i:  # Pomijamy ostatni punkt (ten sam co początkowy)
+            continue
+
+        day_num = day_for_point.get(idx, "?")
+        order_num = order_for_point.get(idx, i)
+
+        # Tworzymy etykietę z dniem i kolejnością
+        order_label = f"D{day_num}-{order_num:02d}"
+
+        # Użyj koloru odpowiadającego danemu dniowi (dzień jest
+        # 1-based; przy większej liczbie dni niż kolorów - modulo)
+        color = day_colors[(day_num - 1) % ncolors]
+
+        folium.CircleMarker(
+            location=loc_coords[idx],
+            radius=8,
+            color=color,
+            fill=True,
+            fill_opacity=0.8,
+            tooltip=f"{order_label} - {algo_name}: Dzień {day_num}, Punkt {order_num}",
+        ).add_to(warstwa)
+
+
 def generuj_mape_wielowarstwowa(
     json_file,
     html_file="index.html",
     show_route=True,
     offline_mode=False,
     force_recalculate=False,
+    debug_json=False,
 ):
     """
     Generuje mapę HTML z wieloma warstwami informacji: lokalizacje, numery, adresy,
@@ -366,6 +1126,7 @@ def generuj_mape_wielowarstwowa(
         show_route (bool): Czy wyświetlać warstwy z trasami
         offline_mode (bool): Czy używać tylko danych lokalnych (bez pobierania tras)
         force_recalculate (bool): Czy wymusić ponowne obliczenia tras
+        debug_json (bool): Czy zapisać wyniki TSP dodatkowo jako czytelny JSON
 
     Returns:
         bool: True jeśli operacja się powiodła
@@ -379,35 +1140,24 @@ def generuj_mape_wielowarstwowa(
             html_file = os.path.join("__out", html_file)
 
         # Wczytanie danych
-        with open(json_file, "r", encoding="utf-8") as f:
-            data = json.load(f)
-
-        # Filtrowanie lokalizacji z prawidłowymi współrzędnymi
-        valid_locations = [
-            item
-            for item in data
-            if "latitude" in item
-            and "longitude" in item
-            and item["latitude"] is not None
-            and item["longitude"] is not None
-            and not pd.isna(item["latitude"])
-            and not pd.isna(item["longitude"])
-        ]
+        data = _wczytaj_json(json_file)
+
+        # Filtrowanie lokalizacji z prawidłowymi współrzędnymi - jedno
+        # wektorowe sprawdzenie kolumn zamiast warunków dla każdego rekordu
+        lat, lng = _wspolrzedne_numeryczne(pd.DataFrame(data))
+        good = (lat.notna() & lng.notna()).to_numpy()
+        valid_locations = [data[i] for i in good.nonzero()[0]]
 
         if not valid_locations:
             print("Brak lokalizacji z prawidłowymi współrzędnymi")
             return False
 
         # Obliczanie średnich współrzędnych dla centrowania mapy
-        avg_lat = sum(item["latitude"] for item in valid_locations) / len(
-            valid_locations
-        )
-        avg_lng = sum(item["longitude"] for item in valid_locations) / len(
-            valid_locations
-        )
+        avg_lat = float(lat[good].mean())
+        avg_lng = float(lng[good].mean())
 
-        # Tworzenie mapy
-        mapa = folium.Map(location=[avg_lat, avg_lng], zoom_start=7)
+        # Tworzenie mapy (wektory rysowane na canvas zamiast osobnych elementów SVG)
+        mapa = folium.Map(location=[avg_lat, avg_lng], zoom_start=7, prefer_canvas=True)
 
         # Definicja podstawowych warstw
         warstwy = {
@@ -426,9 +1176,10 @@ def generuj_mape_wielowarstwowa(
                 ],  # Jeśli nie ma Nadarzyna, użyj pierwszej lokalizacji
             )
 
-            # Wyznacz pozostałe lokalizacje
+            # Wyznacz pozostałe lokalizacje (porównanie tożsamości zamiast
+            # porównywania wszystkich pól słowników)
             other_locations = [
-                item for item in valid_locations if item != start_location
+                item for item in valid_locations if item is not start_location
             ]
 
             # Oblicz macierz odległości
@@ -443,7 +1194,14 @@ def generuj_mape_wielowarstwowa(
             # Znajdź różne trasy z różnych algorytmów
             print("Wyznaczanie tras przy użyciu różnych algorytmów...")
             all_routes_data = znajdz_najkrotsza_trase_tsp(
-                matrix_data, force_recalculate=force_recalculate
+                matrix_data,
+                force_recalculate=force_recalculate,
+                debug_json=debug_json,
+            )
+
+            # Geometria tras tylko dla odcinków, które faktycznie rysujemy
+            uzupelnij_trasy_segmentow(
+                matrix_data, all_routes_data["algorithms"], offline_mode=offline_mode
             )
 
             # Tworzymy warstwy dla każdego algorytmu
@@ -478,57 +1236,59 @@ def generuj_mape_wielowarstwowa(
         for nazwa, warstwa in warstwy.items():
             warstwa.add_to(mapa)
 
-        # Dodanie obiektów do poszczególnych warstw
-        for item in valid_locations:
-            # Warstwa: Lokalizacje
-            popup_text = f"""
-            <b>{item.get('Miasto', '')}</b><br>
-            Adres: {item.get('Adres', '')}<br>
-            Kod pocztowy: {item.get('Kod pocztowy', '')}<br>
-            Numer: {item.get('numer', '')}
-            """
-
-            folium.Marker(
-                location=[item["latitude"], item["longitude"]],
-                popup=folium.Popup(popup_text, max_width=300),
-                tooltip=item.get("Miasto", ""),
-            ).add_to(warstwy["Lokalizacje"])
-
-            # Warstwa: Numery
-            folium.CircleMarker(
-                location=[item["latitude"], item["longitude"]],
-                radius=12,
-                color="red",
-                fill=True,
-                fill_color="red",
-                fill_opacity=0.7,
-                popup=f"Numer: {item.get('numer', '')}",
-            ).add_to(warstwy["Numery"])
-
-            folium.map.Marker(
-                [item["latitude"], item["longitude"]],
-                icon=folium.DivIcon(
-                    icon_size=(20, 20),
-                    icon_anchor=(10, 10),
-                    html=f'<div style="font-size: 10pt; color: white; text-align: center; font-weight: bold;">{item.get("numer", "")}</div>',
-                ),
-            ).add_to(warstwy["Numery"])
-
-            # Warstwa: Adresy
-            pelny_adres = item.get("pełny_adres", "")
-            folium.map.Marker(
-                [item["latitude"], item["longitude"]],
-                icon=folium.DivIcon(
-                    icon_size=(200, 20),
-                    icon_anchor=(100, -20),
-                    html=f'<div style="font-size: 9pt; color: black; background-color: white; padding: 2px; border-radius: 3px; text-align: center;">{pelny_adres}</div>',
-                ),
-            ).add_to(warstwy["Adresy"])
+        # Warstwy Lokalizacje i Numery - po jednej warstwie klastrów, której
+        # markery tworzy przeglądarka, zamiast osobnych obiektów folium na punkt
+        FastMarkerCluster(
+            [
+                [
+                    item["latitude"],
+                    item["longitude"],
+                    POPUP_HTML.format(
+                        miasto=item.get("Miasto", ""),
+                        adres=item.get("Adres", ""),
+                        kod=item.get("Kod pocztowy", ""),
+                        numer=item.get("numer", ""),
+                    ),
+                    str(item.get("Miasto", "")),
+                ]
+                for item in valid_locations
+            ],
+            callback=MARKER_CALLBACK,
+            options=MARKER_CLUSTER_OPTIONS,
+        ).add_to(warstwy["Lokalizacje"])
+
+        FastMarkerCluster(
+            [
+                [
+                    item["latitude"],
+                    item["longitude"],
+                    NUMER_HTML.format(numer=item.get("numer", "")),
+                    f"Numer: {item.get('numer', '')}",
+                ]
+                for item in valid_locations
+            ],
+            callback=NUMER_CALLBACK,
+            options=MARKER_CLUSTER_OPTIONS,
+        ).add_to(warstwy["Numery"])
+
+        # Warstwa: Adresy - również jako klastry zamiast markera DivIcon na punkt
+        FastMarkerCluster(
+            [
+                [
+                    item["latitude"],
+                    item["longitude"],
+                    ADRES_HTML.format(adres=item.get("pełny_adres", "")),
+                ]
+                for item in valid_locations
+            ],
+            callback=ADRES_CALLBACK,
+            options=MARKER_CLUSTER_OPTIONS,
+        ).add_to(warstwy["Adresy"])
 
         # Jeśli potrzebne warstwy trasy, dodajemy trasy i numery kolejności z różnych algorytmów
         if show_route:
             # Tworzymy legendę z informacjami o trasach
-            legend_html = f"""
+            legend_parts = [f"""
             <div style="position: fixed; 
                         bottom: 50px; right: 50px; width: 320px; height: auto;
                         border:2px solid grey; z-index:9999; 
@@ -543,11 +1303,13 @@ def generuj_mape_wielowarstwowa(
                 <td style="padding: 4px; text-align: right;">Dystans</td>
                 <td style="padding: 4px; text-align: right;">Dni</td>
             </tr>
-            """
+            """]
 
             # Dodajemy informacje o wszystkich algorytmach do legendy
-            # Słownik do przechowywania palet kolorów dla każdego algorytmu
+            # Słowniki palet kolorów dla każdego algorytmu - wyznaczane raz
+            # tutaj i używane dalej przez obie mapy zamiast ponownych odwołań
             algorithm_palettes = {}
+            algorithm_day_colors = {}
 
             # Mapowanie nazw algorytmów na klucze z ALGORITHM_COLORS
             algo_name_mapping = {
@@ -568,7 +1330,8 @@ def generuj_mape_wielowarstwowa(
 
                 # Użyj pierwszego koloru z palety dla danego algorytmu
                 algo_key = algo_name_mapping.get(algo_name, "default")
-                color = ALGORITHM_COLORS[algo_key][0]  # Pierwszy kolor z palety
+                algorithm_day_colors[algo_name] = ALGORITHM_COLORS[algo_key]
+                color = algorithm_day_colors[algo_name][0]  # Pierwszy kolor z palety
 
                 # Generujemy paletę kolorów dla dni tego algorytmu
                 algorithm_palettes[algo_name] = generuj_kolory_dla_dni(
@@ -580,7 +1343,7 @@ def generuj_mape_wielowarstwowa(
                     "font-weight: bold; background-color: #f0f0f0;" if is_best else ""
                 )
 
-                legend_html += f"""
+                legend_parts.append(f"""
                 <tr style="{style}">
                     <td style="padding: 4px;">
                         <svg height="3" width="30">
@@ -594,12 +1357,14 @@ def generuj_mape_wielowarstwowa(
                     <td style="padding: 4px; text-align: right;">{total_distance:.1f} km</td>
                     <td style="padding: 4px; text-align: center;">{num_days}</td>
                 </tr>
-                """
+                """)
 
-            legend_html += "</table>"
+            legend_parts.append("</table>")
 
             # Dodajemy sekcję z podziałem na dni dla wszystkich algorytmów
-            legend_html += '<div style="margin-top: 10px; border-top: 1px solid #ccc; padding-top: 8px;">'
+            legend_parts.append(
+                '<div style="margin-top: 10px; border-top: 1px solid #ccc; padding-top: 8px;">'
+            )
 
             for algo_name, algo_data in sorted_algos:
                 is_best = algo_name == all_routes_data["best_algorithm_name"]
@@ -608,25 +1373,25 @@ def generuj_mape_wielowarstwowa(
 
                 # Dodaj naglówek sekcji dla algorytmu tylko gdy mamy więcej niż 1 dzień
                 if len(daily_segments) > 1:
-                    legend_html += f"""
+                    legend_parts.append(f"""
                     <div style="margin-top: 6px; margin-bottom: 4px;">
                         <b>{algo_name}</b> - podział na dni:
                     </div>
                     <div style="display: flex; flex-wrap: wrap; margin-bottom: 8px;">
-                    """
+                    """)
 
                     # Dodaj kolorowe kwadraty dla dni
                     for i, color in enumerate(palette):
-                        legend_html += f"""
+                        legend_parts.append(f"""
                         <div style="margin: 2px; display: flex; align-items: center;">
                             <div style="width: 12px; height: 12px; background-color: {color}; margin-right: 4px;"></div>
                             <span style="font-size: 11px;">Dzień {i+1}</span>
                         </div>
-                        """
+                        """)
 
-                    legend_html += "</div>"
+                    legend_parts.append("</div>")
 
-            legend_html += """
+            legend_parts.append("""
             </div>
             
             <div style="font-size: 11px; margin-top: 8px; color: #666; text-align: center;">
@@ -634,10 +1399,24 @@ def generuj_mape_wielowarstwowa(
             </div>
             
             </div>
-            """
+            """)
+
+            legend_html = "".join(legend_parts)
 
             mapa.get_root().html.add_child(folium.Element(legend_html))
 
+            # Współrzędne punktów macierzy - raz dla wszystkich algorytmów i map
+            loc_coords = wspolrzedne_lokalizacji(matrix_data["locations"])
+
+            # Geometria dni liczona raz i używana przez obie mapy oraz GeoJSON
+            linie_dni = {
+                algo_name: [
+                    zbierz_linie_dnia(day["segments"], matrix_data, loc_coords)
+                    for day in algo_data["daily_segments"]
+                ]
+                for algo_name, algo_data in all_routes_data["algorithms"].items()
+            }
+
             # Dodajemy trasy i numery kolejności dla każdego algorytmu na osobne warstwy
             for algo_name, algo_data in all_routes_data["algorithms"].items():
                 # Rysowanie segmentów dziennych tras
@@ -647,60 +1426,19 @@ def generuj_mape_wielowarstwowa(
                 # Użyj palety kolorów specyficznej dla tego algorytmu
                 colors = algorithm_palettes[algo_name]
 
-                # Nazwa warstwy dla tego algorytmu
-                layer_name = f"Trasa - {algo_name}"
-                order_layer_name = f"Kolejność - {algo_name}"
-
-                # Przygotuj informacje o kolejności punktów i przynależności do dni
-                day_for_point, order_for_point = przygotuj_etykiety_kolejnosci(
-                    path, daily_segments
-                )
+                # Warstwy tego algorytmu (stałe dla wszystkich dni)
+                route_layer = warstwy[f"Trasa - {algo_name}"]
+                start_layer = start_day_warstwy[algo_name]
 
                 # Dodaj markery z informacją o kolejności i dniu
-                for i, idx in enumerate(path):
-                    if (
-                        idx == 0 and i == len(path) - 1
-                    ):  # Pomijamy ostatni punkt (ten sam co początkowy)
-                        continue
-
-                    loc = matrix_data["locations"][idx]
-                    day_num = day_for_point.get(idx, "?")
-                    order_num = order_for_point.get(idx, i)
-
-                    # Tworzymy etykietę z dniem i kolejnością
-                    order_label = f"D{day_num}-{order_num:02d}"
-
-                    # Użyj koloru odpowiadającego danemu dniowi
-                    algo_key = algo_name_mapping.get(algo_name, "default")
-                    colors = ALGORITHM_COLORS[algo_key]
-                    # Dzień jest 1-based, więc odejmujemy 1 aby dostać indeks
-                    day_idx = day_num - 1
-                    # Jeśli mamy więcej dni niż kolorów, używamy modulo
-                    color = colors[day_idx % len(colors)]
-
-                    # Utwórz marker z numerem dnia i kolejnością
-                    folium.map.Marker(
-                        [loc["latitude"], loc["longitude"]],
-                        icon=folium.DivIcon(
-                            icon_size=(60, 30),
-                            icon_anchor=(30, 15),
-                            html=f"""
-                            <div style="
-                                background-color: {color}; 
-                                color: white; 
-                                border-radius: 5px; 
-                                text-align: center; 
-                                font-weight: bold; 
-                                padding: 2px 5px;
-                                font-size: 10px;
-                                opacity: 0.8;
-                            ">
-                                {order_label}
-                            </div>
-                            """,
-                        ),
-                        tooltip=f"{algo_name}: Dzień {day_num}, Punkt {order_num}",
-                    ).add_to(warstwy[order_layer_name])
+                dodaj_znaczniki_kolejnosci(
+                    warstwy[f"Kolejność - {algo_name}"],
+                    algo_name,
+                    path,
+                    daily_segments,
+                    loc_coords,
+                    algorithm_day_colors[algo_name],
+                )
 
                 # Dodaj trasy na podstawie segmentów dziennych
                 for day_idx, day in enumerate(daily_segments):
@@ -709,59 +1447,24 @@ def generuj_mape_wielowarstwowa(
                     # Dodaj marker początku dnia
                     if day["segments"]:
                         first_segment = day["segments"][0]
-                        start_loc = matrix_data["locations"][first_segment[0]]
                         folium.CircleMarker(
-                            location=[start_loc["latitude"], start_loc["longitude"]],
+                            location=loc_coords[first_segment[0]],
                             radius=20,  # Zwiększony o 30% z 15
                             color=color,
                             fill=False,  # Pusty środek
                             weight=3,  # Grubsza linia obrysu
                             popup=f"Początek dnia {day_idx+1}",
                             tooltip=f"Początek dnia {day_idx+1}",
-                        ).add_to(
-                            start_day_warstwy[algo_name]
-                        )  # Używamy właściwej warstwy dla algorytmu
-
-                    for segment in day["segments"]:
-                        from_idx, to_idx = segment
-                        from_loc = matrix_data["locations"][from_idx]
-                        to_loc = matrix_data["locations"][to_idx]
-
-                        # Pobierz szczegóły trasy
-                        route_key = (from_idx, to_idx)
-                        polyline_coords = matrix_data["routes"].get(route_key)
-                        segment_distance = matrix_data["distances"].get(route_key, 0)
-
-                        # Jeśli mamy szczegóły trasy, rysujemy po drogach
-                        if polyline_coords:
-                            # Zamień kolejność współrzędnych dla folium (lat, lng)
-                            folium_coords = [(lat, lng) for lat, lng in polyline_coords]
-
-                            # Dodaj linię trasy
-                            tooltip = f"{algo_name} - Dzień {day_idx+1}: {int(segment_distance)} km"
-
-                            folium.PolyLine(
-                                folium_coords,
-                                color=color,
-                                weight=4,
-                                opacity=0.8,
-                                tooltip=tooltip,
-                            ).add_to(warstwy[layer_name])
-                        else:
-                            # Jeśli brak szczegółów, rysujemy linię prostą
-                            tooltip = f"{algo_name} - Dzień {day_idx+1}: {int(segment_distance)} km (linia prosta)"
-
-                            folium.PolyLine(
-                                [
-                                    (from_loc["latitude"], from_loc["longitude"]),
-                                    (to_loc["latitude"], to_loc["longitude"]),
-                                ],
-                                color=color,
-                                weight=4,
-                                opacity=0.8,
-                                tooltip=tooltip,
-                                dash_array="10, 10",
-                            ).add_to(warstwy[layer_name])
+                        ).add_to(start_layer)
+
+                    # Wszystkie segmenty dnia jako jedna multilinia (oraz
+                    # ewentualnie druga dla odcinków w linii prostej)
+                    dodaj_linie_dnia(
+                        route_layer,
+                        linie_dni[algo_name][day_idx],
+                        color,
+                        f"{algo_name} - Dzień {day_idx+1}",
+                    )
 
         # Dodanie kontrolki warstw
         folium.LayerControl().add_to(mapa)
@@ -771,7 +1474,9 @@ def generuj_mape_wielowarstwowa(
 
         # Tworzymy drugi plik tylko dla tras
         if show_route:
-            mapa_trasy = folium.Map(location=[avg_lat, avg_lng], zoom_start=7)
+            mapa_trasy = folium.Map(
+                location=[avg_lat, avg_lng], zoom_start=7, prefer_canvas=True
+            )
 
             # Dodajemy tylko warstwę lokalizacji i warstwy tras
             lokalizacje_warstwa = folium.FeatureGroup(name="Lokalizacje")
@@ -797,124 +1502,61 @@ def generuj_mape_wielowarstwowa(
                 mapa_trasy.add_child(start_day_warstwy[algo_name])
 
             # Dodaj markery lokalizacji
-            for item in valid_locations:
-                folium.Marker(
-                    location=[item["latitude"], item["longitude"]],
-                    popup=f"<b>{item.get('Miasto', '')}</b><br>#{item.get('numer', '')}",
-                    tooltip=item.get("Miasto", ""),
-                ).add_to(lokalizacje_warstwa)
+            FastMarkerCluster(
+                [
+                    [
+                        item["latitude"],
+                        item["longitude"],
+                        f"<b>{item.get('Miasto', '')}</b><br>#{item.get('numer', '')}",
+                        str(item.get("Miasto", "")),
+                    ]
+                    for item in valid_locations
+                ],
+                callback=MARKER_CALLBACK,
+                options=MARKER_CLUSTER_OPTIONS,
+            ).add_to(lokalizacje_warstwa)
 
             # Dodaj trasy i numery kolejności dla każdego algorytmu
             for algo_name, algo_data in all_routes_data["algorithms"].items():
                 daily_segments = algo_data["daily_segments"]
                 path = algo_data["path"]
-                colors = generuj_kolory_dla_dni(len(daily_segments), algo_name)
-
-                # Przygotuj informacje o kolejności punktów i przynależności do dni
-                day_for_point, order_for_point = przygotuj_etykiety_kolejnosci(
-                    path, daily_segments
-                )
+                colors = algorithm_palettes[algo_name]
+                route_layer = trasy_warstwy[algo_name]
+                start_layer = start_day_warstwy[algo_name]
 
                 # Dodaj markery z informacją o kolejności i dniu
-                for i, idx in enumerate(path):
-                    if (
-                        idx == 0 and i == len(path) - 1
-                    ):  # Pomijamy ostatni punkt (ten sam co początkowy)
-                        continue
-
-                    loc = matrix_data["locations"][idx]
-                    day_num = day_for_point.get(idx, "?")
-                    order_num = order_for_point.get(idx, i)
-
-                    # Tworzymy etykietę z dniem i kolejnością
-                    order_label = f"D{day_num}-{order_num:02d}"
-
-                    # Użyj koloru odpowiadającego danemu dniowi
-                    algo_key = algo_name_mapping.get(algo_name, "default")
-                    colors = ALGORITHM_COLORS[algo_key]
-                    # Dzień jest 1-based, więc odejmujemy 1 aby dostać indeks
-                    day_idx = day_num - 1
-                    # Jeśli mamy więcej dni niż kolorów, używamy modulo
-                    color = colors[day_idx % len(colors)]
-
-                    # Utwórz marker z numerem dnia i kolejnością
-                    folium.map.Marker(
-                        [loc["latitude"], loc["longitude"]],
-                        icon=folium.DivIcon(
-                            icon_size=(60, 30),
-                            icon_anchor=(30, 15),
-                            html=f"""
-                            <div style="
-                                background-color: {color}; 
-                                color: white; 
-                                border-radius: 5px; 
-                                text-align: center; 
-                                font-weight: bold; 
-                                padding: 2px 5px;
-                                font-size: 10px;
-                                opacity: 0.8;
-                            ">
-                                {order_label}
-                            </div>
-                            """,
-                        ),
-                        tooltip=f"{algo_name}: Dzień {day_num}, Punkt {order_num}",
-                    ).add_to(order_warstwy[algo_name])
+                dodaj_znaczniki_kolejnosci(
+                    order_warstwy[algo_name],
+                    algo_name,
+                    path,
+                    daily_segments,
+                    loc_coords,
+                    algorithm_day_colors[algo_name],
+                )
 
                 # Dodaj trasy
                 for day_idx, day in enumerate(daily_segments):
                     color = colors[day_idx]
 
-                    for segment in day["segments"]:
-                        from_idx, to_idx = segment
-                        from_loc = matrix_data["locations"][from_idx]
-                        to_loc = matrix_data["locations"][to_idx]
-
-                        route_key = (from_idx, to_idx)
-                        polyline_coords = matrix_data["routes"].get(route_key)
-                        segment_distance = matrix_data["distances"].get(route_key, 0)
-
-                        if polyline_coords:
-                            folium_coords = [(lat, lng) for lat, lng in polyline_coords]
-                            tooltip = f"{algo_name} - Dzień {day_idx+1}: {int(segment_distance)} km"
-
-                            folium.PolyLine(
-                                folium_coords,
-                                color=color,
-                                weight=4,
-                                opacity=0.8,
-                                tooltip=tooltip,
-                            ).add_to(trasy_warstwy[algo_name])
-                        else:
-                            tooltip = f"{algo_name} - Dzień {day_idx+1}: {int(segment_distance)} km (linia prosta)"
-
-                            folium.PolyLine(
-                                [
-                                    (from_loc["latitude"], from_loc["longitude"]),
-                                    (to_loc["latitude"], to_loc["longitude"]),
-                                ],
-                                color=color,
-                                weight=4,
-                                opacity=0.8,
-                                tooltip=tooltip,
-                                dash_array="10, 10",
-                            ).add_to(trasy_warstwy[algo_name])
+                    dodaj_linie_dnia(
+                        route_layer,
+                        linie_dni[algo_name][day_idx],
+                        color,
+                        f"{algo_name} - Dzień {day_idx+1}",
+                    )
 
                     # Dodaj marker początku dnia
                     if day["segments"]:
                         first_segment = day["segments"][0]
-                        start_loc = matrix_data["locations"][first_segment[0]]
                         folium.CircleMarker(
-                            location=[start_loc["latitude"], start_loc["longitude"]],
+                            location=loc_coords[first_segment[0]],
                             radius=20,  # Zwiększony o 30% z 15
                             color=color,
                             fill=False,  # Pusty środek
                             weight=3,  # Grubsza linia obrysu
                             popup=f"Początek dnia {day_idx+1}",
                             tooltip=f"Początek dnia {day_idx+1}",
-                        ).add_to(
-                            start_day_warstwy[algo_name]
-                        )  # Używamy właściwej warstwy dla algorytmu
+                        ).add_to(start_layer)
 
             # Dodaj warstwy do mapy
             lokalizacje_warstwa.add_to(mapa_trasy)
@@ -937,6 +1579,15 @@ def generuj_mape_wielowarstwowa(
                 "Wygenerowano mapę ze wszystkimi trasami: __out/mapa_wszystkich_tras.html"
             )
 
+            # Lekka wersja mapy tras: GeoJSON + statyczny szablon Leaflet
+            geojson_html = zapisz_trasy_geojson(
+                linie_dni,
+                algorithm_palettes,
+                all_routes_data["best_algorithm_name"],
+                (avg_lat, avg_lng),
+            )
+            print(f"Wygenerowano mapę tras z pliku GeoJSON: {geojson_html}")
+
         print(f"Mapa główna została wygenerowana i zapisana jako {html_file}")
         return True
 
@@ -946,6 +1597,13 @@ def generuj_mape_wielowarstwowa(
         return False
 
 
+def _brak_wartosci(v):
+    """Czy wartość współrzędnej jest pusta (None, NaN lub tekst "nan")"""
+    # NaN jako jedyna wartość jest różny od samego siebie - bez wywołań
+    # pd.isna dla typowej, poprawnej liczby
+    return v is None or v != v or (type(v) is str and v.lower() == "nan")
+
+
 def inicjalizuj_nan_wartosci(json_file):
     """
     Inicjalizuje wartości NaN w pliku JSON na None, aby poprawnie je rozpoznawać
@@ -958,23 +1616,22 @@ def inicjalizuj_nan_wartosci(json_file):
     """
     try:
         # Wczytanie danych
-        with open(json_file, "r", encoding="utf-8") as f:
-            data = json.load(f)
-
-        # Zamiana NaN na None
-        for item in data:
-            if "latitude" in item and (
-                pd.isna(item["latitude"]) or str(item["latitude"]).lower() == "nan"
-            ):
-                item["latitude"] = None
-            if "longitude" in item and (
-                pd.isna(item["longitude"]) or str(item["longitude"]).lower() == "nan"
-            ):
-                item["longitude"] = None
+        data = _wczytaj_json(json_file)
+
+        # Zamiana NaN na None - braki wykrywane wektorowo dla całej kolumny,
+        # a zmieniane są tylko rekordy, w których faktycznie wystąpiły
+        df = pd.DataFrame(data)
+        for col in ("latitude", "longitude"):
+            if col not in df:
+                continue
+            values = df[col]
+            brak = values.isna() | values.astype(str).str.lower().eq("nan")
+            for i in brak.to_numpy().nonzero()[0]:
+                if col in data[i]:
+                    data[i][col] = None
 
         # Zapis danych
-        with open(json_file, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
+        _zapisz_json(json_file, data)
 
         print(f"Zainicjalizowano wartości NaN w pliku {json_file}")
         return True
@@ -992,8 +1649,7 @@ def sprawdz_status_serwisu_geolokalizacji():
         bool: True jeśli serwis jest dostępny, False w przeciwnym przypadku
     """
     try:
-        geolocator = Nominatim(user_agent="test_service")
-        location = geolocator.geocode("Warszawa, Polska", timeout=10)
+        location = _geocode("Warszawa, Polska", timeout=10)
         if location:
             print("Serwis geolokalizacji jest dostępny.")
             return True
@@ -1028,21 +1684,18 @@ def update_json_with_numbers(json_file_path):
             data = df.to_dict(orient="records")
 
             # Zapisz dane do JSON
-            with open(json_file_path, "w", encoding="utf-8") as file:
-                json.dump(data, file, ensure_ascii=False, indent=4)
+            _zapisz_json(json_file_path, data)
             print(f"Utworzono nowy plik {json_file_path} z danymi z Excela")
 
         # Wczytaj dane z pliku JSON
-        with open(json_file_path, "r", encoding="utf-8") as file:
-            data = json.load(file)
+        data = _wczytaj_json(json_file_path)
 
         # Dodaj numerację do każdego wpisu
         for i, entry in enumerate(data, 1):
             entry["numer"] = i
 
         # Zapisz zaktualizowane dane z powrotem do pliku
-        with open(json_file_path, "w", encoding="utf-8") as file:
-            json.dump(data, file, ensure_ascii=False, indent=4)
+        _zapisz_json(json_file_path, data)
 
         print(f"Pomyślnie zaktualizowano plik {json_file_path} z numeracją")
         return True
@@ -1064,11 +1717,15 @@ def popraw_wspolrzedne_dla_lokalizacji(json_file):
     """
     try:
         # Wczytanie danych z JSON
-        with open(json_file, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        data = _wczytaj_json(json_file)
+
+        # Klucz współrzędnych jako krotka liczb (zaokrąglonych do 6 miejsc)
+        # zamiast tekstu "lat,lng" - porównanie nie zależy od zapisu liczby
+        def klucz_wspolrzednych(lat, lng):
+            return (round(float(lat), 6), round(float(lng), 6))
 
         # Sprawdź, czy występują duplikaty współrzędnych
-        coords_count = {}
+        coords_count = defaultdict(list)
         for item in data:
             if (
                 "latitude" in item
@@ -1076,15 +1733,20 @@ def popraw_wspolrzedne_dla_lokalizacji(json_file):
                 and item["latitude"] is not None
                 and item["longitude"] is not None
             ):
-                coord_key = f"{item['latitude']},{item['longitude']}"
-                if coord_key in coords_count:
-                    coords_count[coord_key].append(item["pełny_adres"])
-                else:
-                    coords_count[coord_key] = [item["pełny_adres"]]
+                coord_key = klucz_wspolrzednych(item["latitude"], item["longitude"])
+                coords_count[coord_key].append(item["pełny_adres"])
 
         # Znajdź duplikaty
         duplicates = {k: v for k, v in coords_count.items() if len(v) > 1}
 
+        # Pozycja adresu w grupie duplikatów (pierwsze wystąpienie) liczona
+        # raz, zamiast list.index() przy każdym rekordzie
+        addr_pos = {}
+        for coord_key, addresses in duplicates.items():
+            pozycje = addr_pos[coord_key] = {}
+            for pos, addr in enumerate(addresses):
+                pozycje.setdefault(addr, pos)
+
         if not duplicates:
             print("Nie znaleziono zduplikowanych współrzędnych.")
             return True
@@ -1100,12 +1762,14 @@ def popraw_wspolrzedne_dla_lokalizacji(json_file):
         # Próba poprawy duplikatów - wymuś ponowną geolokalizację
         poprawione = 0
         for i, item in enumerate(data):
-            if "pełny_adres" in item and "latitude" in item and "longitude" in item:
-                coord_key = f"{item['latitude']},{item['longitude']}"
-                if (
-                    coord_key in duplicates
-                    and duplicates[coord_key].index(item["pełny_adres"]) > 0
-                ):
+            if (
+                "pełny_adres" in item
+                and item.get("latitude") is not None
+                and item.get("longitude") is not None
+            ):
+                coord_key = klucz_wspolrzednych(item["latitude"], item["longitude"])
+                pos = addr_pos.get(coord_key, {}).get(item["pełny_adres"], 0)
+                if pos > 0:
                     print(f"Próba poprawy współrzędnych dla: {item['pełny_adres']}")
                     # Wymuszamy bardzo dokładny adres
                     miasto = item.get("Miasto", "").strip()
@@ -1120,7 +1784,7 @@ def popraw_wspolrzedne_dla_lokalizacji(json_file):
                     if (
                         latitude is not None
                         and longitude is not None
-                        and f"{latitude},{longitude}" != coord_key
+                        and klucz_wspolrzednych(latitude, longitude) != coord_key
                     ):
                         item["latitude"] = latitude
                         item["longitude"] = longitude
@@ -1129,19 +1793,14 @@ def popraw_wspolrzedne_dla_lokalizacji(json_file):
                     else:
                         # Jeśli nie udało się znaleźć nowych współrzędnych, dodaj małe przesunięcie
                         # aby były widoczne na mapie (tylko do celów wizualizacji)
-                        item["latitude"] = float(item["latitude"]) + (
-                            0.002 * (duplicates[coord_key].index(item["pełny_adres"]))
-                        )
-                        item["longitude"] = float(item["longitude"]) + (
-                            0.002 * (duplicates[coord_key].index(item["pełny_adres"]))
-                        )
+                        item["latitude"] = float(item["latitude"]) + 0.002 * pos
+                        item["longitude"] = float(item["longitude"]) + 0.002 * pos
                         poprawione += 1
                         print(f"Dodano przesunięcie dla: {item['pełny_adres']}")
 
                     # Zapisuj częściowe wyniki co 3 poprawki
                     if poprawione % 3 == 0:
-                        with open(json_file, "w", encoding="utf-8") as f:
-                            json.dump(data, f, ensure_ascii=False, indent=4)
+                        _zapisz_json(json_file, data)
                         print(
                             f"Zapisano częściowe wyniki. Poprawiono {poprawione} adresów."
                         )
@@ -1150,8 +1809,7 @@ def popraw_wspolrzedne_dla_lokalizacji(json_file):
                     time.sleep(2)
 
         # Zapis zaktualizowanych danych do pliku JSON
-        with open(json_file, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
+        _zapisz_json(json_file, data)
 
         print(
             f"Zakończono poprawianie zduplikowanych współrzędnych. Poprawiono {poprawione} adresów."
@@ -1163,6 +1821,63 @@ def popraw_wspolrzedne_dla_lokalizacji(json_file):
         return False
 
 
+def _adresy_do_geolokalizacji(data):
+    """
+    Buduje sformatowane adresy do geolokalizacji dla wszystkich rekordów
+
+    Operacje tekstowe wykonywane są na całych kolumnach (pandas .str) zamiast
+    w pętli po rekordach.
+
+    Args:
+        data (list): Lista rekordów z polami Miasto, Adres i Kod pocztowy
+
+    Returns:
+        list: Adresy w formacie "ul. Nazwa numer, kod Miasto, Polska"
+    """
+    if not data:
+        return []
+
+    df = pd.DataFrame(data)
+
+    def kolumna(nazwa):
+        if nazwa not in df:
+            return pd.Series("", index=df.index)
+        return df[nazwa].astype(object).fillna("").astype(str).str.strip()
+
+    miasto = kolumna("Miasto")
+    kod = kolumna("Kod pocztowy")
+
+    # Dokładniejsze przetwarzanie adresu
+    # Usunięcie zbędnych spacji
+    adres = kolumna("Adres").str.split().str.join(" ")
+
+    # Poprawna standardyzacja ulicy - pierwszy pasujący prefiks decyduje,
+    # który zapis (wszystkie jego wystąpienia) zamieniamy na "ul."
+    do_zamiany = pd.Series(True, index=df.index)
+    for prefiks in ("Ul.", "UL.", "Ulica", "ULICA"):
+        maska = do_zamiany & adres.str.startswith(prefiks)
+        adres = adres.mask(maska, adres.str.replace(prefiks, "ul.", regex=False))
+        do_zamiany &= ~maska
+
+    # Wyciągnięcie numeru domu i ulicy (ostatni wyraz to numer)
+    czesci = adres.str.rpartition(" ")
+    bez_numeru = czesci[1] == ""
+    numer_domu = czesci[2].mask(bez_numeru, "")
+    nazwa_ulicy = czesci[0].mask(bez_numeru, adres)
+
+    # Formatowanie z prefiksem ul. tylko jeśli nie ma go jeszcze
+    bez_prefiksu = ~nazwa_ulicy.str.startswith(("ul.", "al.", "pl."))
+    nazwa_ulicy = nazwa_ulicy.mask(bez_prefiksu, "ul. " + nazwa_ulicy)
+
+    # Dodanie separatora między ulicą a numerem i usunięcie podwójnych spacji
+    poprawne_adresy = (
+        (nazwa_ulicy + " " + numer_domu + ", " + kod + " " + miasto + ", Polska")
+        .str.split()
+        .str.join(" ")
+    )
+    return poprawne_adresy.tolist()
+
+
 def popraw_format_adresow(json_file):
     """
     Poprawia format adresów w pliku JSON i przygotowuje je do geolokalizacji
@@ -1175,55 +1890,18 @@ def popraw_format_adresow(json_file):
     """
     try:
         # Wczytanie danych
-        with open(json_file, "r", encoding="utf-8") as f:
-            data = json.load(f)
-
-        # Poprawianie każdego rekordu
-        for item in data:
-            miasto = item.get("Miasto", "").strip()
-            adres = item.get("Adres", "").strip()
-            kod = item.get("Kod pocztowy", "").strip()
-
-            # Dokładniejsze przetwarzanie adresu
-            # Usunięcie zbędnych spacji
-            adres = " ".join(adres.split())
-
-            # Poprawna standardyzacja ulicy
-            if adres.startswith("Ul."):
-                adres = adres.replace("Ul.", "ul.")
-            elif adres.startswith("UL."):
-                adres = adres.replace("UL.", "ul.")
-            elif adres.startswith("Ulica"):
-                adres = adres.replace("Ulica", "ul.")
-            elif adres.startswith("ULICA"):
-                adres = adres.replace("ULICA", "ul.")
-
-            # Wyciągnięcie numeru domu i ulicy
-            ulica_parts = adres.split(" ")
-            numer_domu = ulica_parts[-1] if len(ulica_parts) > 1 else ""
-            nazwa_ulicy = " ".join(ulica_parts[:-1]) if len(ulica_parts) > 1 else adres
-
-            # Formatowanie z prefiksem ul. tylko jeśli nie ma go jeszcze
-            if not (
-                nazwa_ulicy.startswith("ul.")
-                or nazwa_ulicy.startswith("al.")
-                or nazwa_ulicy.startswith("pl.")
-            ):
-                nazwa_ulicy = "ul. " + nazwa_ulicy
+        data = _wczytaj_json(json_file)
 
-            # Dodanie separatora między ulicą a numerem
-            poprawny_adres = f"{nazwa_ulicy} {numer_domu}, {kod} {miasto}, Polska"
-
-            # Usunięcie podwójnych spacji
-            poprawny_adres = " ".join(poprawny_adres.split())
+        # Wszystkie rekordy przetwarzane naraz operacjami na kolumnach
+        poprawne_adresy = _adresy_do_geolokalizacji(data)
 
+        for item, poprawny_adres in zip(data, poprawne_adresy):
             item["adres_do_geolokalizacji"] = poprawny_adres
 
-            print(f"Przygotowano adres: {poprawny_adres}")
+        print(f"Przygotowano {len(data)} adresów do geolokalizacji")
 
         # Zapisanie zaktualizowanych danych
-        with open(json_file, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
+        _zapisz_json(json_file, data)
 
         print(f"Poprawiono format adresów w pliku {json_file}")
         return True
@@ -1244,14 +1922,11 @@ def geolokalizuj_pojedynczy_adres(adres):
         tuple: (latitude, longitude) lub (None, None)
     """
     try:
-        geolocator = Nominatim(user_agent="jednorazowa_dokladna_geolokalizacja")
         print(f"Geolokalizacja adresu: {adres}")
 
-        # Wydłużony timeout dla pojedynczego zapytania
-        time.sleep(1)  # Małe opóźnienie przed zapytaniem
-
-        # Zwiększenie parametrów dokładności
-        location = geolocator.geocode(
+        # Odstęp między zapytaniami (także z innych wątków) pilnuje wspólny
+        # RateLimiter, więc nie ma tu już stałych opóźnień
+        location = _geocode(
             adres,
             timeout=20,
             exactly_one=True,
@@ -1280,8 +1955,7 @@ def geolokalizuj_pojedynczy_adres(adres):
             # Spróbuj alternatywny format adresu
             alt_adres = adres.replace("ul.", "").replace(",", "")
             print(f"Próba z alternatywnym formatem adresu: {alt_adres}")
-            time.sleep(1.5)
-            alt_location = geolocator.geocode(alt_adres, timeout=20, language="pl")
+            alt_location = _geocode(alt_adres, timeout=20, language="pl")
 
             if alt_location:
                 print(
@@ -1297,6 +1971,79 @@ def geolokalizuj_pojedynczy_adres(adres):
         return None, None
 
 
+def _geolokalizuj_pojedynczy_z_cache(adres, wyniki):
+    """
+    Geolokalizuje adres przez geolokalizuj_pojedynczy_adres, sprawdzając
+    najpierw wyniki bieżącego przebiegu i trwały cache geolokalizacji
+
+    Do trwałego cache trafiają tylko znalezione współrzędne - (None, None)
+    oznacza także błąd serwisu, więc wynik negatywny pamiętany jest wyłącznie
+    do końca przebiegu.
+
+    Args:
+        adres (str): Adres do geolokalizacji
+        wyniki (dict): Wyniki bieżącego przebiegu {adres: (lat, lng)}
+
+    Returns:
+        tuple: (latitude, longitude, odpytano) - odpytano=True, jeśli wysłano
+            zapytanie do serwisu geolokalizacji
+    """
+    if adres in wyniki:
+        return (*wyniki[adres], False)
+
+    # Osobna przestrzeń kluczy - wynik dokładnej geolokalizacji może różnić
+    # się od wyniku geolokalizuj_adres dla tego samego adresu
+    klucz = "dokladny|" + adres
+    zapisany = wczytaj_z_cache_geolokalizacji(klucz)
+    if zapisany is not None and zapisany[0] is not None:
+        wyniki[adres] = zapisany
+        return (*wyniki[adres], False)
+
+    # geolokalizuj_pojedynczy_adres sam zapisuje wynik pod tym kluczem
+    wynik = geolokalizuj_pojedynczy_adres(adres)
+    wyniki[adres] = wynik
+    return (*wynik, True)
+
+
+def _geolokalizuj_z_wariantami(item, wyniki):
+    """
+    Geolokalizuje rekord, próbując kolejno adresu do geolokalizacji,
+    alternatywnego formatu "ulica, miasto, kod" i na końcu samego miasta
+
+    Args:
+        item (dict): Rekord z polem "adres_do_geolokalizacji"
+        wyniki (dict): Wyniki bieżącego przebiegu {adres: (lat, lng)}
+
+    Returns:
+        tuple: (latitude, longitude) lub (None, None)
+    """
+    lat, lng, _ = _geolokalizuj_pojedynczy_z_cache(
+        item["adres_do_geolokalizacji"], wyniki
+    )
+    if lat is not None and lng is not None:
+        print(f"Uzupełniono współrzędne dla: {item['Miasto']}")
+        return lat, lng
+
+    # Jeśli nie udało się znaleźć współrzędnych, spróbuj sformułować adres inaczej
+    miasto = item.get("Miasto", "").strip()
+    ulica = item.get("Adres", "").strip()
+    kod = item.get("Kod pocztowy", "").strip()
+
+    alternatywny_adres = f"{ulica}, {miasto}, {kod}, Polska"
+    print(f"Próba z alternatywnym formatem adresu: {alternatywny_adres}")
+
+    lat, lng, _ = _geolokalizuj_pojedynczy_z_cache(alternatywny_adres, wyniki)
+    if lat is not None and lng is not None:
+        print(f"Uzupełniono współrzędne dla alternatywnego adresu: {item['Miasto']}")
+        return lat, lng
+
+    # Jeśli nadal nie działa, spróbuj samo miasto
+    lat, lng, _ = _geolokalizuj_pojedynczy_z_cache(f"{miasto}, Polska", wyniki)
+    if lat is not None and lng is not None:
+        print(f"Uzupełniono współrzędne dla miasta: {miasto}")
+    return lat, lng
+
+
 def uzupelnij_wspolrzedne_jednorazowo(json_file):
     """
     Uzupełnia współrzędne dla wszystkich adresów w pliku JSON
@@ -1310,83 +2057,74 @@ def uzupelnij_wspolrzedne_jednorazowo(json_file):
     """
     try:
         # Wczytanie danych
-        with open(json_file, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        data = _wczytaj_json(json_file)
+
+        # Wyniki przerwanego wcześniej przebiegu
+        odtworzone = _odtworz_z_dziennika(
+            json_file, data, klucz_adresu="adres_do_geolokalizacji"
+        )
 
         # Licznik przetworzonych adresów
         processed = 0
 
+        # Wyniki dla adresów odpytanych w tym przebiegu - powtarzający się
+        # adres nie jest wysyłany ponownie (ani nie czeka na opóźnienie API)
+        wyniki = {}
+
         # Najpierw sortujemy lokalizacje, aby zacząć od adresów
         # z pełnymi danymi
-        for item in sorted(
-            data, key=lambda x: len(x.get("adres_do_geolokalizacji", "")), reverse=True
-        ):
+        kolejnosc = sorted(
+            range(len(data)),
+            key=lambda i: len(data[i].get("adres_do_geolokalizacji", "")),
+            reverse=True,
+        )
+
+        # Rekordy z tym samym adresem geolokalizowane są jednym zadaniem, żeby
+        # równoległe wątki nie wysyłały tego samego zapytania jednocześnie
+        do_geolokalizacji = {}
+        for i in kolejnosc:
+            item = data[i]
             if "adres_do_geolokalizacji" in item:
                 # Sprawdzenie czy już mamy współrzędne
-                if (
-                    "latitude" not in item
-                    or item["latitude"] is None
-                    or pd.isna(item["latitude"])
-                    or "longitude" not in item
-                    or item["longitude"] is None
-                    or pd.isna(item["longitude"])
+                if _brak_wartosci(item.get("latitude")) or _brak_wartosci(
+                    item.get("longitude")
                 ):
-
-                    # Wykonanie geolokalizacji
-                    lat, lng = geolokalizuj_pojedynczy_adres(
-                        item["adres_do_geolokalizacji"]
-                    )
-
-                    if lat is not None and lng is not None:
-                        item["latitude"] = lat
-                        item["longitude"] = lng
-                        processed += 1
-                        print(f"Uzupełniono współrzędne dla: {item['Miasto']}")
-                    else:
-                        # Jeśli nie udało się znaleźć współrzędnych,
-                        # spróbuj sformułować adres inaczej
-                        miasto = item.get("Miasto", "").strip()
-                        ulica = item.get("Adres", "").strip()
-                        kod = item.get("Kod pocztowy", "").strip()
-
-                        alternatywny_adres = f"{ulica}, {miasto}, {kod}, Polska"
-                        print(
-                            f"Próba z alternatywnym formatem adresu: "
-                            f"{alternatywny_adres}"
-                        )
-
-                        lat, lng = geolokalizuj_pojedynczy_adres(alternatywny_adres)
-
-                        if lat is not None and lng is not None:
-                            item["latitude"] = lat
-                            item["longitude"] = lng
-                            processed += 1
-                            print(
-                                f"Uzupełniono współrzędne dla "
-                                f"alternatywnego adresu: {item['Miasto']}"
-                            )
-                        else:
-                            # Jeśli nadal nie działa, spróbuj samo miasto
-                            miasto_adres = f"{miasto}, Polska"
-                            lat, lng = geolokalizuj_pojedynczy_adres(miasto_adres)
-
-                            if lat is not None and lng is not None:
-                                item["latitude"] = lat
-                                item["longitude"] = lng
-                                processed += 1
-                                print(
-                                    f"Uzupełniono współrzędne dla " f"miasta: {miasto}"
-                                )
-
-                    # Zapisywanie po każdym przetworzonym adresie
-                    with open(json_file, "w", encoding="utf-8") as f:
-                        json.dump(data, f, ensure_ascii=False, indent=4)
-
-                    # Dłuższe opóźnienie dla API
-                    time.sleep(2.5)
+                    do_geolokalizacji.setdefault(
+                        item["adres_do_geolokalizacji"], []
+                    ).append(i)
                 else:
                     print(f"Adres już ma współrzędne: {item['Miasto']}")
 
+        # Każdy wynik dopisywany jest do dziennika (append-only), a cały plik
+        # JSON zapisywany tylko raz na końcu zamiast po każdym adresie. Wątki
+        # nakładają na siebie czas oczekiwania na odpowiedź serwisu, a wspólny
+        # RateLimiter pilnuje odstępu między zapytaniami
+        with open(_plik_dziennika(json_file), "ab") as dziennik, ThreadPoolExecutor(
+            max_workers=GEOLOCATION_WORKERS
+        ) as executor:
+            futures = {
+                executor.submit(_geolokalizuj_z_wariantami, data[indeksy[0]], wyniki): (
+                    adres,
+                    indeksy,
+                )
+                for adres, indeksy in do_geolokalizacji.items()
+            }
+            for future in as_completed(futures):
+                adres, indeksy = futures[future]
+                lat, lng = future.result()
+                if lat is None or lng is None:
+                    continue
+                for i in indeksy:
+                    data[i]["latitude"] = lat
+                    data[i]["longitude"] = lng
+                    processed += 1
+                    _dopisz_do_dziennika(dziennik, i, adres, lat, lng)
+
+        # Zapis zaktualizowanych danych - dziennik nie jest już potrzebny
+        if processed or odtworzone:
+            _zapisz_json(json_file, data)
+        os.remove(_plik_dziennika(json_file))
+
         print(f"Uzupełniono współrzędne dla {processed} adresów")
         return True
 
@@ -1409,8 +2147,6 @@ def pobierz_trase(start_lat, start_lng, end_lat, end_lng, cached_routes=None):
     Returns:
         tuple: (polyline_coords, distance_km) lub (None, None) w przypadku błędu
     """
-    import threading
-
     # Mutex do synchronizacji dostępu do cache'u
     if not hasattr(pobierz_trase, "lock"):
         pobierz_trase.lock = threading.Lock()
@@ -1426,13 +2162,12 @@ def pobierz_trase(start_lat, start_lng, end_lat, end_lng, cached_routes=None):
         if cache_key in cached_routes:
             return cached_routes[cache_key]
         elif reverse_key in cached_routes:
-            # Dla wielu dróg trasa w obie strony jest taka sama
+            # Dla wielu dróg trasa w obie strony jest taka sama - cache
+            # przechowuje tylko jeden kierunek, a przeciwny odwracany jest
+            # przy odczycie zamiast trzymać w pamięci drugą kopię geometrii
             polyline_coords, distance_km = cached_routes[reverse_key]
             if polyline_coords:
-                # Odwracamy kolejność punktów dla przeciwnego kierunku
-                reversed_coords = polyline_coords[::-1]
-                cached_routes[cache_key] = (reversed_coords, distance_km)
-                return reversed_coords, distance_km
+                return tuple(reversed(polyline_coords)), distance_km
 
     try:
         # Używamy API OSRM do wyznaczania trasy z retries
@@ -1440,8 +2175,13 @@ def pobierz_trase(start_lat, start_lng, end_lat, end_lng, cached_routes=None):
         for attempt in range(max_retries):
             try:
                 url = f"http://router.project-osrm.org/route/v1/driving/{start_lng},{start_lat};{end_lng},{end_lat}?overview=full&geometries=polyline"
-                response = requests.get(url, timeout=30)
-                data = response.json()
+                # Wspólna sesja z pulą połączeń keep-alive zamiast nowego
+                # połączenia TCP dla każdej pary punktów; odpowiedź
+                # skompresowana, a JSON parsowany przez orjson
+                response = get_session().get(
+                    url, timeout=30, headers={"Accept-Encoding": "gzip"}
+                )
+                data = orjson.loads(response.content)
 
                 if (
                     response.status_code == 200
@@ -1472,13 +2212,13 @@ def pobierz_trase(start_lat, start_lng, end_lat, end_lng, cached_routes=None):
             data["routes"][0]["distance"] / 1000
         )  # konwersja z metrów na kilometry
 
-        # Dekodowanie polyline do listy współrzędnych
-        polyline_coords = polyline.decode(encoded_polyline)
+        # Dekodowanie polyline do niezmiennej krotki współrzędnych - trafienia
+        # w cache zwracają ten sam obiekt bez kopiowania i nikt go nie zmodyfikuje
+        polyline_coords = tuple(polyline.decode(encoded_polyline))
 
-        # Zapisz trasę w cache (w obu kierunkach)
+        # Zapisz trasę w cache (kierunek przeciwny obsługuje odczyt)
         with pobierz_trase.lock:
             cached_routes[cache_key] = (polyline_coords, distance_km)
-            cached_routes[reverse_key] = (polyline_coords[::-1], distance_km)
 
         print(f"Pobrano trasę: {distance_km:.1f} km")
         return polyline_coords, distance_km
@@ -1499,11 +2239,6 @@ def oblicz_macierz_odleglosci(
     """
     Wykorzystuje istniejący cache tras do natychmiastowego stworzenia matrycy odległości
     """
-    import hashlib
-    import json
-
-    from core.cache_manager import CacheManager
-
     # Inicjalizacja cache managera
     cache_manager = CacheManager(
         cache_dir="cache",
@@ -1515,20 +2250,15 @@ def oblicz_macierz_odleglosci(
     all_locations = [start_location] + locations
     n = len(all_locations)
 
-    # Generowanie klucza cache na podstawie lokalizacji
-    def generate_matrix_key(locations_list):
-        loc_coords = sorted(
-            [
+    # Wygeneruj klucz dla matrycy na podstawie lokalizacji
+    matrix_key = _klucz_matrycy(
+        tuple(
+            sorted(
                 (loc.get("latitude", 0), loc.get("longitude", 0))
-                for loc in locations_list
-            ]
+                for loc in all_locations
+            )
         )
-        loc_str = json.dumps(loc_coords)
-        matrix_key = hashlib.sha256(loc_str.encode()).hexdigest()
-        return matrix_key
-
-    # Wygeneruj klucz dla matrycy
-    matrix_key = generate_matrix_key(all_locations)
+    )
 
     # Sprawdź czy matryca istnieje w cache
     cached_matrix = cache_manager.get_matrix_entry(matrix_key)
@@ -1555,61 +2285,68 @@ def oblicz_macierz_odleglosci(
     # Inicjalizuj struktury danych
     distance_matrix = {}
     routes_data = {}
-    brakujace_trasy = 0
-
-    # Stwórz macierz bezpośrednio z istniejącego cache
-    for i in range(n):
-        for j in range(n):
-            if i != j:
-                loc_i = all_locations[i]
-                loc_j = all_locations[j]
-
-                # Pobierz trasę bezpośrednio z cache
-                polyline_coords, distance_km = cache_manager.get_route(
-                    loc_i["latitude"],
-                    loc_i["longitude"],
-                    loc_j["latitude"],
-                    loc_j["longitude"],
-                )
 
-                if polyline_coords is not None or distance_km is not None:
-                    # Trasa znaleziona w cache
-                    key = (i, j)
-                    distance_matrix[key] = distance_km
-                    routes_data[key] = polyline_coords
-                else:
-                    # Trasa nie znaleziona - tylko obliczam tę jedną brakującą
-                    brakujace_trasy += 1
-                    print(
-                        f"Brak trasy w cache: {loc_i.get('Miasto', 'Start')} → {loc_j.get('Miasto', 'Start')}"
-                    )
+    # Stwórz macierz bezpośrednio z istniejącego cache (jedno wywołanie dla
+    # wszystkich par), zbierając brakujące pary
+    lats = [loc["latitude"] for loc in all_locations]
+    lons = [loc["longitude"] for loc in all_locations]
+    pary = {
+        (i, j): (lats[i], lons[i], lats[j], lons[j])
+        for i in range(n)
+        for j in range(n)
+        if i != j
+    }
+    z_cache = cache_manager.get_routes(list(pary.values()))
 
-                    polyline_coords, distance_km = pobierz_trase(
-                        loc_i["latitude"],
-                        loc_i["longitude"],
-                        loc_j["latitude"],
-                        loc_j["longitude"],
-                    )
+    brakujace = []
+    for key, pair in pary.items():
+        polyline_coords, distance_km = z_cache[pair]
 
-                    if polyline_coords is not None and distance_km is not None:
-                        # Dodaj do cache i do matrycy
-                        cache_manager.add_route(
-                            loc_i["latitude"],
-                            loc_i["longitude"],
-                            loc_j["latitude"],
-                            loc_j["longitude"],
-                            polyline_coords,
-                            distance_km,
-                        )
+        if polyline_coords is not None or distance_km is not None:
+            # Trasa znaleziona w cache
+            distance_matrix[key] = distance_km
+            routes_data[key] = polyline_coords
+        else:
+            print(
+                f"Brak trasy w cache: {all_locations[key[0]].get('Miasto', 'Start')} → {all_locations[key[1]].get('Miasto', 'Start')}"
+            )
+            brakujace.append(key)
+
+    # Brakujące odległości pobieramy z usługi OSRM /table - jedno zapytanie na
+    # fragment macierzy zamiast osobnego zapytania /route dla każdej pary.
+    # Algorytmy TSP potrzebują tylko odległości; geometrię odcinków rysowanych
+    # na mapie pobiera później uzupelnij_trasy_segmentow
+    brakujace_trasy = len(brakujace)
+    if brakujace:
+        print(f"Pobieram macierz odległości dla {brakujace_trasy} brakujących par...")
+        punkty = sorted({idx for key in brakujace for idx in key})
+        pozycja = {idx: k for k, idx in enumerate(punkty)}
+        macierz, z_serwera = pobierz_macierz_odleglosci(
+            [all_locations[idx]["latitude"] for idx in punkty],
+            [all_locations[idx]["longitude"] for idx in punkty],
+            return_mask=True,
+        )
 
-                        key = (i, j)
-                        distance_matrix[key] = distance_km
-                        routes_data[key] = polyline_coords
-                    else:
-                        # Nie udało się pobrać trasy
-                        print(
-                            f"BŁĄD: Nie udało się pobrać trasy {loc_i.get('Miasto', 'Start')} → {loc_j.get('Miasto', 'Start')}"
-                        )
+        for key in brakujace:
+            i, j = pozycja[key[0]], pozycja[key[1]]
+            distance_km = float(macierz[i, j])
+            if np.isfinite(distance_km):
+                distance_matrix[key] = distance_km
+                routes_data[key] = None
+                # Odległość drogowa trafia do cache tras (bez geometrii), aby
+                # zmiana jednej lokalizacji nie wymagała pobierania całej
+                # macierzy; wartości awaryjne nie są zapisywane
+                if z_serwera[i, j]:
+                    cache_manager.add_route(
+                        *pary[key], None, distance_km, auto_save=False
+                    )
+            else:
+                # Nie udało się pobrać trasy
+                loc_i = all_locations[key[0]]
+                loc_j = all_locations[key[1]]
+                print(
+                    f"BŁĄD: Nie udało się pobrać trasy {loc_i.get('Miasto', 'Start')} → {loc_j.get('Miasto', 'Start')}"
+                )
 
     # Przygotuj dane matrycy
     matrix_data = {
@@ -1618,17 +2355,82 @@ def oblicz_macierz_odleglosci(
         "locations": all_locations,
     }
 
-    # Zapisz matrycę do cache
+    # Zapisz matrycę do cache razem z trasami oczekującymi na zapis
     print(
         f"Zapisuję nową matrycę do cache (obliczono tylko {brakujace_trasy} brakujących tras)"
     )
-    cache_manager.add_matrix_entry(matrix_key, matrix_data)
+    cache_manager.add_matrix_entry(matrix_key, matrix_data, auto_save=False)
+    cache_manager.flush()
 
     return matrix_data
 
 
+def uzupelnij_trasy_segmentow(matrix_data, algorithms, offline_mode=False):
+    """
+    Uzupełnia geometrię tras dla odcinków wybranych przez algorytmy
+
+    Odległości z usługi /table nie zawierają punktów trasy - pobieramy je
+    tylko dla odcinków, które trafią na mapę (jedną partią zapytań /route),
+    a w trybie offline jedynie odczytujemy z cache tras.
+
+    Args:
+        matrix_data (dict): Dane macierzy odległości, uzupełniane w miejscu
+        algorithms (dict): Wyniki algorytmów zawierające "daily_segments"
+        offline_mode (bool): Czy używać wyłącznie cache tras
+
+    Returns:
+        int: Liczba odcinków, dla których uzupełniono trasę
+    """
+    locations = matrix_data["locations"]
+    routes = matrix_data["routes"]
+
+    # Odcinki wszystkich algorytmów bez geometrii (każdy tylko raz)
+    brakujace = {}
+    for algo_data in algorithms.values():
+        for day in algo_data["daily_segments"]:
+            for from_idx, to_idx in day["segments"]:
+                key = (from_idx, to_idx)
+                if key in brakujace or routes.get(key) is not None:
+                    continue
+                brakujace[key] = (
+                    locations[from_idx]["latitude"],
+                    locations[from_idx]["longitude"],
+                    locations[to_idx]["latitude"],
+                    locations[to_idx]["longitude"],
+                )
+
+    if not brakujace:
+        return 0
+
+    cache_manager = CacheManager(
+        cache_dir="cache",
+        routes_file="cached_routes.pkl",
+        matrix_file="distance_matrix.pkl",
+    )
+
+    if offline_mode:
+        wyniki = cache_manager.get_routes(list(brakujace.values()))
+    else:
+        print(f"Pobieram trasy dla {len(brakujace)} odcinków rysowanych na mapie...")
+        wyniki = pobierz_trasy(list(dict.fromkeys(brakujace.values())), cache_manager)
+        cache_manager.flush()
+
+    uzupelnione = 0
+    for key, pair in brakujace.items():
+        polyline_coords = wyniki[pair][0]
+        if polyline_coords is not None and len(polyline_coords):
+            routes[key] = polyline_coords
+            uzupelnione += 1
+
+    return uzupelnione
+
+
 def znajdz_najkrotsza_trase_tsp(
-    matrix_data, max_daily_distance=1000, num_threads=8, force_recalculate=False
+    matrix_data,
+    max_daily_distance=1000,
+    num_threads=8,
+    force_recalculate=False,
+    debug_json=False,
 ):
     """
     Znajduje najkrótszą trasę TSP z wykorzystaniem wielowątkowości i cache'owania.
@@ -1639,19 +2441,11 @@ def znajdz_najkrotsza_trase_tsp(
         max_daily_distance (float): Maksymalna dzienna odległość
         num_threads (int): Liczba wątków do przetwarzania równoległego (domyślnie 8)
         force_recalculate (bool): Czy wymusić ponowne obliczenie tras
+        debug_json (bool): Czy obok pliku pickle zapisać wyniki jako czytelny JSON
 
     Returns:
         dict: Wyniki dla wszystkich algorytmów oraz informacja o najlepszym
     """
-    import hashlib
-    import json
-    import os
-    import threading
-    from concurrent.futures import ThreadPoolExecutor
-    from datetime import datetime
-
-    from core.cache_manager import CacheManager
-
     # Inicjalizacja menedżera cache
     cache_manager = CacheManager(
         cache_dir="cache",
@@ -1663,26 +2457,56 @@ def znajdz_najkrotsza_trase_tsp(
     locations = matrix_data["locations"]
     n = len(locations)
 
+    # Słownik {(i, j): km} rozpisany raz na gęstą macierz NxN - algorytmy
+    # odczytują wiersze tablicy zamiast haszować krotkę przy każdym odczycie.
+    # D: brak pary = inf (punkt nieosiągalny), D0: brak pary = 0 (tak jak
+    # dotychczas traktowały brakujące odcinki 2-opt i podział na dni).
+    # Odległości w km mieszczą się w float32 z dokładnością do metrów -
+    # macierz zajmuje połowę pamięci, a sumy liczone są w float64
+    D = np.full((n, n), np.inf, dtype=np.float32)
+    if distances:
+        idx = np.fromiter(
+            (i for key in distances for i in key),
+            dtype=np.intp,
+            count=2 * len(distances),
+        ).reshape(-1, 2)
+        D[idx[:, 0], idx[:, 1]] = np.fromiter(
+            (np.inf if v is None else v for v in distances.values()),
+            dtype=np.float32,
+            count=len(distances),
+        )
+    D0 = np.where(np.isfinite(D), D, 0.0)
+
+    def dlugosc_trasy(path, macierz):
+        nodes = np.asarray(path, dtype=np.intp)
+        return float(macierz[nodes[:-1], nodes[1:]].sum(dtype=np.float64))
+
     # Generowanie klucza cache dla wyników TSP
     def generate_tsp_key():
-        # Bierzemy pod uwagę macierz odległości i max_daily_distance
-        matrix_str = json.dumps(
-            sorted([(f"{k[0]},{k[1]}", v) for k, v in distances.items()])
-        )
-        tsp_data = f"{matrix_str}|{max_daily_distance}|{n}"
-        tsp_key = hashlib.sha256(tsp_data.encode()).hexdigest()
-        return tsp_key
+        # Bierzemy pod uwagę macierz odległości i max_daily_distance - bajty
+        # gęstej macierzy nie zależą od kolejności kluczy słownika, a nie
+        # powstaje ani sortowana lista par, ani wielomegabajtowy tekst JSON
+        hasher = _hasher_klucza(D.tobytes())
+        hasher.update(np.array([max_daily_distance, n], dtype=np.float64).tobytes())
+        return hasher.hexdigest()
 
     # Sprawdź czy mamy już obliczenia w cache, chyba że wymuszono przeliczenie
     tsp_key = generate_tsp_key()
-    tsp_cache_file = f"cache/tsp_results_{tsp_key[:8]}.json"
+    # Wyniki trzymamy w pickle - zagnieżdżone listy ścieżek i segmentów
+    # zapisują się i wczytują wielokrotnie szybciej niż sformatowany JSON
+    tsp_cache_file = f"cache/tsp_results_{tsp_key[:8]}.pkl"
+    tsp_json_file = os.path.splitext(tsp_cache_file)[0] + ".json"
 
-    if not force_recalculate and os.path.exists(tsp_cache_file):
+    if not force_recalculate:
         try:
-            print(f"Znaleziono zapisane wyniki TSP w cache (klucz: {tsp_key[:8]})")
-            with open(tsp_cache_file, "r", encoding="utf-8") as f:
-                cached_results = json.load(f)
-            return cached_results
+            if os.path.exists(tsp_cache_file):
+                print(f"Znaleziono zapisane wyniki TSP w cache (klucz: {tsp_key[:8]})")
+                with open(tsp_cache_file, "rb") as f:
+                    return pickle.load(f)
+            if os.path.exists(tsp_json_file):
+                # Cache zapisany przez starszą wersję programu
+                print(f"Znaleziono zapisane wyniki TSP w JSON (klucz: {tsp_key[:8]})")
+                return _wczytaj_json(tsp_json_file)
         except Exception as e:
             print(f"Błąd podczas ładowania cache TSP: {str(e)}")
 
@@ -1692,161 +2516,56 @@ def znajdz_najkrotsza_trase_tsp(
     def nearest_neighbor():
         print("Uruchamiam algorytm najbliższego sąsiada...")
         path = [0]  # Startujemy z lokalizacji 0 (Nadarzyn)
-        unvisited = set(range(1, n))
-        total_distance = 0
-
-        while unvisited:
-            current = path[-1]
-            nearest = min(
-                unvisited, key=lambda x: distances.get((current, x), float("inf"))
-            )
+        unvisited = np.ones(n, dtype=bool)
+        unvisited[0] = False
 
-            distance = distances.get((current, nearest), float("inf"))
-            total_distance += distance
+        for _ in range(n - 1):
+            row = np.where(unvisited, D[path[-1]], np.inf)
+            nearest = int(np.argmin(row))
+            if not unvisited[nearest]:
+                # Pozostałe punkty są nieosiągalne - bierzemy pierwszy z nich
+                nearest = int(np.flatnonzero(unvisited)[0])
 
             path.append(nearest)
-            unvisited.remove(nearest)
+            unvisited[nearest] = False
 
         # Dodaj powrót do punktu początkowego
-        return_distance = distances.get((path[-1], 0), float("inf"))
-        total_distance += return_distance
         path.append(0)
 
-        return path, total_distance
+        return path, dlugosc_trasy(path, D)
 
-    # 2. Algorytm 2-opt (poprawa rozwiązania zachłannego) - wersja wielowątkowa
+    # 2. Algorytm 2-opt (poprawa rozwiązania zachłannego) - jądro Numba
     def two_opt(path, total_distance):
         print("Uruchamiam algorytm 2-opt dla poprawy rozwiązania...")
-        improved = True
-        best_distance = total_distance
-        best_path = path.copy()
-        path_lock = threading.Lock()
-
-        # Mierzenie czasu wykonania
-        start_time = time.time()
-        iteration_count = 0
-
-        # Równoległy 2-opt na segmentach trasy
-        def process_segment(start_i, end_i, current_path, current_best_distance):
-            local_best_distance = current_best_distance
-            local_best_path = current_path.copy()
-            local_improved = False
-            local_iterations = 0
-
-            for i in range(start_i, min(end_i, len(current_path) - 2)):
-                for j in range(i + 1, len(current_path) - 1):
-                    local_iterations += 1
-                    # Oblicz zmianę odległości przy zamianie krawędzi
-                    a, b = current_path[i - 1], current_path[i]
-                    c, d = current_path[j], current_path[j + 1]
-
-                    current_distance = distances.get((a, b), 0) + distances.get(
-                        (c, d), 0
-                    )
-                    new_distance = distances.get((a, c), 0) + distances.get((b, d), 0)
-
-                    if new_distance < current_distance:
-                        # Tworzymy nową ścieżkę z zamianą
-                        new_path = current_path.copy()
-                        new_path[i : j + 1] = reversed(new_path[i : j + 1])
-
-                        # Oblicz nowy całkowity dystans
-                        new_total = 0
-                        for k in range(len(new_path) - 1):
-                            new_total += distances.get(
-                                (new_path[k], new_path[k + 1]), 0
-                            )
-
-                        if new_total < local_best_distance:
-                            local_best_distance = new_total
-                            local_best_path = new_path.copy()
-                            local_improved = True
-
-            return (
-                local_improved,
-                local_best_path,
-                local_best_distance,
-                local_iterations,
-            )
-
-        # Iteracyjne ulepszanie z wielowątkowością
-        while improved:
-            improved = False
-            iteration_count += 1
-
-            # Wyświetl postęp co 5 iteracji
-            if iteration_count % 5 == 0:
-                elapsed = time.time() - start_time
-                print(
-                    f"2-opt: iteracja {iteration_count}, czas: {elapsed:.2f}s, dystans: {best_distance:.2f} km"
-                )
-
-            # Podziel zakres iteracji na segmenty dla wątków
-            segment_size = max(1, (len(path) - 3) // num_threads)
-            segments = [
-                (i, min(i + segment_size, len(path) - 2))
-                for i in range(1, len(path) - 2, segment_size)
-            ]
-
-            with ThreadPoolExecutor(max_workers=num_threads) as executor:
-                futures = [
-                    executor.submit(process_segment, start, end, path, best_distance)
-                    for start, end in segments
-                ]
 
-                total_local_iterations = 0
-                for future in futures:
-                    local_improved, local_path, local_distance, local_iterations = (
-                        future.result()
-                    )
-                    total_local_iterations += local_iterations
-
-                    if local_improved and local_distance < best_distance:
-                        with path_lock:
-                            best_distance = local_distance
-                            best_path = local_path.copy()
-                            path = local_path.copy()
-                            improved = True
-                            print(
-                                f"Znaleziono lepsze rozwiązanie: {best_distance:.2f} km"
-                            )
-
-            # Jeśli długo nie ma poprawy (ponad 20 iteracji), kończymy
-            if iteration_count > 20 and not improved:
-                print(
-                    f"Przerwano optymalizację po {iteration_count} iteracjach bez poprawy"
-                )
-                break
-
-        total_time = time.time() - start_time
-        print(
-            f"Zakończono 2-opt po {iteration_count} iteracjach, czas: {total_time:.2f}s"
+        # Równoległe (prange) przebiegi best improvement na macierzy D0 -
+        # każda para krawędzi oceniana w O(1), bez przeliczania całej trasy
+        # i bez kopiowania ścieżki dla kandydatów; długość wyniku to długość
+        # początkowa plus suma zmian zaakceptowanych ruchów
+        best_path, best_distance, total_time = run_two_opt_directed(
+            path, dlugosc_trasy(path, D0), D0, num_threads
         )
-        return best_path, best_distance
+
+        print(f"Zakończono 2-opt, czas: {total_time:.2f}s")
+        if best_distance < total_distance:
+            print(f"Znaleziono lepsze rozwiązanie: {best_distance:.2f} km")
+            return best_path, best_distance
+        return path, total_distance
 
     # 3. Algorytm przybliżony oparty na MST (Minimum Spanning Tree)
     def mst_approx():
         print("Uruchamiam algorytm oparty na MST...")
         start_time = time.time()
 
-        # Tworzenie grafu
-        G = nx.Graph()
-        for i in range(n):
-            for j in range(i + 1, n):
-                dist = distances.get((i, j), float("inf"))
-                G.add_edge(i, j, weight=dist)
-
-        # Znajdź MST
-        mst = nx.minimum_spanning_tree(G)
-
-        # Wykonaj przejście DFS po MST
-        path = list(nx.dfs_preorder_nodes(mst, source=0))
-        path.append(0)  # Powrót do początku
+        # MST i przejście DFS (pre-order) w SciPy (csgraph) bezpośrednio na
+        # macierzy. csgraph traktuje inf jako brak krawędzi, więc brakujące
+        # pary dostają wagę tak dużą, że suma n takich krawędzi nie przekracza
+        # zakresu typu macierzy - graf pozostaje pełny
+        weights = np.where(np.isfinite(D), D, np.finfo(D.dtype).max / max(n, 1))
+        path, _, _ = run_mst(weights, n)
 
         # Oblicz całkowity dystans
-        total_distance = 0
-        for i in range(len(path) - 1):
-            total_distance += distances.get((path[i], path[i + 1]), float("inf"))
+        total_distance = dlugosc_trasy(path, D)
 
         total_time = time.time() - start_time
         print(f"Zakończono MST w {total_time:.2f}s")
@@ -1867,48 +2586,59 @@ def znajdz_najkrotsza_trase_tsp(
             f"Algorytm najbliższego sąsiada zakończony: {nn_distance:.2f} km, czas: {nn_time:.2f}s"
         )
 
-        opt_start_time = time.time()
-        opt_future = executor.submit(two_opt, nn_path.copy(), nn_distance)
+        # Podział na dni liczy się w puli równolegle z 2-opt i MST
+        nn_days_future = executor.submit(
+            podziel_trase_na_dni, nn_path, D0, max_daily_distance
+        )
 
-        # Pobierz pozostałe wyniki
-        opt_path, opt_distance = opt_future.result()
+        # 2-opt w wątku głównym - równoległe jądro Numba wywołane z wątku
+        # roboczego blokuje zamknięcie interpretera (warstwa workqueue);
+        # jądro zwalnia GIL, więc MST liczy się w tym czasie w puli
+        opt_start_time = time.time()
+        opt_path, opt_distance = two_opt(nn_path, nn_distance)
         opt_time = time.time() - opt_start_time
         print(
             f"Algorytm 2-opt zakończony: {opt_distance:.2f} km, czas: {opt_time:.2f}s"
         )
 
+        # Pobierz pozostałe wyniki
         mst_path, mst_distance = mst_future.result()
         mst_time = time.time() - start_total_time
         print(f"Algorytm MST zakończony: {mst_distance:.2f} km, czas: {mst_time:.2f}s")
 
-    # Dodaj podział tras na dni
-    print("Dzielę trasy na dni...")
+        # Dodaj podział tras na dni - trasy 2-opt bez poprawy względem NN
+        # nie dzielimy drugi raz
+        print("Dzielę trasy na dni...")
+        mst_days_future = executor.submit(
+            podziel_trase_na_dni, mst_path, D0, max_daily_distance
+        )
+        nn_days = nn_days_future.result()
+        if opt_path == nn_path:
+            opt_days = nn_days
+        else:
+            opt_days = podziel_trase_na_dni(opt_path, D0, max_daily_distance)
+        mst_days = mst_days_future.result()
 
-    # Wyniki dla wszystkich algorytmów
+    # Wyniki dla wszystkich algorytmów (ścieżki nie są dalej modyfikowane,
+    # więc trafiają do wyników bez kopiowania)
     algorithms = {
         "Najbliższy sąsiad": {
-            "path": nn_path.copy(),
+            "path": nn_path,
             "distance": nn_distance,
             "time": nn_time,
-            "daily_segments": podziel_trase_na_dni(
-                nn_path, distances, max_daily_distance
-            ),
+            "daily_segments": nn_days,
         },
         "Najbliższy sąsiad + 2-opt": {
-            "path": opt_path.copy(),
+            "path": opt_path,
             "distance": opt_distance,
             "time": opt_time + nn_time,  # Całkowity czas to NN + 2-opt
-            "daily_segments": podziel_trase_na_dni(
-                opt_path, distances, max_daily_distance
-            ),
+            "daily_segments": opt_days,
         },
         "MST": {
-            "path": mst_path.copy(),
+            "path": mst_path,
             "distance": mst_distance,
             "time": mst_time,
-            "daily_segments": podziel_trase_na_dni(
-                mst_path, distances, max_daily_distance
-            ),
+            "daily_segments": mst_days,
         },
     }
 
@@ -1940,9 +2670,14 @@ def znajdz_najkrotsza_trase_tsp(
     # Zapisz wyniki do cache
     try:
         os.makedirs("cache", exist_ok=True)
-        with open(tsp_cache_file, "w", encoding="utf-8") as f:
-            json.dump(results, f, indent=2, ensure_ascii=False)
+        with open(tsp_cache_file, "wb") as f:
+            pickle.dump(results, f, protocol=5)
         print(f"Zapisano wyniki TSP do cache: {tsp_cache_file}")
+
+        if debug_json:
+            with open(tsp_json_file, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2, ensure_ascii=False)
+            print(f"Zapisano czytelną kopię wyników TSP: {tsp_json_file}")
     except Exception as e:
         print(f"Błąd podczas zapisywania cache TSP: {str(e)}")
 
@@ -1972,58 +2707,17 @@ def generuj_kolory_dla_dni(num_days, algorithm_name="default"):
     return colors[:num_days]
 
 
-def podziel_trase_na_dni(path, distances, max_daily_distance):
-    """
-    Dzieli trasę na segmenty dzienne według maksymalnej odległości dziennej
-
-    Args:
-        path (list): Ścieżka z punktami trasy
-        distances (dict): Słownik z odległościami między punktami
-        max_daily_distance (float): Maksymalna dzienna odległość
-
-    Returns:
-        list: Lista słowników z segmentami dziennymi
-    """
-    daily_segments = []
-    current_day = []
-    current_distance = 0
-
-    for i in range(len(path) - 1):
-        from_idx = path[i]
-        to_idx = path[i + 1]
-
-        segment_distance = distances.get((from_idx, to_idx), 0)
-
-        # Sprawdź, czy dodanie tego segmentu nie przekroczy dziennego limitu
-        if current_distance + segment_distance <= max_daily_distance:
-            current_day.append((from_idx, to_idx))
-            current_distance += segment_distance
-        else:
-            # Zapisz obecny dzień i rozpocznij nowy
-            daily_segments.append(
-                {"segments": current_day, "distance": current_distance}
-            )
-
-            current_day = [(from_idx, to_idx)]
-            current_distance = segment_distance
-
-    # Dodaj ostatni dzień
-    if current_day:
-        daily_segments.append({"segments": current_day, "distance": current_distance})
-
-    return daily_segments
-
-
 def sprawdz_dostepnosc_serwerow_osrm():
     """
     Sprawdza dostępność różnych serwerów OSRM równolegle z poprawionymi adresami URL
 
+    Zapytania idą przez współdzieloną sesję z puli keep-alive, a serwer, który
+    odpowiedział poprawnie w ciągu ostatnich OSRM_PROBE_CACHE_TTL sekund,
+    nie jest sprawdzany ponownie - używany jest zapamiętany czas odpowiedzi.
+
     Returns:
         list: Lista działających serwerów OSRM
     """
-    import time
-    from concurrent.futures import ThreadPoolExecutor, as_completed
-
     # Poprawiona lista serwerów z protokołem HTTPS
     osrm_servers = [
         "https://routing.openstreetmap.de",  # używamy tylko HTTPS
@@ -2036,10 +2730,16 @@ def sprawdz_dostepnosc_serwerow_osrm():
     print("Sprawdzanie dostępności serwerów OSRM (równolegle)...")
 
     def check_server(server):
+        ostatnie = _osrm_probe_cache.get(server)
+        if ostatnie and time.time() - ostatnie[0] < OSRM_PROBE_CACHE_TTL:
+            czas_odpowiedzi[server] = ostatnie[1]
+            print(f"Serwer {server} działa poprawnie (wynik z cache).")
+            return server
+
         try:
             start_time = time.time()
             # Poprawione zapytanie zgodne z API OSRM
-            response = requests.get(
+            response = get_session().get(
                 f"{server}/route/v1/driving/21.017532,52.237049;21.017532,52.237049?overview=full",
                 timeout=20,  # zwiększony timeout
             )
@@ -2050,6 +2750,7 @@ def sprawdz_dostepnosc_serwerow_osrm():
                     data = response.json()
                     if "routes" in data:
                         czas_odpowiedzi[server] = end_time - start_time
+                        _osrm_probe_cache[server] = (end_time, czas_odpowiedzi[server])
                         print(f"Serwer {server} działa poprawnie.")
                         return server
                 except Exception as e:
@@ -2097,9 +2798,6 @@ def ustaw_serwery_osrm(serwery):
         bool: True jeśli operacja się powiodła
     """
     try:
-        # Importujemy moduł config
-        import config
-
         # Ustawiamy nową listę serwerów
         config.OSRM_SERVERS = serwery
 
@@ -2117,8 +2815,6 @@ def odświeżaj_serwery_osrm(interval=300):
     Args:
         interval (int): Interwał czasu między sprawdzeniami w sekundach
     """
-    import threading
-    import time
 
     def sprawdzaj_okresowo():
         while True:
@@ -2191,8 +2887,6 @@ def verify_and_cleanup_cache(json_file_path="Tabela.json", offline_mode=False):
     Returns:
         tuple: (is_valid, cleanup_count) - czy cache jest poprawny i ilość usuniętych plików
     """
-    from core.cache_manager import CacheManager
-
     print("Weryfikacja i porządkowanie plików cache...")
 
     # Inicjalizacja menedżera cache
@@ -2258,9 +2952,16 @@ if __name__ == "__main__":
         action="store_true",
         help="Uruchom w trybie offline (tylko z cache)",
     )
+    parser.add_argument(
+        "--debug-json",
+        action="store_true",
+        help="Zapisz wyniki TSP dodatkowo jako czytelny plik JSON",
+    )
 
     args = parser.parse_args()
 
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
     # Ścieżki do plików
     json_file = args.json_file
     excel_file = args.excel_file
@@ -2344,11 +3045,10 @@ if __name__ == "__main__":
             show_route,
             offline_mode=offline_mode,
             force_recalculate=need_recalculation,
+            debug_json=args.debug_json,
         )
 
         # Wykonaj końcowe czyszczenie katalogu cache
-        from core.cache_manager import CacheManager
-
         cache_manager = CacheManager()
         cleaned = cache_manager.cleanup_cache_directory()
         print(f"Zakończono porządkowanie katalogu cache. Usunięto {cleaned} plików.")
@@ -0,0 +1,42 @@
+import math
+
+from create_JSON import _inicjalizuj_nan, _wczytaj_json, _zapisz_json
+
+
+def test_inicjalizuj_nan_zeruje_tylko_braki():
+    data = [
+        {"latitude": float("nan"), "longitude": "52,2297"},
+        {"latitude": "nan", "longitude": 21.0122},
+        {"latitude": 52.2297, "longitude": 21.0122},
+    ]
+
+    _inicjalizuj_nan(data)
+
+    assert data[0] == {"latitude": None, "longitude": "52,2297"}
+    assert data[1] == {"latitude": None, "longitude": 21.0122}
+    assert data[2] == {"latitude": 52.2297, "longitude": 21.0122}
+
+
+def test_inicjalizuj_nan_pomija_brakujace_klucze():
+    data = [{"latitude": math.nan}]
+
+    _inicjalizuj_nan(data)
+
+    assert data == [{"latitude": None}]
+
+
+def test_wczytaj_json_pusty_plik(tmp_path):
+    json_file = tmp_path / "pusty.json"
+    json_file.write_bytes(b"")
+
+    assert _wczytaj_json(str(json_file)) == []
+    assert _wczytaj_json(str(json_file), domyslnie={}) == {}
+
+
+def test_zapisz_i_wczytaj_json(tmp_path):
+    json_file = str(tmp_path / "dane.json")
+    data = [{"Miasto": "Łódź", "latitude": 51.7592, "longitude": 19.456}]
+
+    _zapisz_json(json_file, data)
+
+    assert _wczytaj_json(json_file) == data
@@ -0,0 +1,49 @@
+import orjson
+
+from create_JSON import _Dziennik, _odtworz_z_dziennika, _plik_dziennika
+
+
+def _dane(n):
+    return [
+        {"pełny_adres": f"Adres {i}", "latitude": None, "longitude": None}
+        for i in range(n)
+    ]
+
+
+def _wpis(i):
+    return {"pełny_adres": f"Adres {i}", "latitude": 50.0 + i, "longitude": 20.0 + i}
+
+
+def test_odtworzenie_po_przerwanym_wpisie(tmp_path):
+    json_file = str(tmp_path / "dane.json")
+    plik = _plik_dziennika(json_file)
+
+    # Pierwszy przebieg: wpis 0 zapisany, wpis 1 przerwany w połowie
+    with _Dziennik(json_file) as dziennik:
+        dziennik.dopisz(0, _wpis(0))
+    with open(plik, "ab") as f:
+        f.write(orjson.dumps({"idx": 1, "adres": "Adres 1"})[:10])
+
+    data = _dane(3)
+    assert _odtworz_z_dziennika(json_file, data) == 1
+
+    # Drugi przebieg dopisuje kolejne wpisy za obciętym fragmentem
+    with _Dziennik(json_file) as dziennik:
+        dziennik.dopisz(1, _wpis(1))
+        dziennik.dopisz(2, _wpis(2))
+
+    data = _dane(3)
+    assert _odtworz_z_dziennika(json_file, data) == 3
+    assert [item["latitude"] for item in data] == [50.0, 51.0, 52.0]
+
+
+def test_wpis_bez_konca_linii_jest_obcinany(tmp_path):
+    json_file = str(tmp_path / "dane.json")
+    plik = _plik_dziennika(json_file)
+    with open(plik, "wb") as f:
+        f.write(orjson.dumps({"idx": 0, "adres": "Adres 0", "lat": 1.0, "lng": 2.0}))
+
+    data = _dane(1)
+    assert _odtworz_z_dziennika(json_file, data) == 0
+    with open(plik, "rb") as f:
+        assert f.read() == b""
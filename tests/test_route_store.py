@@ -0,0 +1,37 @@
+import threading
+
+import numpy as np
+
+from core.cache_manager import _RouteStore
+
+
+def _trasa(i):
+    return np.array([[50.0, 20.0 + i], [50.1, 20.1 + i]]), 1.0 + i
+
+
+def _w_watku(fn):
+    wynik = []
+    watek = threading.Thread(target=lambda: wynik.append(fn()))
+    watek.start()
+    watek.join()
+    return wynik[0]
+
+
+def test_odczyt_z_innego_watku_przed_i_po_commit(tmp_path):
+    store = _RouteStore(str(tmp_path / "routes.db"), max_entries=1)
+    klucze = [(50.0, 20.0 + i, 50.1, 20.1 + i) for i in range(3)]
+    try:
+        store.update({klucz: _trasa(i) for i, klucz in enumerate(klucze)})
+
+        # Niezatwierdzone trasy spoza bufora LRU nadal są widoczne
+        znalezione = _w_watku(lambda: store.get_many(klucze))
+        assert set(znalezione) == set(klucze)
+
+        store.commit()
+        store._front.clear()
+        coords, distance_km = _w_watku(lambda: store.get(klucze[0]))
+        np.testing.assert_array_equal(coords, _trasa(0)[0])
+        assert distance_km == 1.0
+        assert _w_watku(lambda: store.get((0.0, 0.0, 0.0, 0.0))) is None
+    finally:
+        store.close()